@@ -1,8 +1,10 @@
 import datetime
 import json
 import os
+import shutil
 import traceback
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 
 import dotenv
 import requests
@@ -32,6 +34,13 @@ from bs4 import BeautifulSoup
 from functools import wraps
 
 from error import bad_request
+from index_cache import IndexCache
+from index_loader import DOCSTORE_FILE, INDEX_FILE, MMAP_ZERO_COPY, lazy_files, load_store, save_atomic
+from lazy_docstore import DOCSTORE_DB, convert_docstore
+from parser.checkpoint import is_transient_error
+from parser.index_factory import INDEX_PARAMS_FILE, VECTORS_FILE
+from parser.index_shards import SHARDS_DIR, SHARDS_FILE, ShardLayout, is_sharded, publish_layout, shard_path
+from parser.index_manifest import MANIFEST_FILE
 from worker import ingest_worker
 import celeryconfig
 
@@ -106,6 +115,20 @@ vectors_collection = db["vectors"]
 users = db['users']
 fs = GridFS(db)
 
+# index.faiss is memory-mapped read-only, so gunicorn workers share one copy of each index in the page cache
+INDEX_MMAP = os.getenv("INDEX_MMAP", "true").lower() in ("true", "1", "yes")
+if INDEX_MMAP and not MMAP_ZERO_COPY:
+    print("INDEX_MMAP: this faiss build cannot map flat indexes, each worker loads its own copy")
+# chunks are read from docstore.sqlite when a search returns them, instead of unpickling all of index.pkl
+INDEX_LAZY_DOCSTORE = os.getenv("INDEX_LAZY_DOCSTORE", "true").lower() in ("true", "1", "yes")
+# shards of sharded indexes are searched concurrently, faiss releases the GIL while searching
+shard_search_pool = ThreadPoolExecutor(max_workers=int(os.getenv("INDEX_SEARCH_THREADS", str(os.cpu_count() or 1))))
+# loaded vector stores are kept in memory between requests, INDEX_CACHE_MB sets the budget per process
+# and INDEX_CACHE_ENTRIES the number of stores, which bounds stores that are read from disk on demand
+index_cache = IndexCache(max_bytes=int(os.getenv("INDEX_CACHE_MB", "1024")) * 1024 * 1024,
+                         lazy_files=lazy_files(INDEX_MMAP, INDEX_LAZY_DOCSTORE),
+                         max_entries=int(os.getenv("INDEX_CACHE_ENTRIES", "64")))
+
 
 def async_generate(chain, question, chat_history):
     result = chain({"question": question, "chat_history": chat_history})
@@ -125,6 +148,25 @@ def run_async_chain(chain, question, chat_history):
     return result
 
 
+def get_embeddings(embeddings_key):
+    if embeddings_choice == "openai_text-embedding-ada-002":
+        return OpenAIEmbeddings(openai_api_key=embeddings_key)
+    elif embeddings_choice == "huggingface_sentence-transformers/all-mpnet-base-v2":
+        return HuggingFaceHubEmbeddings()
+    elif embeddings_choice == "huggingface_hkunlp/instructor-large":
+        return HuggingFaceInstructEmbeddings()
+    elif embeddings_choice == "cohere_medium":
+        return CohereEmbeddings(cohere_api_key=embeddings_key)
+
+
+def load_vectorstore(vectorstore, embeddings):
+    store = index_cache.get(vectorstore, lambda path: load_store(path, embeddings, mmap=INDEX_MMAP,
+                                                                 lazy_docstore=INDEX_LAZY_DOCSTORE,
+                                                                 executor=shard_search_pool))
+    # the cached store is shared between requests, so bind this request's embeddings to a new wrapper
+    return FAISS(embeddings.embed_query, store.index, store.docstore, store.index_to_docstore_id)
+
+
 def extract_metadata(metadata):
     result = {}
     path, filename = os.path.split(metadata['source'])
@@ -160,9 +202,15 @@ def validate_user_id(func):
     return wrapper
 
 
-@celery.task(bind=True, name="app.ingest")
-def ingest(self, directory, formats, name_job, filename, user):
-    resp = ingest_worker(self, directory, formats, name_job, filename, user)
+@celery.task(bind=True, name="app.ingest", max_retries=3)
+def ingest(self, directory, formats, name_job, filename, user, incremental=False):
+    try:
+        resp = ingest_worker(self, directory, formats, name_job, filename, user, incremental)
+    except Exception as e:
+        if not is_transient_error(e):
+            raise
+        # embedding progress is checkpointed, so the retry resumes where this attempt stopped
+        raise self.retry(exc=e, countdown=60)
     return resp
 
 
@@ -229,18 +277,7 @@ def api_answer():
         # vectorstore = "outputs/inputs/"
         # loading the index and the store and the prompt template
         # Note if you have used other embeddings than OpenAI, you need to change the embeddings
-        if embeddings_choice == "openai_text-embedding-ada-002":
-            docsearch = FAISS.load_local(
-                vectorstore, OpenAIEmbeddings(openai_api_key=embeddings_key))
-        elif embeddings_choice == "huggingface_sentence-transformers/all-mpnet-base-v2":
-            docsearch = FAISS.load_local(
-                vectorstore, HuggingFaceHubEmbeddings())
-        elif embeddings_choice == "huggingface_hkunlp/instructor-large":
-            docsearch = FAISS.load_local(
-                vectorstore, HuggingFaceInstructEmbeddings())
-        elif embeddings_choice == "cohere_medium":
-            docsearch = FAISS.load_local(
-                vectorstore, CohereEmbeddings(cohere_api_key=embeddings_key))
+        docsearch = load_vectorstore(vectorstore, get_embeddings(embeddings_key))
 
         # create a prompt template
         if history:
@@ -427,6 +464,8 @@ def upload_file():
     if 'name' not in request.form:
         return {"status": 'no name'}
     job_name = secure_filename(request.form['name'])
+    # only re-embed files that changed since the last upload of this job
+    incremental = request.form.get('incremental', 'false').lower() == 'true'
     # check if the post request has the file part
     if 'file' not in request.files:
         print('No file part')
@@ -451,7 +490,7 @@ def upload_file():
         print("Size of file is :", file.tell(), "bytes")
         print('save the file into: ' + os.path.join(save_dir, filename))
         task = ingest.delay(
-            'temp', [".rst", ".md", ".pdf", ".html"], job_name, filename, user)
+            'temp', [".rst", ".md", ".pdf", ".html"], job_name, filename, user, incremental)
         # task id
         task_id = task.id
         return {"status": 'ok', "task_id": task_id}
@@ -571,12 +610,49 @@ def upload_index_files():
     if file_pkl.filename == '':
         return {"status": 'no file name'}
 
-    # saves index files
+    # saves index files, in the folder of the shard for the shards of a sharded index
     save_dir = os.path.join('indexes', user, job_name)
-    if not os.path.exists(save_dir):
-        os.makedirs(save_dir)
-    file_faiss.save(os.path.join(save_dir, 'index.faiss'))
-    file_pkl.save(os.path.join(save_dir, 'index.pkl'))
+    index_dir = save_dir
+    if 'shard' in request.form:
+        if not request.form['shard'].isdigit():
+            return {"status": 'bad shard'}
+        # shards are uploaded into a new version, readers keep using the current one until it is published
+        version = secure_filename(request.form.get('shard_version', ''))
+        if not version or version.isdigit():
+            return {"status": 'bad shard version'}
+        index_dir = shard_path(save_dir, int(request.form['shard']), version)
+    if not os.path.exists(index_dir):
+        os.makedirs(index_dir)
+    # files are replaced by a rename, workers that mapped the previous index keep reading it until they reload
+    save_atomic(file_faiss, os.path.join(index_dir, 'index.faiss'))
+    save_atomic(file_pkl, os.path.join(index_dir, 'index.pkl'))
+    if 'file_manifest' in request.files:
+        save_atomic(request.files['file_manifest'], os.path.join(save_dir, MANIFEST_FILE))
+    for field, name in (('file_params', INDEX_PARAMS_FILE), ('file_vectors', VECTORS_FILE)):
+        if field in request.files:
+            save_atomic(request.files[field], os.path.join(index_dir, name))
+        elif os.path.exists(os.path.join(index_dir, name)):
+            # the files of a previous index do not apply to this one
+            os.remove(os.path.join(index_dir, name))
+    if INDEX_LAZY_DOCSTORE:
+        convert_docstore(index_dir)
+    if 'file_shards' in request.files:
+        # the layout is sent with the last shard, publishing it switches readers to the new version at once
+        staged = os.path.join(save_dir, f".{SHARDS_FILE}.{version}")
+        save_atomic(request.files['file_shards'], staged)
+        try:
+            publish_layout(save_dir, staged)
+        except FileNotFoundError as e:
+            os.remove(staged)
+            print(e)
+            return {"status": 'missing shard'}
+        remove_unused_index_files(save_dir)
+    elif 'shard' in request.form:
+        # the current version is unchanged until the layout arrives
+        return {"status": 'ok'}
+    else:
+        remove_unused_index_files(save_dir)
+    index_cache.invalidate(save_dir)
     # create entry in vectors_collection
     # Check if a document with the same filename exists
     existing_document = vectors_collection.find_one(
@@ -610,6 +686,30 @@ def upload_index_files():
     return {"status": 'ok'}
 
 
+def remove_unused_index_files(save_dir):
+    """Remove the files of the previous index in save_dir that the new one does not use.
+
+    A sharded index does not use the files of a single index, its previous
+    versions are removed by `publish_layout`, and a single index does not
+    use shards.
+    """
+    if is_sharded(save_dir):
+        for name in (INDEX_FILE, DOCSTORE_FILE, INDEX_PARAMS_FILE, VECTORS_FILE, DOCSTORE_DB):
+            if os.path.exists(os.path.join(save_dir, name)):
+                os.remove(os.path.join(save_dir, name))
+    else:
+        if os.path.exists(os.path.join(save_dir, SHARDS_FILE)):
+            os.remove(os.path.join(save_dir, SHARDS_FILE))
+        if os.path.exists(os.path.join(save_dir, SHARDS_DIR)):
+            shutil.rmtree(os.path.join(save_dir, SHARDS_DIR))
+
+
+@app.route('/api/index_cache_stats', methods=['GET'])
+def index_cache_stats():
+    """Get hit/miss/eviction counters of this worker's index cache."""
+    return index_cache.stats()
+
+
 @app.route('/api/download', methods=['get'])
 def download_file():
     user = secure_filename(request.args.get('user'))
@@ -619,6 +719,23 @@ def download_file():
     return send_from_directory(save_dir, filename, as_attachment=True)
 
 
+@app.route('/api/download_index', methods=['get'])
+def download_index_file():
+    """Serve the files of an existing index, used by incremental ingestion."""
+    user = secure_filename(request.args.get('user'))
+    job_name = secure_filename(request.args.get('name'))
+    filename = request.args.get('file')
+    if filename not in ['index.faiss', 'index.pkl', MANIFEST_FILE, VECTORS_FILE, SHARDS_FILE]:
+        return {"status": 'error'}, 400
+    save_dir = os.path.join('indexes', user, job_name)
+    shard = request.args.get('shard')
+    if shard is not None:
+        if not shard.isdigit() or not is_sharded(save_dir):
+            return {"status": 'error'}, 400
+        save_dir = shard_path(save_dir, int(shard), ShardLayout.load(save_dir).version)
+    return send_from_directory(save_dir, filename, as_attachment=True)
+
+
 @app.route('/api/delete_old', methods=['get'])
 def delete_old():
     """Delete old indexes."""
@@ -633,6 +750,7 @@ def delete_old():
         return {"status": 'error'}
     path_clean = '/'.join(dirs)
     vectors_collection.delete_one({'location': path})
+    index_cache.invalidate(path_clean)
     try:
         print('deleting ' + path_clean)
         shutil.rmtree(path_clean)
@@ -0,0 +1,57 @@
+"""Search benchmark of the index types of `parser.index_factory`.
+
+Builds a flat, an IVF and an HNSW index over clustered random vectors of
+the size of OpenAI embeddings, and reports build time, search latency and
+recall@10 against exact search for a few values of `nprobe`/`efSearch`.
+
+Run from the application folder:
+    python -m benchmarks.ann_bench [number of vectors]
+"""
+import sys
+import time
+
+import faiss
+import numpy as np
+
+from parser.index_factory import build_index, choose_factory, set_search_params
+
+DIM = 1536
+QUERIES = 200
+K = 10
+
+
+def make_vectors(n, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(n // 500, 1), DIM)).astype(np.float32)
+    vectors = centers[rng.integers(0, len(centers), n)] + 0.5 * rng.normal(size=(n, DIM)).astype(np.float32)
+    queries = vectors[rng.integers(0, n, QUERIES)] + 0.1 * rng.normal(size=(QUERIES, DIM)).astype(np.float32)
+    return vectors, queries
+
+
+def recall(found, truth):
+    return np.mean([len(set(a) & set(b)) / K for a, b in zip(found, truth)])
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    vectors, queries = make_vectors(n)
+    truth = None
+    for factory, sweep in [("Flat", [{}]),
+                           (choose_factory(n, min_vectors=0), [{"nprobe": p} for p in (8, 32, 128)]),
+                           ("HNSW32", [{"efSearch": ef} for ef in (16, 64, 256)])]:
+        start = time.perf_counter()
+        index = build_index(vectors, factory)
+        build = time.perf_counter() - start
+        for params in sweep:
+            set_search_params(index, params)
+            start = time.perf_counter()
+            _, found = index.search(queries, K)
+            latency = (time.perf_counter() - start) / QUERIES * 1000
+            truth = found if truth is None else truth
+            print(f"{factory:>14} {str(params):>18}: build {build:6.1f}s, "
+                  f"{latency:7.3f} ms/query, recall@{K} {recall(found, truth):.3f}")
+
+
+if __name__ == "__main__":
+    faiss.omp_set_num_threads(1)
+    main()
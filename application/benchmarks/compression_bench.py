@@ -0,0 +1,61 @@
+"""Recall and memory benchmark of compressed indexes.
+
+Builds an index of clustered random vectors of the size of OpenAI
+embeddings for every `INDEX_COMPRESSION` setting, and reports the memory
+taken by the index, search latency and recall@10 against exact search,
+without re-ranking and re-ranking 4 and 16 times more candidates against
+the full precision vectors, memory-mapped from disk as in the app.
+
+Run from the application folder:
+    python -m benchmarks.compression_bench [number of vectors] [--ivf]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+from benchmarks.ann_bench import K, QUERIES, make_vectors, recall
+from parser.index_factory import (COMPRESSIONS, DEFAULT_NPROBE, RerankedIndex, build_index,
+                                  choose_factory, default_search_params, set_search_params)
+
+
+def index_bytes(index):
+    return faiss.serialize_index(index).size
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    n = int(args[0]) if args else 100000
+    # flat encodings unless --ivf, to compare compression alone
+    min_vectors = 0 if "--ivf" in sys.argv else n + 1
+    vectors, queries = make_vectors(n)
+    _, truth = build_index(vectors, "Flat").search(queries, K)
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "vectors.npy")
+        np.save(path, vectors)
+        mapped = np.load(path, mmap_mode="r")
+        print(f"{n} vectors, full precision vectors on disk: {os.path.getsize(path) / 2 ** 20:.0f} MB")
+        for compression in COMPRESSIONS:
+            factory = choose_factory(n, "auto", min_vectors, compression, vectors.shape[1])
+            start = time.perf_counter()
+            index = build_index(vectors, factory)
+            build = time.perf_counter() - start
+            set_search_params(index, default_search_params(index, nprobe=DEFAULT_NPROBE))
+            size = index_bytes(index)
+            for rerank in (1, 4, 16):
+                searched = index if rerank == 1 else RerankedIndex(index, mapped, rerank)
+                start = time.perf_counter()
+                _, found = searched.search(queries, K)
+                latency = (time.perf_counter() - start) / QUERIES * 1000
+                print(f"{compression:>5} {factory:>16} rerank {rerank:>2}: {size / 2 ** 20:7.1f} MB "
+                      f"({size / n:6.0f} B/vector), build {build:5.1f}s, {latency:6.2f} ms/query, "
+                      f"recall@{K} {recall(found, truth):.3f}")
+
+
+if __name__ == "__main__":
+    faiss.omp_set_num_threads(1)
+    main()
@@ -0,0 +1,69 @@
+"""Throughput benchmark of the HTML sectionizer.
+
+Generates large Sphinx-like HTML pages (nested sections with anchors,
+permalinks, code blocks and lists) and reports how many MB per second
+`HTMLParser` turns into sections. For reference it also times
+`BSHTMLLoader` on the same file, which the previous parser ran (and threw
+away) before parsing the page a second time with unstructured.
+
+Run from the application folder:
+    python -m benchmarks.html_bench
+"""
+import os
+import random
+import tempfile
+import time
+
+from langchain.document_loaders import BSHTMLLoader
+
+from parser.file.html_parser import HTMLParser
+
+WORDS = ["index", "vector", "query", "document", "token", "parser", "embedding", "section",
+         "header", "chunk", "faiss", "upload", "answer", "source", "model", "worker"]
+
+
+def make_html(size_mb, seed=0):
+    rng = random.Random(seed)
+    parts = ["<html><head><title>Benchmark docs</title><script>var x = 1;</script></head><body>"]
+    size = 0
+    section = 0
+    while size < size_mb * 1024 * 1024:
+        level = rng.choice([1, 2, 2, 3, 3, 3])
+        html = [f'<section id="s{section}"><h{level}>Section {section}'
+                f'<a class="headerlink" href="#s{section}">¶</a></h{level}>']
+        for _ in range(rng.choice([2, 5, 20])):
+            words = [rng.choice(WORDS) for _ in range(16)]
+            words[3] = f'<a href="#s{rng.randrange(section + 1)}">{words[3]}</a>'
+            words[9] = f"<code>{words[9]}</code>"
+            html.append(f"<p>{' '.join(words)}</p>")
+        html.append("<ul>" + "".join(f"<li>{rng.choice(WORDS)}</li>" for _ in range(5)) + "</ul>")
+        html.append("<pre>run --the command</pre></section>\n")
+        text = "".join(html)
+        parts.append(text)
+        size += len(text)
+        section += 1
+    parts.append("</body></html>")
+    return "".join(parts)
+
+
+def main():
+    parser = HTMLParser()
+    print(f"{'MB':>6} {'sections':>9} {'sectionizer MB/s':>17} {'BSHTMLLoader MB/s':>18}")
+    for size_mb in (1, 4, 16):
+        with tempfile.NamedTemporaryFile("w", suffix=".html", delete=False, encoding="utf-8") as f:
+            f.write(make_html(size_mb))
+        try:
+            megabytes = os.path.getsize(f.name) / (1024 * 1024)
+            start = time.perf_counter()
+            docs = parser.parse_file(f.name)
+            elapsed = time.perf_counter() - start
+            start = time.perf_counter()
+            BSHTMLLoader(f.name, open_encoding="utf-8").load()
+            soup = time.perf_counter() - start
+        finally:
+            os.remove(f.name)
+        print(f"{megabytes:>6.1f} {len(docs):>9} {megabytes / elapsed:>17.1f} {megabytes / soup:>18.1f}")
+
+
+if __name__ == "__main__":
+    main()
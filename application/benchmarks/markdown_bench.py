@@ -0,0 +1,86 @@
+"""Throughput benchmark of the markdown sectionizer.
+
+Generates multi-MB markdown files with nested headers, links, images and
+inline HTML, and reports how many MB per second `MarkdownParser` turns
+into sections, next to the previous line-concatenating implementation.
+
+Run from the application folder:
+    python -m benchmarks.markdown_bench
+"""
+import random
+import re
+import time
+
+from parser.file.markdown_parser import MarkdownParser
+from parser.token_func import get_encoding
+
+WORDS = ["index", "vector", "query", "document", "token", "parser", "embedding", "section",
+         "header", "chunk", "faiss", "upload", "answer", "source", "model", "worker"]
+
+
+def make_markdown(size_mb, seed=0):
+    rng = random.Random(seed)
+    parts = []
+    size = 0
+    section = 0
+    while size < size_mb * 1024 * 1024:
+        level = rng.choice([1, 2, 2, 3, 3, 3])
+        lines = [f"{'#' * level} Section {section}"]
+        # some sections are very long, which is where repeated concatenation hurts
+        for _ in range(rng.choice([5, 20, 50, 2000])):
+            words = [rng.choice(WORDS) for _ in range(12)]
+            words[3] = f"[{words[3]}](https://example.com/{section})"
+            words[7] = f"<b>{words[7]}</b>"
+            lines.append(" ".join(words))
+        lines.append("![[diagram.png]]")
+        text = "\n".join(lines) + "\n"
+        parts.append(text)
+        size += len(text)
+        section += 1
+    return "".join(parts)
+
+
+def legacy_markdown_to_tups(markdown_text, max_tokens=2048):
+    markdown_text = re.sub(r"\[(.*?)\]\((.*?)\)", r"\1", markdown_text)
+    markdown_text = re.sub(r"!{1}\[\[(.*)\]\]", "", markdown_text)
+    markdown_tups = []
+    current_header = None
+    current_text = ""
+
+    def append(header, text):
+        if len(get_encoding().encode(text)) > max_tokens:
+            for i in range(0, len(text), max_tokens):
+                markdown_tups.append((header, text[i:i + max_tokens]))
+        else:
+            markdown_tups.append((header, text))
+
+    for line in markdown_text.split("\n"):
+        if re.match(r"^#+\s", line):
+            if current_header is not None and current_text != "":
+                append(current_header, current_text)
+            current_header = line
+            current_text = ""
+        else:
+            current_text += line + "\n"
+    append(current_header, current_text)
+    return [(re.sub(r"#", "", key).strip(), re.sub(r"<.*?>", "", value)) for key, value in markdown_tups]
+
+
+def main():
+    get_encoding()
+    parser = MarkdownParser()
+    print(f"{'MB':>6} {'sections':>9} {'sectionizer MB/s':>17} {'legacy MB/s':>12}")
+    for size_mb in (1, 4, 16):
+        text = make_markdown(size_mb)
+        megabytes = len(text) / (1024 * 1024)
+        start = time.perf_counter()
+        sections = parser.markdown_to_sections(text)
+        elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        legacy_markdown_to_tups(text)
+        legacy = time.perf_counter() - start
+        print(f"{megabytes:>6.1f} {len(sections):>9} {megabytes / elapsed:>17.1f} {megabytes / legacy:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
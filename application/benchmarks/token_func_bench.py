@@ -0,0 +1,68 @@
+"""Micro-benchmark of grouping and splitting documents by tokens.
+
+Times `group_split` on synthetic corpora of growing size and compares
+grouping with the previous implementation, which re-encoded the whole
+group for every document it added. Time per document should stay flat as
+the corpus grows.
+
+Run from the application folder:
+    python -m benchmarks.token_func_bench
+"""
+import random
+import time
+
+from parser.schema.base import Document
+from parser.token_func import get_encoding, group_documents, group_split
+
+WORDS = ["index", "vector", "query", "document", "token", "parser", "embedding", "section",
+         "header", "chunk", "faiss", "upload", "answer", "source", "model", "worker"]
+
+
+def make_corpus(num_docs, seed=0):
+    rng = random.Random(seed)
+    docs = []
+    for i in range(num_docs):
+        # mostly small sections with a few large ones, like a typical docs site
+        num_words = rng.choice([20, 40, 80, 160, 320, 2500])
+        text = f"Title {i}\n\nHeader\n" + " ".join(rng.choice(WORDS) for _ in range(num_words))
+        docs.append(Document(text=text, doc_id=str(i)))
+    return docs
+
+
+def legacy_group_documents(documents, min_tokens, max_tokens):
+    encoding = get_encoding()
+    docs = []
+    current_group = None
+    for doc in documents:
+        doc_len = len(encoding.encode(doc.text))
+        if current_group is None:
+            current_group = Document(text=doc.text, doc_id=doc.doc_id)
+        elif len(encoding.encode(current_group.text)) + doc_len < max_tokens and doc_len >= min_tokens:
+            current_group.text += " " + doc.text
+        else:
+            docs.append(current_group)
+            current_group = Document(text=doc.text, doc_id=doc.doc_id)
+    if current_group is not None:
+        docs.append(current_group)
+    return docs
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    get_encoding()
+    print(f"{'docs':>8} {'group_split s':>14} {'us/doc':>8} {'group s':>8} {'legacy group s':>15} {'speedup':>8}")
+    for num_docs in (1000, 2000, 4000, 8000):
+        chunks, total = timed(group_split, make_corpus(num_docs), max_tokens=2000, min_tokens=150)
+        _, grouping = timed(group_documents, make_corpus(num_docs), min_tokens=150, max_tokens=2000)
+        _, legacy = timed(legacy_group_documents, make_corpus(num_docs), min_tokens=150, max_tokens=2000)
+        print(f"{num_docs:>8} {total:>14.3f} {total / num_docs * 1e6:>8.0f} {grouping:>8.3f} "
+              f"{legacy:>15.3f} {legacy / grouping:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
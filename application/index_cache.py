@@ -0,0 +1,141 @@
+"""In-process cache for loaded FAISS vector stores.
+
+Loading a store with `FAISS.load_local` reads `index.faiss` and unpickles
+`index.pkl` from disk, which is by far the slowest part of answering a
+question on a large index. The cache keeps recently used stores in memory,
+keyed on the store path and the mtime/size of its files, so a store that is
+replaced on disk is reloaded automatically on the next request. The
+shards of a sharded index are never changed once published, a new version
+replaces its layout, so the layout alone identifies the version of the
+index, and its size is that of the files of all its shards.
+
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Tuple
+
+from parser.index_shards import SHARDS_FILE, ShardLayout, is_sharded, shard_path
+
+INDEX_FILES = ("index.faiss", "index.pkl")
+
+
+def index_files(path: str) -> List[str]:
+    """Return the index files under `path`, relative to it."""
+    if not is_sharded(path):
+        return list(INDEX_FILES)
+    layout = ShardLayout.load(path)
+    return [os.path.relpath(os.path.join(shard_path(path, shard, layout.version), name), path)
+            for shard in range(layout.num_shards) for name in INDEX_FILES]
+
+
+def index_version(path: str) -> Tuple[Tuple[str, int, int], ...]:
+    """Return the name, mtime_ns and size of the files identifying the version of the index at `path`."""
+    version = []
+    # reading the layout of a sharded index on every request would parse every source file it lists
+    for name in ([SHARDS_FILE] if is_sharded(path) else INDEX_FILES):
+        stat = os.stat(os.path.join(path, name))
+        version.append((name, stat.st_mtime_ns, stat.st_size))
+    return tuple(version)
+
+
+def index_bytes(path: str, lazy_files: Tuple[str, ...] = ()) -> int:
+    """Return the size of the index files under `path` that are loaded in memory."""
+    total = 0
+    for name in index_files(path):
+        if os.path.basename(name) not in lazy_files:
+            # the shards of a previous version may be removed while they are listed
+            try:
+                total += os.path.getsize(os.path.join(path, name))
+            except FileNotFoundError:
+                pass
+    return total
+
+
+class IndexCache:
+    """LRU cache of vector stores with a memory budget.
+
+    The size of an entry is estimated from the size of its files on disk,
+    which is close to what the flat FAISS index and the docstore take up
+    once loaded. Files that are read on demand rather than loaded, such as
+    a memory-mapped index or a pickle replaced by an on-disk docstore, do
+    not count towards the budget, and the number of entries is capped
+    too, as stores read entirely on demand take no budget at all. A store
+    dropped from the cache is only released, requests may still be using
+    it: an on-disk docstore closes its connection once it is no longer
+    referenced.
+
+    Args:
+        max_bytes (int): Memory budget for all cached stores.
+            A budget of 0 disables caching.
+        lazy_files (Tuple[str, ...]): Index files that are read on demand.
+        max_entries (int): Maximum number of cached stores.
+
+    """
+
+    def __init__(self, max_bytes: int, lazy_files: Tuple[str, ...] = (), max_entries: int = 64) -> None:
+        """Init params."""
+        self.max_bytes = max_bytes
+        self.lazy_files = lazy_files
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[Any, Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, path: str, loader: Callable[[str], Any]) -> Any:
+        """Return the store at `path`, calling `loader(path)` on a miss."""
+        key = os.path.normpath(path)
+        version = index_version(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        store = loader(path)
+        nbytes = index_bytes(key, self.lazy_files)
+        with self._lock:
+            self._remove(key)
+            if nbytes <= self.max_bytes and self.max_entries > 0:
+                self._entries[key] = (version, store, nbytes)
+                self._bytes += nbytes
+                while self._bytes > self.max_bytes or len(self._entries) > self.max_entries:
+                    self._remove(next(iter(self._entries)))
+                    self.evictions += 1
+        return store
+
+    def invalidate(self, path: str) -> None:
+        """Drop the store at `path` and every store below it."""
+        key = os.path.normpath(path)
+        prefix = key + os.sep
+        with self._lock:
+            for cached in [k for k in self._entries if k == key or k.startswith(prefix)]:
+                self._remove(cached)
+                self.invalidations += 1
+
+    def stats(self) -> Dict[str, int]:
+        """Return cache counters for this process."""
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries,
+                "lazy_files": list(self.lazy_files),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
@@ -0,0 +1,118 @@
+"""Loading of FAISS vector stores saved with `save_local`.
+
+With `mmap`, `index.faiss` is memory-mapped read-only instead of being read
+into the process. The vectors then live in the page cache, shared by every
+gunicorn worker that opens the same index, and loading a large index only
+maps the file instead of copying it.
+
+With `lazy_docstore`, chunks are fetched from `docstore.sqlite` when a
+search returns them instead of unpickling all of `index.pkl`, see
+`lazy_docstore`.
+
+The search parameters saved with IVF and HNSW indexes in `index_params.json`,
+such as `nprobe`, are set on the loaded index, and compressed indexes are
+wrapped to re-rank their results with the memory-mapped `vectors.npy`, see
+`parser.index_factory`.
+
+Indexes saved as shards are loaded as one store searching every shard,
+concurrently with an `executor`, see `parser.index_shards`.
+
+Zero-copy mapping of flat indexes needs a faiss build with
+`IO_FLAG_MMAP_IFC`. Older builds fall back to `IO_FLAG_MMAP`, which maps
+the inverted lists of on-disk IVF indexes but still copies flat vectors,
+so `lazy_files` only counts `index.faiss` as read on demand with the former.
+
+"""
+import os
+import pickle
+import shutil
+import tempfile
+from concurrent.futures import Executor
+from typing import Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain.vectorstores import FAISS
+
+from lazy_docstore import DOCSTORE_DB, SQLiteDocstore, SQLiteIdMap, convert_docstore, is_converted
+from parser.index_factory import VECTORS_FILE, RerankedIndex, load_index_params, set_search_params
+from parser.index_shards import ShardedDocstore, ShardedIdMap, ShardedIndex, ShardLayout, is_sharded, shard_path
+
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "index.pkl"
+
+MMAP_ZERO_COPY = hasattr(faiss, "IO_FLAG_MMAP_IFC")
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+def lazy_files(mmap: bool, lazy_docstore: bool) -> Tuple[str, ...]:
+    """Return the index files that `load_store` reads on demand rather than into memory."""
+    files = ()
+    if mmap and MMAP_ZERO_COPY:
+        files += (INDEX_FILE,)
+    if lazy_docstore:
+        files += (DOCSTORE_FILE,)
+    return files
+
+
+def load_store(path: str, embeddings, mmap: bool = False, lazy_docstore: bool = False,
+               executor: Optional[Executor] = None) -> FAISS:
+    """Load the store saved in `path`, the same as `FAISS.load_local` without mmap and lazy_docstore.
+
+    A memory-mapped index is read-only, vectors cannot be added to it or
+    removed from it. The docstore of an index is converted on its first
+    lazy load, if it was not converted when it was uploaded. The shards of
+    a sharded index are searched in `executor`.
+
+    """
+    if is_sharded(path):
+        layout = ShardLayout.load(path)
+        shards = [load_store(shard_path(path, shard, layout.version), embeddings, mmap, lazy_docstore)
+                  for shard in range(layout.num_shards)]
+        index = ShardedIndex([shard.index for shard in shards], executor)
+        return FAISS(embeddings.embed_query, index, ShardedDocstore([shard.docstore for shard in shards]),
+                     ShardedIdMap([shard.index_to_docstore_id for shard in shards], index.offsets))
+    index = faiss.read_index(os.path.join(path, INDEX_FILE), MMAP_FLAGS if mmap else 0)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        # max marginal relevance searches reconstruct vectors by position, which IVF indexes need a direct map for
+        ivf.make_direct_map()
+    index_params = load_index_params(path)
+    if index_params is not None:
+        set_search_params(index, index_params["search"])
+        if index_params.get("rerank"):
+            vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode="r")
+            index = RerankedIndex(index, vectors, index_params["rerank"])
+    if lazy_docstore:
+        if not is_converted(path):
+            convert_docstore(path)
+        docstore = SQLiteDocstore(os.path.join(path, DOCSTORE_DB))
+        return FAISS(embeddings.embed_query, index, docstore, SQLiteIdMap(docstore))
+    with open(os.path.join(path, DOCSTORE_FILE), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(embeddings.embed_query, index, docstore, index_to_docstore_id)
+
+
+def save_atomic(file, path: str) -> None:
+    """Save an uploaded file to `path` through a temporary file and a rename.
+
+    Overwriting a file in place would change the pages of an index other
+    processes have memory-mapped. After a rename, they keep reading the old
+    file until they reload.
+
+    """
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".upload-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if hasattr(file, "save"):
+                file.save(f)
+            else:
+                shutil.copyfileobj(file, f)
+        # mkstemp creates files readable by the owner only
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
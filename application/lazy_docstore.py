@@ -0,0 +1,186 @@
+"""Disk-backed docstore for FAISS vector stores.
+
+`index.pkl` holds the text and metadata of every chunk of an index, and
+`FAISS.load_local` has to unpickle all of it before answering a question
+that only needs a few chunks. This module converts it once to
+`docstore.sqlite`, next to the index, and serves chunks from there by
+position in the FAISS index. A loaded store then only keeps an open
+database connection in memory, whatever the size of the corpus.
+
+The database records the size and mtime of the `index.pkl` it was
+converted from, and is converted again if the pickle changes.
+
+Existing indexes can be converted ahead of time with:
+    python -m lazy_docstore indexes/
+"""
+import argparse
+import json
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import weakref
+from typing import Iterator, Mapping, Union
+
+from langchain.docstore.base import Docstore
+from langchain.docstore.document import Document
+
+DOCSTORE_DB = "docstore.sqlite"
+PICKLE_FILE = "index.pkl"
+
+
+def _source_version(pickle_path: str) -> str:
+    stat = os.stat(pickle_path)
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def convert_docstore(folder: str) -> str:
+    """Convert the `index.pkl` of the index in `folder` to `docstore.sqlite`.
+
+    The database is written to a temporary file and renamed into place, so
+    processes converting the same index at the same time do not interfere.
+
+    Returns:
+        str: Path of the database.
+
+    """
+    pickle_path = os.path.join(folder, PICKLE_FILE)
+    db_path = os.path.join(folder, DOCSTORE_DB)
+    version = _source_version(pickle_path)
+    with open(pickle_path, "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".docstore-")
+    os.close(fd)
+    try:
+        conn = sqlite3.connect(tmp_path)
+        conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        conn.execute("CREATE TABLE docs (position INTEGER PRIMARY KEY, id TEXT NOT NULL, "
+                     "text TEXT NOT NULL, metadata TEXT NOT NULL)")
+        conn.execute("CREATE INDEX docs_id ON docs (id)")
+
+        def rows():
+            for position, doc_id in index_to_docstore_id.items():
+                doc = docstore.search(doc_id)
+                if isinstance(doc, Document):
+                    yield int(position), doc_id, doc.page_content, json.dumps(doc.metadata, default=str)
+
+        conn.executemany("INSERT INTO docs VALUES (?, ?, ?, ?)", rows())
+        conn.execute("INSERT INTO meta VALUES ('source_version', ?)", (version,))
+        conn.commit()
+        conn.close()
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, db_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return db_path
+
+
+def is_converted(folder: str) -> bool:
+    """Check if the index in `folder` has a docstore database matching its `index.pkl`."""
+    db_path = os.path.join(folder, DOCSTORE_DB)
+    if not os.path.exists(db_path):
+        return False
+    try:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'source_version'").fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return False
+    return row is not None and row[0] == _source_version(os.path.join(folder, PICKLE_FILE))
+
+
+class SQLiteDocstore(Docstore):
+    """Read-only docstore fetching chunks from `docstore.sqlite` on demand.
+
+    Also serves as the position -> docstore id mapping of the FAISS store,
+    see `SQLiteIdMap`. The connection can be shared by threads. It is
+    closed by `close`, or once the docstore is no longer referenced, so a
+    store evicted from the `IndexCache` keeps it until the last request
+    using the store is done.
+
+    Args:
+        db_path (str): Path of the database.
+
+    """
+
+    def __init__(self, db_path: str) -> None:
+        """Init params."""
+        self.db_path = db_path
+        self._conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._closer = weakref.finalize(self, self._conn.close)
+
+    def search(self, search: str) -> Union[str, Document]:
+        """Fetch a chunk by docstore id."""
+        with self._lock:
+            row = self._conn.execute("SELECT text, metadata FROM docs WHERE id = ?", (search,)).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(page_content=row[0], metadata=json.loads(row[1]))
+
+    def id_at(self, position: int) -> str:
+        with self._lock:
+            row = self._conn.execute("SELECT id FROM docs WHERE position = ?", (int(position),)).fetchone()
+        if row is None:
+            raise KeyError(position)
+        return row[0]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def positions(self) -> Iterator[int]:
+        with self._lock:
+            positions = [row[0] for row in self._conn.execute("SELECT position FROM docs ORDER BY position")]
+        return iter(positions)
+
+    def close(self) -> None:
+        """Close the database connection, the docstore cannot be used after."""
+        with self._lock:
+            self._closer()
+
+    @property
+    def closed(self) -> bool:
+        return not self._closer.alive
+
+
+class SQLiteIdMap(Mapping[int, str]):
+    """FAISS position -> docstore id mapping read from `docstore.sqlite`."""
+
+    def __init__(self, docstore: SQLiteDocstore) -> None:
+        """Init params."""
+        self.docstore = docstore
+
+    def __getitem__(self, position: int) -> str:
+        return self.docstore.id_at(position)
+
+    def __iter__(self) -> Iterator[int]:
+        return self.docstore.positions()
+
+    def __len__(self) -> int:
+        return self.docstore.count()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Convert index.pkl files to docstore.sqlite databases.")
+    parser.add_argument("paths", nargs="+", help="index folders, or folders to search for indexes")
+    args = parser.parse_args()
+    for path in args.paths:
+        for root, _, files in os.walk(path):
+            if PICKLE_FILE not in files:
+                continue
+            if is_converted(root):
+                print(f"{root}: up to date")
+                continue
+            convert_docstore(root)
+            print(f"{root}: converted")
+
+
+if __name__ == "__main__":
+    main()
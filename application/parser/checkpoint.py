@@ -0,0 +1,80 @@
+"""Ingestion checkpoints.
+
+Periodically saves the partially built FAISS store together with the chunks
+it already contains, so that a retried ingest task continues where the
+failed attempt stopped instead of embedding everything again.
+
+"""
+import json
+import os
+import shutil
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from langchain.vectorstores import FAISS
+
+from parser.embedding_scheduler import is_retryable_error
+
+CHECKPOINT_DIR = "checkpoint"
+PROGRESS_FILE = "progress.json"
+
+
+def is_transient_error(e: BaseException) -> bool:
+    """Check if an ingest failed on an error worth retrying the task for.
+
+    Rate limits, timeouts and server errors of the embeddings provider, and
+    network errors reaching the app, may pass. Anything else, such as a bad
+    upload or an invalid API key, fails the same way on every attempt.
+
+    """
+    return is_retryable_error(e) or isinstance(e, (requests.ConnectionError, requests.Timeout))
+
+
+class IngestCheckpoint:
+    """Checkpoint of an ingestion run.
+
+    Chunks are identified by a key derived from their source and content.
+    The checkpoint also records a fingerprint of all chunks of the run, so a
+    checkpoint left behind by a different upload is never resumed.
+
+    Args:
+        folder (str): Folder the index is built in.
+        fingerprint (str): Fingerprint of the chunks being ingested.
+
+    """
+
+    def __init__(self, folder: str, fingerprint: str) -> None:
+        """Init params."""
+        self.path = os.path.join(folder, CHECKPOINT_DIR)
+        self.fingerprint = fingerprint
+
+    def load(self, embeddings) -> Optional[Tuple[FAISS, Counter, Dict[str, List[str]]]]:
+        """Return the store, done chunk keys and ids per source, if resumable."""
+        progress_path = os.path.join(self.path, PROGRESS_FILE)
+        if not os.path.exists(progress_path):
+            return None
+        with open(progress_path, "r") as f:
+            progress = json.load(f)
+        if progress["fingerprint"] != self.fingerprint:
+            print("Ignoring checkpoint of a different upload")
+            self.clear()
+            return None
+        store = FAISS.load_local(self.path, embeddings)
+        return store, Counter(progress["done"]), progress["ids_by_source"]
+
+    def save(self, store: FAISS, done: Counter, ids_by_source: Dict[str, List[str]]) -> None:
+        """Replace the checkpoint with the current state."""
+        tmp_path = self.path + ".tmp"
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        store.save_local(tmp_path)
+        with open(os.path.join(tmp_path, PROGRESS_FILE), "w") as f:
+            json.dump({"fingerprint": self.fingerprint, "done": done, "ids_by_source": ids_by_source}, f)
+        self.clear()
+        os.rename(tmp_path, self.path)
+
+    def clear(self) -> None:
+        """Remove the checkpoint."""
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
@@ -0,0 +1,143 @@
+"""Persistent embedding cache.
+
+Stores embedding vectors in a local SQLite database keyed by the embedding
+model name and the SHA-256 of the embedded text, so re-ingesting unchanged
+chunks does not call the embeddings API again.
+
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+# page through lookups to stay under SQLite's bound parameter limit
+_QUERY_BATCH = 500
+
+
+def text_hash(text: str) -> str:
+    """Return the cache key of a chunk of text."""
+    return hashlib.sha256(text.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+class EmbeddingCache:
+    """Content-addressed embedding cache backed by SQLite.
+
+    Least recently used vectors are evicted once the stored vectors exceed
+    `max_bytes`. Their size is summed once when the database is opened and
+    kept up to date on every write, so only writes that go over the budget
+    scan the table. Vectors written by other processes sharing the database
+    are counted the next time it is opened. The cache can be shared by
+    threads, queries are serialized.
+
+    Args:
+        path (str): Path of the SQLite database file.
+        max_bytes (int): Size budget for the stored vectors.
+        dtype (str): Storage type of the vectors, "float32" or "float16".
+            float16 halves the size of the cache at a negligible loss of
+            precision for similarity search.
+
+    """
+
+    def __init__(self, path: str, max_bytes: int = 2 * 1024 ** 3, dtype: str = "float32") -> None:
+        """Init params."""
+        if dtype not in ("float32", "float16"):
+            raise ValueError(f"Unsupported embedding cache dtype: {dtype}")
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.max_bytes = max_bytes
+        self.dtype = dtype
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, hash TEXT NOT NULL, dtype TEXT NOT NULL, vector BLOB NOT NULL, "
+            "size INTEGER NOT NULL, last_used REAL NOT NULL, PRIMARY KEY (model, hash))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        # size of the stored vectors
+        self._bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """Return the cached vector of every text, or None where it is not cached."""
+        hashes = [text_hash(text) for text in texts]
+        with self._lock:
+            found = {}
+            for i in range(0, len(hashes), _QUERY_BATCH):
+                page = hashes[i:i + _QUERY_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT hash, dtype, vector FROM embeddings WHERE model = ? "
+                    f"AND hash IN ({','.join('?' * len(page))})",
+                    [model, *page],
+                )
+                for key, dtype, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=dtype).astype(np.float32).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND hash = ?",
+                    [(now, model, key) for key in found],
+                )
+                self._conn.commit()
+            vectors = [found.get(key) for key in hashes]
+            self.hits += sum(vector is not None for vector in vectors)
+            self.misses += sum(vector is None for vector in vectors)
+            return vectors
+
+    def put_many(self, model: str, texts: Sequence[str], vectors: Sequence[Sequence[float]]) -> None:
+        """Store the vectors of `texts` and evict old entries if over budget."""
+        now = time.time()
+        # a text repeated in the batch is stored once
+        rows = {}
+        for text, vector in zip(texts, vectors):
+            blob = np.asarray(vector, dtype=self.dtype).tobytes()
+            key = text_hash(text)
+            rows[key] = (model, key, self.dtype, blob, len(blob), now)
+        hashes = list(rows)
+        with self._lock:
+            replaced = 0
+            for i in range(0, len(hashes), _QUERY_BATCH):
+                page = hashes[i:i + _QUERY_BATCH]
+                replaced += self._conn.execute(
+                    f"SELECT COALESCE(SUM(size), 0) FROM embeddings WHERE model = ? "
+                    f"AND hash IN ({','.join('?' * len(page))})",
+                    [model, *page],
+                ).fetchone()[0]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, dtype, vector, size, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows.values(),
+            )
+            self._conn.commit()
+            self._bytes += sum(row[4] for row in rows.values()) - replaced
+            if self._bytes > self.max_bytes:
+                self.evict()
+
+    def evict(self) -> int:
+        """Drop least recently used vectors until the cache fits its budget."""
+        with self._lock:
+            excess = self._bytes - self.max_bytes
+            if excess <= 0:
+                return 0
+            evicted = []
+            for rowid, size in self._conn.execute("SELECT rowid, size FROM embeddings ORDER BY last_used"):
+                evicted.append((rowid,))
+                self._bytes -= size
+                excess -= size
+                if excess <= 0:
+                    break
+            self._conn.executemany("DELETE FROM embeddings WHERE rowid = ?", evicted)
+            self._conn.commit()
+            return len(evicted)
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,188 @@
+"""Embedding request scheduler.
+
+Runs embedding requests concurrently while staying inside the provider's
+request and token budgets. Budgets are enforced with token buckets, and the
+number of requests in flight is adjusted with AIMD: it grows by one request
+per window of successful, fast responses and is halved on every rate limit
+error. Failed requests are retried with jittered exponential backoff.
+
+"""
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence
+
+# Errors of the openai client that are worth retrying.
+RETRYABLE_ERRORS = {"RateLimitError", "Timeout", "APIError", "APIConnectionError", "ServiceUnavailableError"}
+
+
+def is_rate_limit_error(e: Exception) -> bool:
+    """Check if an exception is a 429 from the provider."""
+    return type(e).__name__ == "RateLimitError" or getattr(e, "http_status", None) == 429
+
+
+def is_retryable_error(e: Exception) -> bool:
+    """Check if an exception is transient."""
+    return type(e).__name__ in RETRYABLE_ERRORS or getattr(e, "http_status", None) in (429, 500, 502, 503, 504)
+
+
+def estimate_tokens(texts: Sequence[str]) -> int:
+    """Cheap token estimate of a request, about 4 characters per token."""
+    return sum(len(text) for text in texts) // 4 + 1
+
+
+class TokenBucket:
+    """Token bucket refilled at a constant rate per minute.
+
+    Args:
+        per_minute (float): Refill rate, and capacity of the bucket.
+
+    """
+
+    def __init__(self, per_minute: float) -> None:
+        """Init params."""
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self._tokens = per_minute
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1) -> None:
+        """Block until `amount` tokens are available and take them."""
+        # a request larger than the bucket would never fit, let it through once the bucket is full
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                wait = (amount - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class EmbeddingScheduler:
+    """Schedule embedding requests within rate limits with adaptive concurrency.
+
+    Args:
+        embed (Callable): Function embedding a list of texts.
+        requests_per_minute (float): Request budget.
+        tokens_per_minute (float): Token budget.
+        max_concurrency (int): Upper bound of requests in flight.
+        initial_concurrency (int): Requests in flight at the start.
+        target_latency (Optional[float]): Responses slower than this many
+            seconds shrink the concurrency. Defaults to three times the
+            fastest response seen.
+        max_retries (int): Retries of a request before its error is raised.
+        base_delay (float): Base of the exponential backoff, in seconds.
+        max_delay (float): Cap of the backoff, in seconds.
+
+    """
+
+    def __init__(
+        self,
+        embed: Callable[[List[str]], List[List[float]]],
+        requests_per_minute: float = 3000,
+        tokens_per_minute: float = 1000000,
+        max_concurrency: int = 8,
+        initial_concurrency: int = 2,
+        target_latency: Optional[float] = None,
+        max_retries: int = 8,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+    ) -> None:
+        """Init params."""
+        self.embed = embed
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.concurrency = float(min(initial_concurrency, max_concurrency))
+        self.target_latency = target_latency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate_limited = 0
+        self._fastest: Optional[float] = None
+        self._in_flight = 0
+        self._slots = threading.Condition()
+
+    def map(self, batches: Iterable[List[str]]) -> Iterator[List[List[float]]]:
+        """Embed every batch, yielding the vectors of each batch in order.
+
+        Batches are pulled from `batches` as earlier ones complete, with at
+        most twice `max_concurrency` batches submitted ahead of the consumer,
+        so `batches` can be a stream fed by a producer. Closing the iterator
+        cancels the batches that have not started yet.
+
+        """
+        executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        try:
+            batches = iter(batches)
+            window = deque(executor.submit(self.embed_batch, batch)
+                           for batch in islice(batches, 2 * self.max_concurrency))
+            while window:
+                vectors = window.popleft().result()
+                next_batch = next(batches, None)
+                if next_batch is not None:
+                    window.append(executor.submit(self.embed_batch, next_batch))
+                yield vectors
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Embed one batch, retrying transient errors with jittered backoff."""
+        if not texts:
+            return []
+        attempt = 0
+        while True:
+            self._acquire_slot()
+            try:
+                self.requests.acquire()
+                self.tokens.acquire(estimate_tokens(texts))
+                start = time.monotonic()
+                vectors = self.embed(texts)
+            except Exception as e:
+                if not is_retryable_error(e) or attempt >= self.max_retries:
+                    raise
+                if is_rate_limit_error(e):
+                    self._on_rate_limited()
+            else:
+                self._on_success(time.monotonic() - start)
+                return vectors
+            finally:
+                self._release_slot()
+            time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+            attempt += 1
+
+    def _acquire_slot(self) -> None:
+        with self._slots:
+            while self._in_flight >= int(self.concurrency):
+                self._slots.wait()
+            self._in_flight += 1
+
+    def _release_slot(self) -> None:
+        with self._slots:
+            self._in_flight -= 1
+            self._slots.notify_all()
+
+    def _on_rate_limited(self) -> None:
+        with self._slots:
+            self.rate_limited += 1
+            self.concurrency = max(1.0, self.concurrency / 2)
+
+    def _on_success(self, latency: float) -> None:
+        with self._slots:
+            if self._fastest is None or latency < self._fastest:
+                self._fastest = latency
+            target = self.target_latency if self.target_latency is not None else 3 * self._fastest
+            if latency > target:
+                self.concurrency = max(1.0, self.concurrency * 0.75)
+            else:
+                # grows by about one request per window of `concurrency` successful requests
+                self.concurrency = min(float(self.max_concurrency), self.concurrency + 1 / self.concurrency)
+            self._slots.notify_all()
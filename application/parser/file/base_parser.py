@@ -2,7 +2,7 @@
 
 from abc import abstractmethod
 from pathlib import Path
-from typing import Dict, List, Optional, Union
+from typing import Any, Dict, List, Optional, Union
 
 
 class BaseParser:
@@ -34,5 +34,9 @@ class BaseParser:
         """Initialize the parser with the config."""
 
     @abstractmethod
-    def parse_file(self, file: Path, errors: str = "ignore") -> Union[str, List[str]]:
-        """Parse file."""
+    def parse_file(self, file: Path, errors: str = "ignore") -> Union[str, List[Any]]:
+        """Parse file.
+
+        Returns the text of the file, or a list of texts, or a list of
+        Documents for parsers that attach metadata to each section.
+        """
@@ -1,28 +1,72 @@
 """Simple reader that reads files of different formats from a directory."""
 import logging
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from fnmatch import fnmatch
+from functools import partial
+from itertools import islice
 from pathlib import Path
-from typing import Callable, Dict, List, Optional, Union
+from typing import Callable, Dict, Iterator, List, Mapping, Optional, Union
 
 from parser.file.base import BaseReader
 from parser.file.base_parser import BaseParser
-from parser.file.docs_parser import DocxParser, PDFParser
-from parser.file.epub_parser import EpubParser
-from parser.file.html_parser import HTMLParser
-from parser.file.markdown_parser import MarkdownParser
-from parser.file.rst_parser import RstParser
-from parser.file.tabular_parser import PandasCSVParser
+from parser.file.registry import ParserRegistry
 from parser.schema.base import Document
 
-DEFAULT_FILE_EXTRACTOR: Dict[str, BaseParser] = {
-    ".pdf": PDFParser(),
-    ".docx": DocxParser(),
-    ".csv": PandasCSVParser(),
-    ".epub": EpubParser(),
-    ".md": MarkdownParser(),
-    ".rst": RstParser(),
-    ".html": HTMLParser(),
-    ".mdx": MarkdownParser(),
-}
+# parsers are imported and instantiated on first use of their extension
+DEFAULT_FILE_EXTRACTOR: Mapping[str, BaseParser] = ParserRegistry()
+
+
+def _matches(rel_path: str, name: str, patterns: Optional[List[str]]) -> bool:
+    """Check if a path relative to the input directory, or its name, matches a glob pattern."""
+    if not patterns:
+        return False
+    return any(fnmatch(rel_path, pattern) or fnmatch(name, pattern) for pattern in patterns)
+
+
+def _parse_file(
+    input_file: Path, file_extractor: Mapping[str, BaseParser], errors: str, in_pool: bool = False
+) -> Optional[Union[str, List[str], List[Document]]]:
+    """Parse one file, returning None if it could not be parsed.
+
+    Defined at module level so it can be sent to worker processes. In a
+    worker process (`in_pool`), parsers that can parse a file in several
+    processes, such as PDFParser and EpubParser, are limited to one: the
+    pool already keeps every CPU busy.
+
+    """
+    try:
+        if input_file.suffix in file_extractor:
+            parser = file_extractor[input_file.suffix]
+            if not parser.parser_config_set:
+                parser.init_parser()
+            if in_pool and getattr(parser, "num_workers", 1) > 1:
+                # the parser is the worker process' own copy
+                parser.num_workers = 1
+            return parser.parse_file(input_file, errors=errors)
+        # do standard read
+        with open(input_file, "r", errors=errors) as f:
+            return f.read()
+    except Exception as e:
+        logging.warning(f"> [SimpleDirectoryReader] Failed to parse {input_file}: {e}")
+        return None
+
+
+# file extractor of a worker process, set once by _init_worker so its parsers are built once per process
+_worker_file_extractor: Optional[Mapping[str, BaseParser]] = None
+
+
+def _init_worker(file_extractor: Mapping[str, BaseParser]) -> None:
+    """Keep the file extractor sent to a worker process when the pool starts it."""
+    global _worker_file_extractor
+    _worker_file_extractor = file_extractor
+
+
+def _parse_in_worker(input_file: Path, errors: str) -> Optional[Union[str, List[str], List[Document]]]:
+    """Parse one file in a worker process with the extractor set by `_init_worker`."""
+    return _parse_file(input_file, _worker_file_extractor, errors, in_pool=True)
 
 
 class SimpleDirectoryReader(BaseReader):
@@ -41,14 +85,26 @@ class SimpleDirectoryReader(BaseReader):
             False by default.
         required_exts (Optional[List[str]]): List of required extensions.
             Default is None.
-        file_extractor (Optional[Dict[str, BaseParser]]): A mapping of file
+        file_extractor (Optional[Mapping[str, BaseParser]]): A mapping of file
             extension to a BaseParser class that specifies how to convert that file
-            to text. See DEFAULT_FILE_EXTRACTOR.
+            to text. See DEFAULT_FILE_EXTRACTOR, a ParserRegistry that only loads
+            the parsers of the extensions it meets.
         num_files_limit (Optional[int]): Maximum number of files to read.
             Default is None.
         file_metadata (Optional[Callable[str, Dict]]): A function that takes
             in a filename and returns a Dict of metadata for the Document.
             Default is None.
+        num_workers (Optional[int]): Number of processes to parse files in.
+            Files are parsed sequentially in the current process by default.
+            Output order is the same in both modes, and a file that fails to
+            parse is logged and skipped.
+        include_globs (Optional[List[str]]): Only read files matching one of
+            these glob patterns. Patterns are matched against the path relative
+            to `input_dir` and against the file name. Default is None.
+        exclude_globs (Optional[List[str]]): Skip files and directories
+            matching one of these glob patterns. Default is None.
+        max_file_size (Optional[int]): Skip files larger than this many bytes.
+            Default is None.
     """
 
     def __init__(
@@ -59,10 +115,14 @@ class SimpleDirectoryReader(BaseReader):
         errors: str = "ignore",
         recursive: bool = True,
         required_exts: Optional[List[str]] = None,
-        file_extractor: Optional[Dict[str, BaseParser]] = None,
+        file_extractor: Optional[Mapping[str, BaseParser]] = None,
         num_files_limit: Optional[int] = None,
         file_metadata: Optional[Callable[[str], Dict]] = None,
         chunk_size_max: int = 2048,
+        num_workers: Optional[int] = None,
+        include_globs: Optional[List[str]] = None,
+        exclude_globs: Optional[List[str]] = None,
+        max_file_size: Optional[int] = None,
     ) -> None:
         """Initialize with parameters."""
         super().__init__()
@@ -76,6 +136,10 @@ class SimpleDirectoryReader(BaseReader):
         self.exclude_hidden = exclude_hidden
         self.required_exts = required_exts
         self.num_files_limit = num_files_limit
+        self.num_workers = num_workers
+        self.include_globs = include_globs
+        self.exclude_globs = exclude_globs
+        self.max_file_size = max_file_size
 
         if input_files:
             self.input_files = []
@@ -92,29 +156,11 @@ class SimpleDirectoryReader(BaseReader):
 
     def _add_files(self, input_dir: Path) -> List[Path]:
         """Add files."""
-        input_files = sorted(input_dir.iterdir())
-        new_input_files = []
-        dirs_to_explore = []
-        for input_file in input_files:
-            if input_file.is_dir():
-                if self.recursive:
-                    dirs_to_explore.append(input_file)
-            elif self.exclude_hidden and input_file.name.startswith("."):
-                continue
-            elif (
-                self.required_exts is not None
-                and input_file.suffix not in self.required_exts
-            ):
-                continue
-            else:
-                new_input_files.append(input_file)
-
-        for dir_to_explore in dirs_to_explore:
-            sub_input_files = self._add_files(dir_to_explore)
-            new_input_files.extend(sub_input_files)
-
+        files = self._iter_files(str(input_dir), "")
         if self.num_files_limit is not None and self.num_files_limit > 0:
-            new_input_files = new_input_files[0 : self.num_files_limit]
+            # stops walking the tree once the limit is reached
+            files = islice(files, self.num_files_limit)
+        new_input_files = list(files)
 
         # print total number of files added
         logging.debug(
@@ -123,6 +169,111 @@ class SimpleDirectoryReader(BaseReader):
 
         return new_input_files
 
+    def _iter_files(self, directory: str, prefix: str) -> Iterator[Path]:
+        """Yield the files of a directory, then the files of its subdirectories.
+
+        `prefix` is the path of `directory` relative to the input directory,
+        used to match the include and exclude patterns.
+
+        """
+        with os.scandir(directory) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+        dirs_to_explore = []
+        for entry in entries:
+            rel_path = prefix + entry.name
+            # DirEntry.is_dir uses the file type returned with the listing, no extra stat
+            if entry.is_dir():
+                if self.recursive and not _matches(rel_path, entry.name, self.exclude_globs):
+                    dirs_to_explore.append((entry.path, rel_path + "/"))
+                continue
+            if self.exclude_hidden and entry.name.startswith("."):
+                continue
+            input_file = Path(entry.path)
+            if self.required_exts is not None and input_file.suffix not in self.required_exts:
+                continue
+            if self.include_globs is not None and not _matches(rel_path, entry.name, self.include_globs):
+                continue
+            if _matches(rel_path, entry.name, self.exclude_globs):
+                continue
+            if self.max_file_size is not None and entry.stat().st_size > self.max_file_size:
+                logging.debug(f"> [SimpleDirectoryReader] Skipping large file {entry.path}")
+                continue
+            yield input_file
+
+        for dir_path, dir_prefix in dirs_to_explore:
+            yield from self._iter_files(dir_path, dir_prefix)
+
+    def _parse_files(self) -> Iterator[Optional[Union[str, List[str], List[Document]]]]:
+        """Parse the input files, in order."""
+        parse = partial(_parse_file, file_extractor=self.file_extractor, errors=self.errors)
+        if self.num_workers is not None and self.num_workers > 1 and len(self.input_files) > 1:
+            # multiprocessing refuses to start the pool from a daemonic process, parse in this one
+            if multiprocessing.current_process().daemon:
+                logging.debug("> [SimpleDirectoryReader] Parsing sequentially in a daemonic process")
+            else:
+                # the extractor is sent once per process rather than with every file
+                parse = partial(_parse_in_worker, errors=self.errors)
+                with ProcessPoolExecutor(max_workers=self.num_workers, initializer=_init_worker,
+                                         initargs=(self.file_extractor,)) as executor:
+                    # only keep a few files ahead of the consumer, so parsed text does not pile up
+                    files = iter(self.input_files)
+                    window = deque(executor.submit(parse, f) for f in islice(files, 2 * self.num_workers))
+                    while window:
+                        data = window.popleft().result()
+                        next_file = next(files, None)
+                        if next_file is not None:
+                            window.append(executor.submit(parse, next_file))
+                        yield data
+                return
+        for input_file in self.input_files:
+            yield parse(input_file)
+
+    def _iter_file_documents(self) -> Iterator[List[Document]]:
+        """Yield the documents of each file that could be parsed."""
+        for input_file, data in zip(self.input_files, self._parse_files()):
+            if data is None:
+                continue
+            items = data if isinstance(data, List) else [str(data)]
+            metadata = self.file_metadata(str(input_file)) if self.file_metadata is not None else None
+            yield [self._to_document(item, metadata) for item in items]
+
+    @staticmethod
+    def _to_document(item: Union[str, Document], metadata: Optional[Dict]) -> Document:
+        """Wrap a parsed text in a Document, parsers may also return Documents with section metadata."""
+        if isinstance(item, Document):
+            if metadata is not None:
+                item.extra_info = {**metadata, **(item.extra_info or {})}
+            return item
+        return Document(item, extra_info=dict(metadata) if metadata is not None else None)
+
+    def iter_documents(self) -> Iterator[Document]:
+        """Lazily load documents, parsing one file at a time.
+
+        Only the file being parsed (or `num_workers` files ahead of the
+        consumer) is held in memory.
+
+        """
+        for documents in self._iter_file_documents():
+            yield from documents
+
+    def iter_data(self, batch_size: Optional[int] = None) -> Iterator[List[Document]]:
+        """Lazily load documents in batches.
+
+        Args:
+            batch_size (Optional[int]): Number of documents per batch.
+                By default one batch is yielded per file.
+
+        """
+        if batch_size is None:
+            yield from self._iter_file_documents()
+            return
+        documents = self.iter_documents()
+        while True:
+            batch = list(islice(documents, batch_size))
+            if not batch:
+                return
+            yield batch
+
     def load_data(self, concatenate: bool = False) -> List[Document]:
         """Load data from the input directory.
 
@@ -135,29 +286,6 @@ class SimpleDirectoryReader(BaseReader):
             List[Document]: A list of documents.
 
         """
-        data: Union[str, List[str]] = ""
-        data_list: List[str] = []
-        metadata_list = []
-        for input_file in self.input_files:
-            if input_file.suffix in self.file_extractor:
-                parser = self.file_extractor[input_file.suffix]
-                if not parser.parser_config_set:
-                    parser.init_parser()
-                data = parser.parse_file(input_file, errors=self.errors)
-            else:
-                # do standard read
-                with open(input_file, "r", errors=self.errors) as f:
-                    data = f.read()
-            if isinstance(data, List):
-                data_list.extend(data)
-            else:
-                data_list.append(str(data))
-            if self.file_metadata is not None:
-                metadata_list.append(self.file_metadata(str(input_file)))
-
         if concatenate:
-            return [Document("\n".join(data_list))]
-        elif self.file_metadata is not None:
-            return [Document(d, extra_info=m) for d, m in zip(data_list, metadata_list)]
-        else:
-            return [Document(d) for d in data_list]
+            return [Document("\n".join(doc.text for doc in self.iter_documents()))]
+        return list(self.iter_documents())
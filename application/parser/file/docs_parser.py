@@ -3,41 +3,124 @@
 Contains parsers for docx, pdf files.
 
 """
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 from parser.file.base_parser import BaseParser
+from parser.schema.base import Document
+
+
+def _iter_page_texts(pdf, file: Path, start: int, stop: int) -> Iterator[Tuple[int, str]]:
+    """Yield the (page number, text) of pages [start, stop) that have text.
+
+    Pages that fail to extract are logged and skipped.
+
+    """
+    for page in range(start, min(stop, len(pdf.pages))):
+        try:
+            page_text = pdf.pages[page].extract_text()
+        except Exception as e:
+            logging.warning(f"> [PDFParser] Failed to extract page {page + 1} of {file}: {e}")
+            continue
+        if page_text and page_text.strip():
+            yield page + 1, page_text
+
+
+def _extract_pages(file: Path, start: int, stop: int) -> List[Tuple[int, str]]:
+    """Extract the text of pages [start, stop) of a PDF.
+
+    Defined at module level so it can be sent to worker processes.
+
+    """
+    import PyPDF2
+
+    with open(file, "rb") as fp:
+        return list(_iter_page_texts(PyPDF2.PdfReader(fp), file, start, stop))
+
+
+def _num_pages(pdf) -> int:
+    """Number of pages, from the page tree root when possible.
+
+    `len(pdf.pages)` loads every page object of the file first.
+
+    """
+    try:
+        return int(pdf.trailer["/Root"]["/Pages"]["/Count"])
+    except Exception:
+        return len(pdf.pages)
 
 
 class PDFParser(BaseParser):
-    """PDF parser."""
+    """PDF parser.
+
+    Extracts one document per page, tagged with its page number. Large
+    files are split into ranges of pages extracted in parallel processes.
+
+    Args:
+        num_workers (Optional[int]): Number of processes to extract pages
+            in. Defaults to the number of CPUs. SimpleDirectoryReader sets it
+            to 1 in its worker processes, which already parse files in
+            parallel.
+        min_pages_per_task (int): Files with no more pages than this are
+            extracted in the current process.
+
+    """
+
+    def __init__(
+        self,
+        *args: Any,
+        num_workers: Optional[int] = None,
+        min_pages_per_task: int = 64,
+        **kwargs: Any,
+    ) -> None:
+        """Init params."""
+        super().__init__(*args, **kwargs)
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self._min_pages_per_task = min_pages_per_task
 
     def _init_parser(self) -> Dict:
         """Init parser."""
         return {}
 
-    def parse_file(self, file: Path, errors: str = "ignore") -> str:
-        """Parse file."""
+    def iter_pages(self, file: Path) -> Iterator[Tuple[int, str]]:
+        """Yield the (page number, text) of the pages with text, in order.
+
+        In parallel mode, each process opens the file once per range of
+        pages. Opening a PDF loads its whole page tree, so files are split
+        into about two ranges per process rather than many small ones.
+
+        """
         try:
             import PyPDF2
         except ImportError:
             raise ValueError("PyPDF2 is required to read PDF files.")
-        text_list = []
         with open(file, "rb") as fp:
-            # Create a PDF object
             pdf = PyPDF2.PdfReader(fp)
-
-            # Get the number of pages in the PDF document
-            num_pages = len(pdf.pages)
-
-            # Iterate over every page
-            for page in range(num_pages):
-                # Extract the text from the page
-                page_text = pdf.pages[page].extract_text()
-                text_list.append(page_text)
-        text = "\n".join(text_list)
-
-        return text
+            num_pages = _num_pages(pdf)
+            # daemonic processes, such as the workers of a multiprocessing.Pool, cannot start children
+            if (self.num_workers < 2 or num_pages <= self._min_pages_per_task
+                    or multiprocessing.current_process().daemon):
+                yield from _iter_page_texts(pdf, file, 0, num_pages)
+                return
+
+        pages_per_task = max(self._min_pages_per_task, -(-num_pages // (2 * self.num_workers)))
+        ranges = [(start, start + pages_per_task) for start in range(0, num_pages, pages_per_task)]
+        with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+            futures = [executor.submit(_extract_pages, file, start, stop) for start, stop in ranges]
+            for future in futures:
+                yield from future.result()
+
+    def parse_file(self, file: Path, errors: str = "ignore") -> List[Document]:
+        """Parse file into one document per page, with the `page` number in its metadata.
+
+        The pages are returned together, as SimpleDirectoryReader expects
+        from a parser. Use `iter_pages` to process them as they are extracted.
+        """
+        return [Document(text, extra_info={"page": page}) for page, text in self.iter_pages(file)]
 
 
 class DocxParser(BaseParser):
@@ -2,21 +2,87 @@
 
 Contains parsers for epub files.
 """
-
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict
+from typing import Any, Dict, List, Optional
 
 from parser.file.base_parser import BaseParser
+from parser.schema.base import Document
+
+_HEADING_RE = re.compile(r"<(h[1-3]|title)[^>]*>(.*?)</\1>", re.IGNORECASE | re.DOTALL)
+_TAG_RE = re.compile(r"<[^>]*>")
+
+
+def _html_to_text(html: str) -> str:
+    """Convert a chapter to text. Defined at module level so it can be sent to worker processes."""
+    import html2text
+
+    return html2text.html2text(html)
+
+
+def _toc_titles(toc, titles: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """Map the file name of every table of contents entry to its title."""
+    from ebooklib import epub
+
+    titles = {} if titles is None else titles
+    for entry in toc:
+        if isinstance(entry, tuple):
+            # a section and its children
+            section, children = entry
+            _toc_titles([section], titles)
+            _toc_titles(children, titles)
+        elif isinstance(entry, (epub.Link, epub.Section)) and getattr(entry, "href", None):
+            # the first entry of a file is its title, later ones are anchors inside it
+            titles.setdefault(entry.href.split("#")[0], entry.title)
+    return titles
+
+
+def _heading_title(html: str) -> Optional[str]:
+    """Title of a chapter from its first heading, or its <title>."""
+    for match in _HEADING_RE.finditer(html):
+        title = " ".join(_TAG_RE.sub("", match.group(2)).split())
+        if title:
+            return title
+    return None
 
 
 class EpubParser(BaseParser):
-    """Epub Parser."""
+    """Epub Parser.
+
+    Extracts one document per chapter of the spine, in reading order, with
+    the chapter number and title in its metadata. Titles come from the
+    table of contents, or from the first heading of the chapter.
+
+    Args:
+        num_workers (Optional[int]): Number of processes converting chapters
+            to text. Defaults to the number of CPUs. SimpleDirectoryReader
+            sets it to 1 in its worker processes, where each book is already
+            converted in a process of its own.
+        min_chapters (int): Books with fewer chapters are converted in the
+            current process.
+
+    """
+
+    def __init__(
+        self,
+        *args: Any,
+        num_workers: Optional[int] = None,
+        min_chapters: int = 8,
+        **kwargs: Any,
+    ) -> None:
+        """Init params."""
+        super().__init__(*args, **kwargs)
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self._min_chapters = min_chapters
 
     def _init_parser(self) -> Dict:
         """Init parser."""
         return {}
 
-    def parse_file(self, file: Path, errors: str = "ignore") -> str:
+    def parse_file(self, file: Path, errors: str = "ignore") -> List[Document]:
         """Parse file."""
         try:
             import ebooklib
@@ -24,20 +90,38 @@ class EpubParser(BaseParser):
         except ImportError:
             raise ValueError("`EbookLib` is required to read Epub files.")
         try:
-            import html2text
+            import html2text  # noqa: F401
         except ImportError:
             raise ValueError("`html2text` is required to parse Epub files.")
 
-        text_list = []
         book = epub.read_epub(file, options={"ignore_ncx": True})
+        toc_titles = _toc_titles(book.toc)
+
+        chapters = []
+        for idref, _ in book.spine:
+            item = book.get_item_with_id(idref)
+            # the spine may also reference images or svg pages
+            if item is None or item.get_type() != ebooklib.ITEM_DOCUMENT:
+                continue
+            html = item.get_content().decode("utf-8", errors=errors)
+            chapters.append((toc_titles.get(item.get_name()) or _heading_title(html), html))
 
-        # Iterate through all chapters.
-        for item in book.get_items():
-            # Chapters are typically located in epub documents items.
-            if item.get_type() == ebooklib.ITEM_DOCUMENT:
-                text_list.append(
-                    html2text.html2text(item.get_content().decode("utf-8"))
-                )
+        htmls = [html for _, html in chapters]
+        # html2text is pure python, chapters are only worth sending to other processes
+        # when there are many, and a daemonic process may not start any
+        if (self.num_workers < 2 or len(chapters) < self._min_chapters
+                or multiprocessing.current_process().daemon):
+            texts = map(_html_to_text, htmls)
+        else:
+            with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+                texts = list(executor.map(_html_to_text, htmls))
 
-        text = "\n".join(text_list)
-        return text
+        results = []
+        for number, ((title, _), text) in enumerate(zip(chapters, texts), start=1):
+            if not text.strip():
+                continue
+            extra_info = {"chapter": number}
+            if title:
+                extra_info["chapter_title"] = title
+            results.append(Document(text, extra_info=extra_info))
+        return results
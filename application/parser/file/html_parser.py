@@ -5,81 +5,151 @@ Contains parser for html files.
 """
 import re
 from pathlib import Path
-from typing import Dict, Union
+from typing import Any, Dict, List, Optional, Tuple
 
 from parser.file.base_parser import BaseParser
+from parser.schema.base import Document
+
+HEADINGS = {"h1": 1, "h2": 2, "h3": 3, "h4": 4, "h5": 5, "h6": 6}
+# elements whose content is never text of the page
+SKIPPED_TAGS = {"head", "script", "style", "noscript", "template", "svg"}
+# elements that separate words, so "<p>a</p><p>b</p>" reads "a b"
+BLOCK_TAGS = {
+    "address", "article", "aside", "blockquote", "br", "dd", "div", "dl", "dt", "figcaption",
+    "figure", "footer", "form", "header", "hr", "li", "main", "nav", "ol", "p", "pre", "section",
+    "table", "td", "th", "tr", "ul",
+}
+# "¶" permalinks added to headings by Sphinx
+_HEADERLINK_RE = re.compile("¶")
+_WHITESPACE_RE = re.compile(r"\s+")
+# lxml refuses str input with an encoding declaration, which XHTML exports (DITA) start with
+_XML_DECLARATION_RE = re.compile(r"^\s*<\?xml[^>]*\?>")
+
+
+def _clean_text(text: str) -> str:
+    """Drop non ascii characters and collapse whitespace."""
+    text = text.encode("ascii", "ignore").decode()
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
 
 class HTMLParser(BaseParser):
-    """HTML parser."""
+    """HTML parser.
+
+    Parses the page once with lxml and walks the tree once, grouping the text
+    under the heading (h1-h6) it follows. Each section becomes a document
+    with the page title, the path of enclosing headings and the anchor
+    (id of the heading or of its closest ancestor, as in Sphinx and DITA
+    exports) in its metadata.
+
+    Args:
+        min_chars (int): Sections with less characters, heading included,
+            are dropped.
+
+    """
+
+    def __init__(self, *args: Any, min_chars: int = 25, **kwargs: Any) -> None:
+        """Init params."""
+        super().__init__(*args, **kwargs)
+        self._min_chars = min_chars
 
     def _init_parser(self) -> Dict:
         """Init parser."""
         return {}
 
-    def parse_file(self, file: Path, errors: str = "ignore") -> Union[str, list[str]]:
-        """Parse file.
+    def html_to_sections(self, html: str) -> Tuple[str, List[Tuple[Optional[str], List[str], Optional[str], str]]]:
+        """Split html into sections.
+
+        Returns:
+            The page title and a list of (heading, heading path, anchor, text)
+            tuples, in document order. Text before the first heading has no
+            heading.
 
-            Returns:
-            Union[str, List[str]]: a string or a List of strings.
         """
         try:
-            import unstructured 
+            from lxml import etree
         except ImportError:
-            raise ValueError("unstructured package is required to parse HTML files.")
-        from unstructured.partition.html import partition_html
-        from unstructured.staging.base import convert_to_isd
-        from unstructured.cleaners.core import clean
-
-        from langchain.document_loaders import BSHTMLLoader
-        loader = BSHTMLLoader(file)
-        data = loader.load()
-        # Using the unstructured library to convert the html to isd format
-        # isd sample : isd = [
-                            #   {"text": "My Title", "type": "Title"},
-                            #   {"text": "My Narrative", "type": "NarrativeText"}
-                            # ]
-        with open(file, "r", encoding="utf-8") as fp:
-            elements = partition_html(file=fp)
-            isd = convert_to_isd(elements)  
-
-        # Removing non ascii charactwers from isd_el['text']
-        for isd_el in isd:
-            isd_el['text'] = isd_el['text'].encode("ascii", "ignore").decode()
-
-        # Removing all the \n characters from isd_el['text'] using regex and replace with single space
-        # Removing all the extra spaces  from isd_el['text'] using regex and replace with single space
-        for isd_el in isd:
-            isd_el['text'] = re.sub(r'\n', ' ', isd_el['text'], flags=re.MULTILINE|re.DOTALL)
-            isd_el['text'] = re.sub(r"\s{2,}"," ", isd_el['text'], flags=re.MULTILINE|re.DOTALL)
-
-        # more cleaning: extra_whitespaces, dashes, bullets, trailing_punctuation
-        for isd_el in isd:
-            clean(isd_el['text'], extra_whitespace=True, dashes=True, bullets=True, trailing_punctuation=True )
-
-        # Creating a list of all the indexes of isd_el['type'] = 'Title'
-        title_indexes = [i for i,isd_el in enumerate(isd) if isd_el['type'] == 'Title']
-
-        # Creating 'Chunks' - List of lists of strings 
-        # each list starting with with isd_el['type'] = 'Title' and all the data till the next 'Title'
-        # Each Chunk can be thought of as an individual set of data, which can be sent to the model
-        # Where Each Title is grouped together with the data under it
-
-        Chunks = [[]]
-        final_chunks = list(list())
-
-        for i,isd_el in enumerate(isd):
-            if i in title_indexes:
-                Chunks.append([])
-            Chunks[-1].append(isd_el['text'])
-
-        # Removing all the chunks with sum of lenth of all the strings in the chunk < 25 #TODO: This value can be an user defined variable
-        for chunk in Chunks:
-            # sum of lenth of all the strings in the chunk
-            sum = 0
-            sum += len(str(chunk))
-            if sum < 25:
-                Chunks.remove(chunk)
-            else :         
-                # appending all the approved chunks to final_chunks as a single string       
-                final_chunks.append(" ".join([str(item) for item in chunk]))
-        return final_chunks
+            raise ValueError("lxml package is required to parse HTML files.")
+
+        html = _XML_DECLARATION_RE.sub("", html, count=1)
+        if not html.strip():
+            return "", []
+        # plain etree elements, the lxml.html element classes are noticeably slower to walk
+        root = etree.fromstring(html, etree.HTMLParser())
+        if root is None:
+            return "", []
+        title = _clean_text(root.findtext(".//title") or "")
+        sections: List[Tuple[Optional[str], List[str], Optional[str], str]] = []
+        heading_stack: List[Tuple[int, str]] = []
+        current: Tuple[Optional[str], List[str], Optional[str]] = (None, [], None)
+        parts: List[str] = []
+        # element whose subtree is being skipped, its tail is still text
+        skipping = None
+
+        def close_section() -> None:
+            text = _clean_text("".join(parts))
+            heading = current[0]
+            full_text = text if heading is None else f"{heading} {text}".strip()
+            if len(full_text) >= self._min_chars:
+                sections.append(current + (full_text,))
+
+        for event, el in etree.iterwalk(root, events=("start", "end", "comment", "pi")):
+            if skipping is not None:
+                if event == "end" and el is skipping:
+                    skipping = None
+                    parts.append(el.tail or "")
+                continue
+            if event in ("comment", "pi"):
+                # no text of their own, but the text after them is
+                parts.append(el.tail or "")
+            elif event == "start":
+                if el.tag in SKIPPED_TAGS:
+                    skipping = el
+                elif el.tag in HEADINGS:
+                    close_section()
+                    heading = _clean_text(_HEADERLINK_RE.sub("", "".join(el.itertext())))
+                    level = HEADINGS[el.tag]
+                    while heading_stack and heading_stack[-1][0] >= level:
+                        heading_stack.pop()
+                    heading_stack.append((level, heading))
+                    current = (heading, [h for _, h in heading_stack], self._anchor(el))
+                    parts = []
+                    skipping = el
+                else:
+                    if el.tag in BLOCK_TAGS:
+                        parts.append(" ")
+                    parts.append(el.text or "")
+            else:
+                if el.tag in BLOCK_TAGS:
+                    parts.append(" ")
+                parts.append(el.tail or "")
+        close_section()
+        return title, sections
+
+    @staticmethod
+    def _anchor(heading) -> Optional[str]:
+        """Id of the heading, or of its closest ancestor with one."""
+        if heading.get("id"):
+            return heading.get("id")
+        for ancestor in heading.iterancestors():
+            if ancestor.tag == "body":
+                break
+            if ancestor.get("id"):
+                return ancestor.get("id")
+        return None
+
+    def parse_file(self, file: Path, errors: str = "ignore") -> List[Document]:
+        """Parse file into one document per section.
+
+        The page `title`, `header_path` and `anchor` of each section are kept
+        in its metadata.
+        """
+        with open(file, "r", encoding="utf-8", errors=errors) as fp:
+            html = fp.read()
+        title, sections = self.html_to_sections(html)
+        results = []
+        for _, path, anchor, text in sections:
+            extra_info = {"title": title, "header_path": " > ".join(path)}
+            if anchor is not None:
+                extra_info["anchor"] = anchor
+            results.append(Document(text, extra_info=extra_info))
+        return results
@@ -5,10 +5,15 @@ Contains parser for md files.
 """
 import re
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple, Union, cast
+from typing import Any, Dict, List, Optional, Pattern, Tuple
 
 from parser.file.base_parser import BaseParser
-import tiktoken
+from parser.schema.base import Document
+from parser.token_func import split_text
+
+# a header line, "\n" is excluded from the separator so a lone "#" line is not a header
+_HEADER_RE = re.compile(r"^(#+)[^\S\n](.*)$", re.MULTILINE)
+_TAG_RE = re.compile(r"<.*?>")
 
 
 class MarkdownParser(BaseParser):
@@ -34,56 +39,88 @@ class MarkdownParser(BaseParser):
         self._remove_images = remove_images
         self._max_tokens = max_tokens
         # self._remove_tables = remove_tables
+        self._cleanup_re = self._compile_cleanup()
+
+    def _compile_cleanup(self) -> Optional[Pattern]:
+        """Combine the enabled image and hyperlink rules into one regex, if any.
 
+        Html tags are removed in a second scan, once links are replaced by
+        their text, so that tags in the text of a link are removed as well.
+        """
+        rules = []
+        if self._remove_images:
+            rules.append(r"!\[\[.*\]\]")
+        if self._remove_hyperlinks:
+            rules.append(r"\[(?P<link>.*?)\]\(.*?\)")
+        return re.compile("|".join(rules)) if rules else None
 
     def tups_chunk_append(self, tups: List[Tuple[Optional[str], str]], current_header: Optional[str], current_text: str):
-        """Append to tups chunk."""
-        num_tokens = len(tiktoken.get_encoding("cl100k_base").encode(current_text))
-        if num_tokens > self._max_tokens:
-            chunks = [current_text[i:i + self._max_tokens] for i in range(0, len(current_text), self._max_tokens)]
-            for chunk in chunks:
-                tups.append((current_header, chunk))
-        else:
+        """Append to tups chunk, splitting text longer than max_tokens by tokens."""
+        # a token is at least one byte, so short texts can skip encoding
+        if len(current_text.encode("utf-8")) <= self._max_tokens:
             tups.append((current_header, current_text))
+            return tups
+        for chunk in split_text(current_text, self._max_tokens):
+            tups.append((current_header, chunk))
         return tups
+
+    def markdown_to_sections(self, markdown_text: str) -> List[Tuple[Optional[str], List[str], str]]:
+        """Split markdown into sections.
+
+        The text is cleaned up with two regex scans, then the header lines
+        are found in a single scan and the sections are sliced out between
+        them, without building them line by line.
+
+        Returns:
+            List of (header, header path, text) tuples. The header path holds
+            the titles of the enclosing headers, e.g. ["Install", "Linux"] for
+            a "## Linux" section under "# Install". Sections longer than
+            max_tokens are split into several tuples with the same header.
+
+        """
+        if self._cleanup_re is not None:
+            # hyperlinks are replaced by their text, images are dropped
+            template = r"\g<link>" if self._remove_hyperlinks else ""
+            markdown_text = self._cleanup_re.sub(template, markdown_text)
+        markdown_text = _TAG_RE.sub("", markdown_text)
+        sections: List[Tuple[Optional[str], List[str], str]] = []
+        # titles of the enclosing headers, by level
+        header_stack: List[Tuple[int, str]] = []
+        current_header: Optional[str] = None
+        current_path: List[str] = []
+        section_start = 0
+
+        def close_section(text: str) -> None:
+            if not text.strip():
+                return
+            for header, chunk in self.tups_chunk_append([], current_header, text):
+                if chunk.strip():
+                    sections.append((header, current_path, chunk))
+
+        for header_match in _HEADER_RE.finditer(markdown_text):
+            close_section(markdown_text[section_start:header_match.start()])
+            level = len(header_match.group(1))
+            title = header_match.group(2).strip()
+            while header_stack and header_stack[-1][0] >= level:
+                header_stack.pop()
+            header_stack.append((level, title))
+            current_header = title
+            current_path = [t for _, t in header_stack]
+            section_start = header_match.end() + 1
+        close_section(markdown_text[section_start:])
+
+        if current_header is None:
+            # files without headers are flattened to a single line, as before
+            sections = [(None, path, text.replace("\n", "")) for _, path, text in sections]
+        return sections
+
     def markdown_to_tups(self, markdown_text: str) -> List[Tuple[Optional[str], str]]:
         """Convert a markdown file to a dictionary.
 
         The keys are the headers and the values are the text under each header.
 
         """
-        markdown_tups: List[Tuple[Optional[str], str]] = []
-        lines = markdown_text.split("\n")
-
-        current_header = None
-        current_text = ""
-
-        for line in lines:
-            header_match = re.match(r"^#+\s", line)
-            if header_match:
-                if current_header is not None:
-                    if current_text == "" or None:
-                        continue
-                    markdown_tups = self.tups_chunk_append(markdown_tups, current_header, current_text)
-
-                current_header = line
-                current_text = ""
-            else:
-                current_text += line + "\n"
-        markdown_tups = self.tups_chunk_append(markdown_tups, current_header, current_text)
-
-        if current_header is not None:
-            # pass linting, assert keys are defined
-            markdown_tups = [
-                (re.sub(r"#", "", cast(str, key)).strip(), re.sub(r"<.*?>", "", value))
-                for key, value in markdown_tups
-            ]
-        else:
-            markdown_tups = [
-                (key, re.sub("\n", "", value)) for key, value in markdown_tups
-            ]
-
-        return markdown_tups
+        return [(header, text) for header, _, text in self.markdown_to_sections(markdown_text)]
 
     def remove_images(self, content: str) -> str:
         """Get a dictionary of a markdown file from its path."""
@@ -114,31 +151,29 @@ class MarkdownParser(BaseParser):
         """Initialize the parser with the config."""
         return {}
 
+    def parse_sections(
+        self, filepath: Path, errors: str = "ignore"
+    ) -> List[Tuple[Optional[str], List[str], str]]:
+        """Parse file into (header, header path, text) sections."""
+        with open(filepath, "r", errors=errors) as f:
+            content = f.read()
+        return self.markdown_to_sections(content)
+
     def parse_tups(
         self, filepath: Path, errors: str = "ignore"
     ) -> List[Tuple[Optional[str], str]]:
         """Parse file into tuples."""
-        with open(filepath, "r") as f:
-            content = f.read()
-        if self._remove_hyperlinks:
-            content = self.remove_hyperlinks(content)
-        if self._remove_images:
-            content = self.remove_images(content)
-        # if self._remove_tables:
-        #     content = self.remove_tables(content)
-        markdown_tups = self.markdown_to_tups(content)
-        return markdown_tups
+        return [(header, text) for header, _, text in self.parse_sections(filepath, errors=errors)]
 
     def parse_file(
         self, filepath: Path, errors: str = "ignore"
-    ) -> Union[str, List[str]]:
-        """Parse file into string."""
-        tups = self.parse_tups(filepath, errors=errors)
+    ) -> List[Document]:
+        """Parse file into one document per section.
+
+        The header path of each section is kept in the `header_path` metadata.
+        """
         results = []
-        # TODO: don't include headers right now
-        for header, value in tups:
-            if header is None:
-                results.append(value)
-            else:
-                results.append(f"\n\n{header}\n{value}")
+        for header, path, value in self.parse_sections(filepath, errors=errors):
+            text = value if header is None else f"\n\n{header}\n{value}"
+            results.append(Document(text, extra_info={"header_path": " > ".join(path)}))
         return results
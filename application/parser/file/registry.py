@@ -0,0 +1,125 @@
+"""Parser registry.
+
+Maps file extensions to parser factories. A parser, and the module it is
+defined in, is only imported and instantiated the first time a file with
+its extension is parsed, so reading a folder of markdown files never
+imports pandas, PyPDF2 or ebooklib.
+
+Other packages can add parsers through the `docsgpt.parsers` entry point
+group, naming the entry point after the extension it handles:
+
+    [options.entry_points]
+    docsgpt.parsers =
+        .xml = my_package.parsers:XMLParser
+
+"""
+import importlib
+import logging
+from typing import Callable, Dict, Iterator, Mapping, Union
+
+from parser.file.base_parser import BaseParser
+
+ENTRY_POINT_GROUP = "docsgpt.parsers"
+
+# "module:attribute" paths, resolved on first use
+DEFAULT_PARSERS: Dict[str, str] = {
+    ".pdf": "parser.file.docs_parser:PDFParser",
+    ".docx": "parser.file.docs_parser:DocxParser",
+    ".csv": "parser.file.tabular_parser:PandasCSVParser",
+    ".epub": "parser.file.epub_parser:EpubParser",
+    ".md": "parser.file.markdown_parser:MarkdownParser",
+    ".rst": "parser.file.rst_parser:RstParser",
+    ".html": "parser.file.html_parser:HTMLParser",
+    ".mdx": "parser.file.markdown_parser:MarkdownParser",
+}
+
+ParserFactory = Union[str, Callable[[], BaseParser]]
+
+
+def _resolve(factory: ParserFactory) -> BaseParser:
+    """Build a parser from a "module:attribute" path, an entry point or a callable."""
+    if isinstance(factory, str):
+        module_name, _, attribute = factory.partition(":")
+        factory = getattr(importlib.import_module(module_name), attribute)
+    elif hasattr(factory, "load"):
+        factory = factory.load()
+    return factory()
+
+
+class ParserRegistry(Mapping[str, BaseParser]):
+    """Lazy mapping of file extension -> parser.
+
+    Can be used wherever a `file_extractor` dict is expected. Looking up an
+    extension instantiates and initializes its parser once; checking if an
+    extension is supported imports nothing.
+
+    Args:
+        factories (Optional[Dict[str, ParserFactory]]): Extension -> factory,
+            a "module:attribute" path or a callable returning a parser.
+            Defaults to DEFAULT_PARSERS.
+        load_entry_points (bool): Whether to add the parsers registered in
+            the `docsgpt.parsers` entry point group. Registered factories
+            take precedence over entry points.
+
+    """
+
+    def __init__(self, factories: Dict[str, ParserFactory] = None, load_entry_points: bool = True) -> None:
+        """Init params."""
+        self._factories: Dict[str, ParserFactory] = dict(DEFAULT_PARSERS if factories is None else factories)
+        self._parsers: Dict[str, BaseParser] = {}
+        self._load_entry_points = load_entry_points
+        self._entry_points_loaded = False
+
+    def register(self, extension: str, factory: ParserFactory) -> None:
+        """Register a parser factory for an extension, replacing any previous one."""
+        self._ensure_entry_points()
+        self._factories[extension] = factory
+        self._parsers.pop(extension, None)
+
+    def _ensure_entry_points(self) -> None:
+        if self._entry_points_loaded or not self._load_entry_points:
+            return
+        self._entry_points_loaded = True
+        from importlib.metadata import entry_points
+
+        try:
+            found = entry_points(group=ENTRY_POINT_GROUP)
+        except TypeError:
+            # python < 3.10
+            found = entry_points().get(ENTRY_POINT_GROUP, [])
+        for entry_point in found:
+            # entry points are only loaded when their extension is first parsed
+            self._factories.setdefault(entry_point.name, entry_point)
+
+    def __getitem__(self, extension: str) -> BaseParser:
+        parser = self._parsers.get(extension)
+        if parser is None:
+            self._ensure_entry_points()
+            if extension not in self._factories:
+                raise KeyError(extension)
+            parser = _resolve(self._factories[extension])
+            if not parser.parser_config_set:
+                parser.init_parser()
+            logging.debug(f"> [ParserRegistry] Loaded {type(parser).__name__} for {extension}")
+            self._parsers[extension] = parser
+        return parser
+
+    def __contains__(self, extension: object) -> bool:
+        self._ensure_entry_points()
+        return extension in self._factories
+
+    def __iter__(self) -> Iterator[str]:
+        self._ensure_entry_points()
+        return iter(self._factories)
+
+    def __len__(self) -> int:
+        self._ensure_entry_points()
+        return len(self._factories)
+
+    def __getstate__(self) -> Dict:
+        # entry points are looked up here once, instead of again in every process the
+        # registry is sent to. Processes get the factories only and build the parsers they need.
+        self._ensure_entry_points()
+        state = self.__dict__.copy()
+        state["_parsers"] = {}
+        return state
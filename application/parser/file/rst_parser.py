@@ -1,14 +1,18 @@
 """reStructuredText parser.
 
-Contains parser for md files.
+Contains parser for rst files.
 
 """
 import re
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple, Union, cast
+from typing import Any, Dict, List, Match, Optional, Pattern, Tuple
 
 from parser.file.base_parser import BaseParser
-import tiktoken
+from parser.schema.base import Document
+
+# a line made of one punctuation character repeated, candidate over/underline of a header
+_ADORNMENT_RE = re.compile(r"^([!-/:-@\[-`{-~])\1+[^\S\n]*$", re.MULTILINE)
+
 
 class RstParser(BaseParser):
     """reStructuredText parser.
@@ -40,7 +44,110 @@ class RstParser(BaseParser):
         self._remove_directives = remove_directives
         self._remove_whitespaces_excess = remove_whitespaces_excess
         self._remove_characters_excess = remove_characters_excess
+        self._cleanup_re = self._compile_cleanup()
+        self._excess_re = self._compile_excess()
+
+    def _compile_cleanup(self) -> Optional[Pattern]:
+        """Combine the enabled cleanup rules into one regex.
+
+        Hyperlinks are kept in the named group `link`, every other match is
+        dropped, so the text is cleaned up with a single scan.
+        """
+        rules = []
+        if self._remove_hyperlinks:
+            rules.append(r"`(?P<link>.*?) <.*?>`_")
+        if self._remove_images:
+            rules.append(r"\.\. image:: .*")
+        if self._remove_table_excess:
+            rules.append(r"^\+-+\+-+\+$")
+        if self._remove_directives:
+            rules.append(r"`\.\.[^:]+::")
+        if self._remove_interpreters:
+            rules.append(r":\w+:")
+        return re.compile("|".join(rules), re.MULTILINE) if rules else None
+
+    def _compile_excess(self) -> Optional[Pattern]:
+        """Combine the enabled excess rules (whitespaces, characters) into one regex."""
+        rules = []
+        if self._remove_whitespaces_excess:
+            rules.append(r"(?P<spaces>\s{2,})")
+        if self._remove_characters_excess:
+            rules.append(r"(?P<char>\S)(?P=char){2,}")
+        return re.compile("|".join(rules)) if rules else None
+
+    @staticmethod
+    def _replace_excess(match: Match) -> str:
+        # the spaces group is missing from the regex when whitespaces are kept
+        if match.lastgroup == "spaces":
+            return "  "
+        return match.group("char") * 3
+
+    def rst_to_sections(self, rst_text: str) -> List[Tuple[Optional[str], List[str], str]]:
+        """Split reStructuredText into sections.
+
+        Only adornment lines (a punctuation character repeated over the whole
+        line) are candidates for headers, and they are found with a single
+        scan. A candidate is a header underline if the line above it is a
+        title at most as long as the adornment, optionally with a matching
+        overline above the title. Header levels follow the order in which
+        adornment styles first appear, as in docutils.
+
+        Returns:
+            List of (header, header path, text) tuples. The header path holds
+            the titles of the enclosing headers, e.g. ["Install", "Linux"].
+
+        """
+        if self._cleanup_re is not None:
+            template = r"\g<link>" if self._remove_hyperlinks else ""
+            rst_text = self._cleanup_re.sub(template, rst_text)
+        sections: List[Tuple[Optional[str], List[str], str]] = []
+        styles: List[Tuple[str, bool]] = []
+        header_stack: List[Tuple[int, str]] = []
+        current_header: Optional[str] = None
+        current_path: List[str] = []
+        section_start = 0
+
+        def close_section(text: str) -> None:
+            if self._excess_re is not None:
+                text = self._excess_re.sub(self._replace_excess, text)
+            if text.strip():
+                sections.append((current_header, current_path, text))
+
+        for adornment in _ADORNMENT_RE.finditer(rst_text):
+            underline = adornment.group().rstrip()
+            title_end = adornment.start() - 1
+            title_start = rst_text.rfind("\n", 0, title_end) + 1
+            if title_end < 0 or title_start < section_start:
+                continue
+            title = rst_text[title_start:title_end]
+            if not title.strip() or len(title.rstrip()) > len(underline) or _ADORNMENT_RE.match(title):
+                continue
+            header_start = title_start
+            overline_start = rst_text.rfind("\n", 0, title_start - 1) + 1
+            has_overline = (title_start > 0 and overline_start >= section_start
+                            and rst_text[overline_start:title_start - 1].rstrip() == underline)
+            if has_overline:
+                header_start = overline_start
+            elif title[0].isspace():
+                # only titles with an overline may be indented
+                continue
+
+            close_section(rst_text[section_start:header_start])
+            style = (underline[0], has_overline)
+            if style not in styles:
+                styles.append(style)
+            level = styles.index(style)
+            while header_stack and header_stack[-1][0] >= level:
+                header_stack.pop()
+            current_header = title.strip()
+            header_stack.append((level, current_header))
+            current_path = [t for _, t in header_stack]
+            section_start = adornment.end() + 1
+        close_section(rst_text[section_start:])
 
+        if current_header is None:
+            sections = [(None, path, text.replace("\n", "")) for _, path, text in sections]
+        return sections
 
     def rst_to_tups(self, rst_text: str) -> List[Tuple[Optional[str], str]]:
         """Convert a reStructuredText file to a dictionary.
@@ -48,48 +155,7 @@ class RstParser(BaseParser):
         The keys are the headers and the values are the text under each header.
 
         """
-        rst_tups: List[Tuple[Optional[str], str]] = []
-        lines = rst_text.split("\n")
-
-        current_header = None
-        current_text = ""
-
-        for i, line in enumerate(lines):
-            header_match = re.match(r"^[^\S\n]*[-=]+[^\S\n]*$", line)
-            if header_match and i > 0 and (len(lines[i - 1].strip()) == len(header_match.group().strip()) or lines[i - 2] == lines[i - 2]):
-                if current_header is not None:
-                    if current_text == "" or None:
-                        continue
-                    # removes the next heading from current Document
-                    if current_text.endswith(lines[i - 1] + "\n"):
-                        current_text = current_text[:len(current_text) - len(lines[i - 1] + "\n")]
-                    rst_tups.append((current_header, current_text))
-
-                current_header = lines[i - 1]
-                current_text = ""
-            else:
-                current_text += line + "\n"
-
-        rst_tups.append((current_header, current_text))
-
-        #TODO: Format for rst
-        #
-        # if current_header is not None:
-        #     # pass linting, assert keys are defined
-        #     rst_tups = [
-        #         (re.sub(r"#", "", cast(str, key)).strip(), re.sub(r"<.*?>", "", value))
-        #         for key, value in rst_tups
-        #     ]
-        # else:
-        #     rst_tups = [
-        #         (key, re.sub("\n", "", value)) for key, value in rst_tups
-        #     ]
-
-        if current_header is None:
-            rst_tups = [
-                (key, re.sub("\n", "", value)) for key, value in rst_tups
-            ]
-        return rst_tups
+        return [(header, text) for header, _, text in self.rst_to_sections(rst_text)]
 
     def remove_images(self, content: str) -> str:
         pattern = r"\.\. image:: (.*)"
@@ -135,39 +201,29 @@ class RstParser(BaseParser):
         """Initialize the parser with the config."""
         return {}
 
+    def parse_sections(
+        self, filepath: Path, errors: str = "ignore"
+    ) -> List[Tuple[Optional[str], List[str], str]]:
+        """Parse file into (header, header path, text) sections."""
+        with open(filepath, "r", errors=errors) as f:
+            content = f.read()
+        return self.rst_to_sections(content)
+
     def parse_tups(
         self, filepath: Path, errors: str = "ignore"
     ) -> List[Tuple[Optional[str], str]]:
         """Parse file into tuples."""
-        with open(filepath, "r") as f:
-            content = f.read()
-        if self._remove_hyperlinks:
-            content = self.remove_hyperlinks(content)
-        if self._remove_images:
-            content = self.remove_images(content)
-        if self._remove_table_excess:
-            content = self.remove_table_excess(content)
-        if self._remove_directives:
-            content = self.remove_directives(content)
-        if self._remove_interpreters:
-            content = self.remove_interpreters(content)
-        rst_tups = self.rst_to_tups(content)
-        if self._remove_whitespaces_excess:
-            rst_tups = self.remove_whitespaces_excess(rst_tups)
-        if self._remove_characters_excess:
-            rst_tups = self.remove_characters_excess(rst_tups)
-        return rst_tups
+        return [(header, text) for header, _, text in self.parse_sections(filepath, errors=errors)]
 
     def parse_file(
         self, filepath: Path, errors: str = "ignore"
-    ) -> Union[str, List[str]]:
-        """Parse file into string."""
-        tups = self.parse_tups(filepath, errors=errors)
+    ) -> List[Document]:
+        """Parse file into one document per section.
+
+        The header path of each section is kept in the `header_path` metadata.
+        """
         results = []
-        # TODO: don't include headers right now
-        for header, value in tups:
-            if header is None:
-                results.append(value)
-            else:
-                results.append(f"\n\n{header}\n{value}")
+        for header, path, value in self.parse_sections(filepath, errors=errors):
+            text = value if header is None else f"\n\n{header}\n{value}"
+            results.append(Document(text, extra_info={"header_path": " > ".join(path)}))
         return results
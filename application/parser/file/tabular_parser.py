@@ -4,9 +4,11 @@ Contains parsers for tabular data files.
 
 """
 from pathlib import Path
-from typing import Any, Dict, List, Union
+from typing import Any, Dict, Iterator, List, Optional, Union
 
 from parser.file.base_parser import BaseParser
+from parser.schema.base import Document
+from parser.token_func import get_encoding
 
 
 class CSVParser(BaseParser):
@@ -56,6 +58,13 @@ class PandasCSVParser(BaseParser):
     Parses CSVs using the separator detection from Pandas `read_csv`function.
     If special parameters are required, use the `pandas_config` dict.
 
+    The file is read `chunk_size` rows at a time, so pandas never holds the
+    whole table, and row strings are built by concatenating whole columns.
+    Values are read as text, as written in the file, so that they do not
+    depend on the types pandas would infer for each chunk. `iter_rows` and
+    `iter_row_groups` yield rows as they are read, `parse_file` returns them
+    all, as SimpleDirectoryReader expects from a parser.
+
     Args:
         concat_rows (bool): whether to concatenate all rows into one document.
             If set to False, a Document will be created for each row.
@@ -65,14 +74,27 @@ class PandasCSVParser(BaseParser):
             Set to ", " by default.
 
         row_joiner (str): Separator to use for joining each row.
-            Only used when `concat_rows=True`.
+            Only used when `concat_rows=True` or `max_tokens` is set.
             Set to "\n" by default.
 
         pandas_config (dict): Options for the `pandas.read_csv` function call.
             Refer to https://pandas.pydata.org/docs/reference/api/pandas.read_csv.html
             for more information.
             Set to empty dict by default, this means pandas will try to figure
-            out the separators, table head, etc. on its own.
+            out the separators, table head, etc. on its own. Columns are read
+            as `str` unless a `dtype` is given.
+
+        chunk_size (int): Number of rows read from the file at a time.
+            Set to 10000 by default.
+
+        max_tokens (Optional[int]): If set, rows are grouped into documents
+            of at most this many tokens (a single longer row is a document of
+            its own), with the range of rows they hold in their metadata.
+            Takes precedence over `concat_rows`. None by default.
+
+        header_prefix (bool): whether to prefix every value with its column
+            name, e.g. "price: 10", so rows read on their own keep their
+            meaning. False by default.
 
     """
 
@@ -83,6 +105,9 @@ class PandasCSVParser(BaseParser):
         col_joiner: str = ", ",
         row_joiner: str = "\n",
         pandas_config: dict = {},
+        chunk_size: int = 10000,
+        max_tokens: Optional[int] = None,
+        header_prefix: bool = False,
         **kwargs: Any
     ) -> None:
         """Init params."""
@@ -91,25 +116,68 @@ class PandasCSVParser(BaseParser):
         self._col_joiner = col_joiner
         self._row_joiner = row_joiner
         self._pandas_config = pandas_config
+        self._chunk_size = chunk_size
+        self._max_tokens = max_tokens
+        self._header_prefix = header_prefix
 
     def _init_parser(self) -> Dict:
         """Init parser."""
         return {}
 
-    def parse_file(self, file: Path, errors: str = "ignore") -> Union[str, List[str]]:
-        """Parse file."""
+    def iter_rows(self, file: Path) -> Iterator[str]:
+        """Yield the row strings of the file."""
         try:
             import pandas as pd
         except ImportError:
             raise ValueError("pandas module is required to read CSV files.")
 
-        df = pd.read_csv(file, **self._pandas_config)
-
-        text_list = df.apply(
-            lambda row: (self._col_joiner).join(row.astype(str).tolist()), axis=1
-        ).tolist()
+        # inferring types per chunk would print "1" in one chunk and "1.0" in the next
+        config = {"dtype": str, **self._pandas_config, "chunksize": self._chunk_size}
+        with pd.read_csv(file, **config) as reader:
+            for chunk in reader:
+                if chunk.empty:
+                    continue
+                # missing values are NaN, and some pandas versions keep them through astype(str)
+                values = chunk.astype(str).fillna("nan")
+                columns = [values[col] for col in values.columns]
+                if self._header_prefix:
+                    columns = [f"{col}: " + column for col, column in zip(values.columns, columns)]
+                # concatenates whole columns instead of joining every row in a python call
+                yield from columns[0].str.cat(columns[1:], sep=self._col_joiner).tolist()
+
+    def iter_row_groups(self, file: Path) -> Iterator[Document]:
+        """Yield documents of consecutive rows of at most `max_tokens` tokens."""
+        encoding = get_encoding()
+        group: List[str] = []
+        group_tokens = 0
+        group_start = 0
+        row = 0
+
+        def make_group() -> Document:
+            return Document(
+                self._row_joiner.join(group),
+                extra_info={"row_start": group_start, "row_end": row - 1},
+                token_count=group_tokens,
+            )
+
+        for text in self.iter_rows(file):
+            # the row joiner adds at most one token per row
+            row_tokens = len(encoding.encode(text)) + 1
+            if group and group_tokens + row_tokens > self._max_tokens:
+                yield make_group()
+                group, group_tokens, group_start = [], 0, row
+            group.append(text)
+            group_tokens += row_tokens
+            row += 1
+        if group:
+            yield make_group()
+
+    def parse_file(self, file: Path, errors: str = "ignore") -> Union[str, List[str], List[Document]]:
+        """Parse file."""
+        if self._max_tokens is not None:
+            return list(self.iter_row_groups(file))
 
         if self._concat_rows:
-            return (self._row_joiner).join(text_list)
+            return (self._row_joiner).join(self.iter_rows(file))
         else:
-            return text_list
+            return list(self.iter_rows(file))
@@ -0,0 +1,276 @@
+"""FAISS index types for vector stores.
+
+Langchain builds stores on a flat index, which compares a query to every
+vector. That is exact and fast enough for small indexes, but search time
+grows with the number of chunks. Large indexes are rebuilt with an
+approximate (ANN) index once ingestion is done:
+
+- `IVF<nlist>,Flat` clusters the vectors and only scans the `nprobe`
+  clusters closest to a query. It is trained on a sample of the vectors.
+- `HNSW<M>` walks a graph of neighbours, exploring `efSearch` candidates.
+  It is only built when asked for: it needs no training but takes more
+  memory than IVF, and building the graph of a large index is slow.
+
+Vectors can also be stored compressed, to fit more indexes in memory:
+`fp16` and `int8` scalar quantization take 2 and 4 times less space, and
+`pq` product quantization 64 times less (16 dimensions per byte). Searches
+on a compressed index are re-ranked: the index returns `rerank` times more
+candidates than asked for, which are sorted again by their exact distance
+to the query, computed from the full precision vectors saved next to the
+index in `vectors.npy`. That file is memory-mapped, so only the candidates
+are read from disk.
+
+Any other faiss factory string works too, with the number of IVF clusters
+lowered for indexes too small to train them. Ingestion always builds a flat
+index, which supports checkpoints and removing vectors, and converts it at
+the end. The search parameters are saved next to the index in
+`index_params.json` and applied when the index is loaded for searching.
+
+"""
+import json
+import os
+import re
+from typing import Dict, Optional
+
+import faiss
+import numpy as np
+
+INDEX_PARAMS_FILE = "index_params.json"
+VECTORS_FILE = "vectors.npy"
+
+# with "auto", indexes with fewer vectors stay flat
+ANN_MIN_VECTORS = 50000
+DEFAULT_NPROBE = 32
+DEFAULT_EF_SEARCH = 64
+DEFAULT_RERANK = 4
+# number of training vectors per IVF cluster, faiss warns below 39
+TRAIN_POINTS_PER_LIST = 64
+MIN_POINTS_PER_LIST = 39
+# product quantizers are trained on 256 centroids per sub-vector, smaller indexes use int8 instead
+PQ_MIN_VECTORS = 10000
+
+COMPRESSIONS = ("none", "fp16", "int8", "pq")
+
+
+def _encoding(compression: str, ntotal: int, dim: int) -> str:
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression {compression!r}, expected one of {', '.join(COMPRESSIONS)}")
+    if compression == "pq" and ntotal < PQ_MIN_VECTORS:
+        compression = "int8"
+    if compression == "pq":
+        # one byte per 16 dimensions, the number of sub-vectors has to divide the dimension
+        return f"PQ{max(m for m in range(1, max(dim // 16, 1) + 1) if dim % m == 0)}"
+    return {"none": "Flat", "fp16": "SQfp16", "int8": "SQ8"}[compression]
+
+
+def choose_factory(ntotal: int, factory: str = "auto", min_vectors: int = ANN_MIN_VECTORS,
+                   compression: str = "none", dim: int = 1536) -> str:
+    """Return the faiss factory string to use for an index of `ntotal` vectors of `dim` dimensions.
+
+    With "auto", indexes of at least `min_vectors` vectors get an IVF index
+    with about 4 * sqrt(ntotal) clusters, others stay flat, and vectors are
+    stored with `compression`. HNSW indexes are never chosen, only built
+    when `factory` asks for one. Any other value is returned as is, except
+    that IVF indexes get at most one cluster per 39 vectors, as training
+    fails with fewer vectors than clusters.
+
+    """
+    if ntotal == 0:
+        # an empty shard, there is nothing to train a quantizer on
+        return "Flat"
+    if factory != "auto":
+        return _fit_nlist(factory, ntotal)
+    encoding = _encoding(compression, ntotal, dim)
+    if ntotal < min_vectors:
+        return encoding
+    nlist = 1 << int(np.log2(4 * np.sqrt(ntotal)))
+    return f"IVF{nlist},{encoding}"
+
+
+def _fit_nlist(factory: str, ntotal: int) -> str:
+    match = re.search(r"IVF(\d+)", factory)
+    if match is None:
+        return factory
+    nlist = max(ntotal // MIN_POINTS_PER_LIST, 1)
+    if int(match.group(1)) <= nlist:
+        return factory
+    print(f"Using {nlist} clusters instead of {match.group(1)} for an index of {ntotal} vectors")
+    return f"{factory[:match.start(1)]}{nlist}{factory[match.end(1):]}"
+
+
+def is_compressed(factory: str) -> bool:
+    """Whether an index built with `factory` stores approximate vectors."""
+    return "SQ" in factory or "PQ" in factory
+
+
+def default_search_params(index, nprobe: int = DEFAULT_NPROBE, ef_search: int = DEFAULT_EF_SEARCH) -> Dict:
+    """Return the search parameters that apply to `index`."""
+    params = {}
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        params["nprobe"] = min(nprobe, ivf.nlist)
+    if hasattr(faiss.downcast_index(index), "hnsw"):
+        params["efSearch"] = ef_search
+    return params
+
+
+def set_search_params(index, params: Dict) -> None:
+    """Set search parameters such as `nprobe` or `efSearch` on `index`."""
+    space = faiss.ParameterSpace()
+    for name, value in params.items():
+        space.set_index_parameter(index, name, value)
+
+
+def vectors_of(index) -> np.ndarray:
+    """Return all vectors of an index, in order of position."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        # IVF indexes can only reconstruct vectors by id through a direct map
+        ivf.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def build_index(vectors: np.ndarray, factory: str, train_size: Optional[int] = None, seed: int = 1234):
+    """Build an index with a faiss factory string and add `vectors` to it.
+
+    Vectors keep their positions, so the position -> docstore id mapping
+    of a store stays valid. Indexes that need training are trained on a
+    random sample of `train_size` vectors, by default 64 per IVF cluster.
+
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    index = faiss.index_factory(vectors.shape[1], factory)
+    if not index.is_trained:
+        if train_size is None:
+            ivf = faiss.try_extract_index_ivf(index)
+            train_size = TRAIN_POINTS_PER_LIST * (ivf.nlist if ivf is not None else 1024)
+        sample = vectors
+        if len(vectors) > train_size:
+            rng = np.random.default_rng(seed)
+            sample = vectors[np.sort(rng.choice(len(vectors), train_size, replace=False))]
+        index.train(sample)
+    index.add(vectors)
+    return index
+
+
+def to_flat(index, folder: Optional[str] = None):
+    """Return a flat index with the vectors of `index`, or `index` if it is flat already.
+
+    The vectors of a compressed index are read at full precision from the
+    `vectors.npy` saved with it in `folder`, if there is one.
+
+    """
+    if isinstance(faiss.downcast_index(index), faiss.IndexFlat):
+        return index
+    vectors = None
+    if folder is not None and os.path.exists(os.path.join(folder, VECTORS_FILE)):
+        vectors = np.load(os.path.join(folder, VECTORS_FILE))
+    if vectors is None or len(vectors) != index.ntotal:
+        vectors = vectors_of(index)
+    flat = faiss.IndexFlatL2(index.d)
+    flat.add(vectors)
+    return flat
+
+
+class RerankedIndex:
+    """Index re-ranking the results of a compressed index with exact distances.
+
+    Only implements searching, which is all a loaded store is used for.
+    Other attributes are those of the compressed index.
+
+    Args:
+        index: The compressed faiss index.
+        vectors (np.ndarray): The full precision vectors, in order of
+            position, typically memory-mapped from `vectors.npy`.
+        rerank (int): Number of candidates fetched per result.
+
+    """
+
+    def __init__(self, index, vectors: np.ndarray, rerank: int = DEFAULT_RERANK) -> None:
+        """Init params."""
+        self.index = index
+        self.vectors = vectors
+        self.rerank = rerank
+
+    def __getattr__(self, name: str):
+        return getattr(self.index, name)
+
+    def search(self, x: np.ndarray, k: int):
+        """Search like a faiss index, returning squared L2 distances and positions."""
+        _, candidates = self.index.search(x, k * self.rerank)
+        distances = np.full((len(x), k), np.inf, dtype=np.float32)
+        labels = np.full((len(x), k), -1, dtype=np.int64)
+        for row, (query, found) in enumerate(zip(x, candidates)):
+            # sorted positions read the memory-mapped file front to back
+            found = np.sort(found[found >= 0])
+            exact = ((np.asarray(self.vectors[found], dtype=np.float32) - query) ** 2).sum(axis=1)
+            order = np.argsort(exact, kind="stable")[:k]
+            distances[row, :len(order)] = exact[order]
+            labels[row, :len(order)] = found[order]
+        return distances, labels
+
+    def reconstruct(self, position: int) -> np.ndarray:
+        """Return the full precision vector at `position`."""
+        return np.asarray(self.vectors[int(position)], dtype=np.float32)
+
+
+def convert_store(store, factory: str = "auto", min_vectors: int = ANN_MIN_VECTORS, compression: str = "none",
+                  nprobe: int = DEFAULT_NPROBE, ef_search: int = DEFAULT_EF_SEARCH, rerank: int = DEFAULT_RERANK,
+                  vectors: Optional[np.ndarray] = None) -> Dict:
+    """Rebuild the index of a langchain FAISS store with the index type chosen for its size.
+
+    Args:
+        vectors (Optional[np.ndarray]): The vectors of the store, if already
+            extracted from its index.
+
+    Returns:
+        Dict: the factory string, search parameters and re-ranking factor of
+        the new index, to be saved with `save_index_params`.
+
+    """
+    factory = choose_factory(store.index.ntotal, factory, min_vectors, compression, store.index.d)
+    if factory == "Flat":
+        store.index = to_flat(store.index)
+    else:
+        print(f"Building {factory} index of {store.index.ntotal} vectors")
+        store.index = build_index(vectors_of(store.index) if vectors is None else vectors, factory)
+    params = default_search_params(store.index, nprobe, ef_search)
+    set_search_params(store.index, params)
+    index_params = {"factory": factory, "search": params}
+    if rerank > 1 and is_compressed(factory):
+        index_params["rerank"] = rerank
+    return index_params
+
+
+def convert_and_save(store, folder: str, factory: str = "auto", **options) -> Dict:
+    """Convert the index of a flat store with `convert_store` and save everything in `folder`.
+
+    Along with `save_local`, writes the index parameters and, for a
+    compressed index re-ranking its results, the full precision vectors.
+
+    """
+    vectors = vectors_of(store.index)
+    index_params = convert_store(store, factory, vectors=vectors, **options)
+    store.save_local(folder)
+    vectors_path = os.path.join(folder, VECTORS_FILE)
+    if index_params.get("rerank"):
+        np.save(vectors_path, vectors)
+    elif os.path.exists(vectors_path):
+        os.remove(vectors_path)
+    save_index_params(folder, index_params)
+    return index_params
+
+
+def save_index_params(folder: str, params: Dict) -> None:
+    """Write the index type and search parameters next to the index in `folder`."""
+    with open(os.path.join(folder, INDEX_PARAMS_FILE), "w") as f:
+        json.dump(params, f)
+
+
+def load_index_params(folder: str) -> Optional[Dict]:
+    """Read the index type and search parameters of the index in `folder`, if saved."""
+    path = os.path.join(folder, INDEX_PARAMS_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
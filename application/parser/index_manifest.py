@@ -0,0 +1,113 @@
+"""Index manifest.
+
+Keeps track of which source files an index was built from, so that a new
+upload only needs to parse and embed the files that changed.
+
+The manifest is stored next to `index.faiss`/`index.pkl` as `manifest.json`
+and maps every source file (relative to the upload folder) to the hash of
+its content and the docstore ids of the vectors embedded from it.
+
+"""
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from parser.file.bulk import DEFAULT_FILE_EXTRACTOR, SimpleDirectoryReader
+
+MANIFEST_FILE = "manifest.json"
+
+
+def file_hash(path: str) -> str:
+    """Return the SHA-256 of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_hashes(folder: str, extensions: Optional[Iterable[str]] = None) -> Dict[str, str]:
+    """Hash the files of `folder` that are ingested, by path relative to `folder`.
+
+    Files are listed like `SimpleDirectoryReader` lists them, keeping the
+    extensions `extensions` that the reader has a parser for, or all of
+    them by default.
+
+    """
+    supported = [ext for ext in (extensions or DEFAULT_FILE_EXTRACTOR) if ext in DEFAULT_FILE_EXTRACTOR]
+    if not supported:
+        return {}
+    reader = SimpleDirectoryReader(input_dir=folder, recursive=True, required_exts=supported)
+    return {os.path.relpath(str(path), folder): file_hash(str(path)) for path in reader.input_files}
+
+
+class IndexManifest:
+    """Mapping of source file -> content hash -> vector ids."""
+
+    def __init__(self, files: Optional[Dict[str, Dict]] = None) -> None:
+        """Init params."""
+        self.files: Dict[str, Dict] = files or {}
+
+    @classmethod
+    def load(cls, folder: str) -> Optional["IndexManifest"]:
+        """Load the manifest of the index in `folder`, if there is one."""
+        path = os.path.join(folder, MANIFEST_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            return cls(json.load(f)["files"])
+
+    def save(self, folder: str) -> None:
+        """Write the manifest next to the index in `folder`."""
+        with open(os.path.join(folder, MANIFEST_FILE), "w") as f:
+            json.dump({"version": 1, "files": self.files}, f)
+
+    def diff(self, hashes: Dict[str, str]) -> Tuple[List[str], List[str]]:
+        """Compare the manifest to the current file hashes.
+
+        Returns:
+            Tuple[List[str], List[str]]: files that are new or changed and
+            need to be embedded, and files that are changed or deleted and
+            whose vectors need to be removed.
+
+        """
+        to_embed = [path for path, digest in hashes.items()
+                    if self.files.get(path, {}).get("hash") != digest]
+        stale = [path for path in self.files
+                 if path not in hashes or hashes[path] != self.files[path]["hash"]]
+        return to_embed, stale
+
+    def stale_ids(self, paths: Iterable[str]) -> List[str]:
+        """Return the vector ids of `paths`."""
+        return [doc_id for path in paths for doc_id in self.files.get(path, {}).get("ids", [])]
+
+    def update(self, path: str, digest: str, ids: List[str]) -> None:
+        """Record the hash and vector ids of a file."""
+        self.files[path] = {"hash": digest, "ids": ids}
+
+    def remove(self, path: str) -> None:
+        """Forget a file."""
+        self.files.pop(path, None)
+
+
+def remove_vectors(store, ids: Iterable[str]) -> int:
+    """Remove vectors from a langchain FAISS store by docstore id.
+
+    Removing from a flat index shifts the positions of the vectors after
+    the removed ones, so the position -> docstore id mapping is rebuilt.
+    The index must be flat, see `index_factory.to_flat`.
+
+    """
+    ids = set(ids)
+    positions = [pos for pos, doc_id in store.index_to_docstore_id.items() if doc_id in ids]
+    if not positions:
+        return 0
+    store.index.remove_ids(np.array(positions, dtype=np.int64))
+    remaining = [doc_id for _, doc_id in sorted(store.index_to_docstore_id.items()) if doc_id not in ids]
+    store.index_to_docstore_id = dict(enumerate(remaining))
+    for doc_id in ids:
+        store.docstore._dict.pop(doc_id, None)
+    return len(positions)
@@ -0,0 +1,294 @@
+"""Sharded vector stores.
+
+A large index can be saved as several shards, each a complete store with
+its own index type, in `shards/<version>/<n>` of the index folder. Every
+source file has all of its chunks in one shard, recorded with the number of
+vectors of each shard and the version in `shards.json`. When files are
+re-uploaded, only the shards holding them are rebuilt and uploaded, into a
+new version. `publish_layout` then links the unchanged shards into it and
+replaces `shards.json`, so readers switch to all new shards at once. The
+shards of a version are never changed once published.
+
+Files are assigned to shards either by file, hashing their path to one of
+a fixed number of shards, or by size, filling the smallest shard and
+adding shards once they all hold `max_vectors` vectors.
+
+A loaded sharded store searches every shard concurrently in a thread pool,
+faiss releasing the GIL while it searches, and merges the results by
+distance. The shards are indexed like a single index, with the positions
+of each shard following those of the previous ones. The docstore ids found
+for these positions carry their shard, so that chunks are fetched from
+that shard's docstore only.
+
+"""
+import bisect
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from concurrent.futures import Executor
+from typing import Dict, Iterator, List, Mapping, Optional, Sequence, Union
+
+import faiss
+import numpy as np
+from langchain.docstore.base import Docstore
+from langchain.docstore.document import Document
+from langchain.docstore.in_memory import InMemoryDocstore
+from langchain.vectorstores import FAISS
+
+from parser.index_factory import vectors_of
+
+SHARDS_FILE = "shards.json"
+SHARDS_DIR = "shards"
+
+
+def shard_path(folder: str, shard: int, version: str = "") -> str:
+    """Return the folder of a shard of the index in `folder`, in `shards/<n>` without a version."""
+    return os.path.join(folder, SHARDS_DIR, version, str(shard))
+
+
+def new_version() -> str:
+    """Return a version name for the shards of a new upload, never a shard number."""
+    return f"v{uuid.uuid4().hex[:16]}"
+
+
+def is_sharded(folder: str) -> bool:
+    """Check if the index in `folder` is saved as shards."""
+    return os.path.exists(os.path.join(folder, SHARDS_FILE))
+
+
+class ShardLayout:
+    """Assignment of source files to shards.
+
+    Args:
+        num_shards (int): Number of shards.
+        max_vectors (int): Number of vectors per shard when sharding by size,
+            0 to shard by file.
+        sources (Optional[Dict[str, int]]): Source file -> shard.
+        sizes (Optional[List[int]]): Number of vectors of each shard.
+        version (str): Version of the shards, the name of their folder in
+            `shards`. Shards saved without a version are in `shards` itself.
+
+    """
+
+    def __init__(self, num_shards: int, max_vectors: int = 0, sources: Optional[Dict[str, int]] = None,
+                 sizes: Optional[List[int]] = None, version: str = "") -> None:
+        """Init params."""
+        self.num_shards = num_shards
+        self.max_vectors = max_vectors
+        self.sources: Dict[str, int] = sources or {}
+        self.sizes: List[int] = sizes or [0] * num_shards
+        self.version = version
+
+    @classmethod
+    def create(cls, total_vectors: int, num_shards: int = 1, max_vectors: int = 0) -> "ShardLayout":
+        """Layout for a new index of `total_vectors` vectors.
+
+        With `max_vectors`, the index gets as many shards as needed to hold
+        that many vectors each, otherwise `num_shards` shards.
+
+        """
+        if max_vectors:
+            num_shards = max(-(-total_vectors // max_vectors), 1)
+        return cls(num_shards, max_vectors)
+
+    @classmethod
+    def load(cls, folder: str, name: str = SHARDS_FILE) -> "ShardLayout":
+        """Load the layout of the index in `folder`."""
+        with open(os.path.join(folder, name), "r") as f:
+            layout = json.load(f)
+        return cls(layout["num_shards"], layout["max_vectors"], layout["sources"], layout["sizes"],
+                   layout.get("shards_version", ""))
+
+    def save(self, folder: str) -> None:
+        """Write the layout next to the shards in `folder`."""
+        with open(os.path.join(folder, SHARDS_FILE), "w") as f:
+            json.dump({"version": 1, "num_shards": self.num_shards, "max_vectors": self.max_vectors,
+                       "sources": self.sources, "sizes": self.sizes, "shards_version": self.version}, f)
+
+    def assign(self, source: str, count: int) -> int:
+        """Assign the `count` vectors of a source file to a shard, and return the shard."""
+        if source in self.sources:
+            shard = self.sources[source]
+        elif self.max_vectors:
+            shard = min(range(self.num_shards), key=self.sizes.__getitem__)
+            if self.sizes[shard] and self.sizes[shard] + count > self.max_vectors:
+                # every shard is full
+                shard = self.num_shards
+                self.num_shards += 1
+                self.sizes.append(0)
+        else:
+            # stable across runs, unlike hash()
+            shard = int(hashlib.sha1(source.encode("utf-8")).hexdigest(), 16) % self.num_shards
+        self.sources[source] = shard
+        self.sizes[shard] += count
+        return shard
+
+    def remove(self, source: str, count: int) -> Optional[int]:
+        """Remove the `count` vectors of a source file, and return the shard it was in."""
+        shard = self.sources.pop(source, None)
+        if shard is not None:
+            self.sizes[shard] -= count
+        return shard
+
+
+def publish_layout(folder: str, staged: str) -> ShardLayout:
+    """Switch the sharded index in `folder` to the layout at `staged`, whose shards have been uploaded.
+
+    Shards of the new version that were not uploaded, being unchanged, are
+    hard-linked from the current version, then the layout is renamed over
+    `shards.json`. Versions other than the new and the previous one are
+    removed, the previous one is kept for readers still loading it.
+
+    Returns:
+        ShardLayout: the published layout.
+
+    """
+    layout = ShardLayout.load(os.path.dirname(staged), os.path.basename(staged))
+    current = ShardLayout.load(folder) if is_sharded(folder) else None
+    for shard in range(layout.num_shards):
+        target = shard_path(folder, shard, layout.version)
+        if os.path.exists(target):
+            continue
+        source = shard_path(folder, shard, current.version) if current is not None else None
+        if source is None or not os.path.exists(source):
+            raise FileNotFoundError(f"Shard {shard} of version {layout.version!r} was not uploaded")
+        os.makedirs(target)
+        for name in os.listdir(source):
+            if not name.startswith("."):
+                os.link(os.path.join(source, name), os.path.join(target, name))
+    os.replace(staged, os.path.join(folder, SHARDS_FILE))
+
+    keep = {layout.version, current.version if current is not None else layout.version}
+    for name in os.listdir(os.path.join(folder, SHARDS_DIR)):
+        # shards saved without a version are in numbered folders
+        if (name if not name.isdigit() else "") not in keep:
+            shutil.rmtree(os.path.join(folder, SHARDS_DIR, name))
+    return layout
+
+
+def add_to_shards(store: FAISS, shard_ids: Dict[int, List[str]], shards: Dict[int, Optional[FAISS]]) -> None:
+    """Copy vectors and chunks of a store to flat shard stores, by docstore id.
+
+    Args:
+        store (FAISS): Store to copy from.
+        shard_ids (Dict[int, List[str]]): Docstore ids to copy to each shard.
+        shards (Dict[int, Optional[FAISS]]): Shard stores, updated in place.
+            Missing shards are created.
+
+    """
+    positions = {doc_id: position for position, doc_id in store.index_to_docstore_id.items()}
+    vectors = vectors_of(store.index)
+    for shard, ids in shard_ids.items():
+        target = shards.get(shard)
+        if target is None:
+            target = shards[shard] = FAISS(store.embedding_function, faiss.IndexFlatL2(store.index.d),
+                                           InMemoryDocstore({}), {})
+        start = target.index.ntotal
+        target.index.add(vectors[[positions[doc_id] for doc_id in ids]])
+        target.docstore.add({doc_id: store.docstore.search(doc_id) for doc_id in ids})
+        target.index_to_docstore_id.update({start + i: doc_id for i, doc_id in enumerate(ids)})
+
+
+class ShardedIndex:
+    """Index searching the indexes of several shards.
+
+    Only implements what a loaded store uses: searching, and
+    reconstructing vectors for max marginal relevance searches.
+
+    Args:
+        indexes (Sequence): The faiss indexes of the shards.
+        executor (Optional[Executor]): Thread pool searching the shards,
+            they are searched one after the other without.
+
+    """
+
+    def __init__(self, indexes: Sequence, executor: Optional[Executor] = None) -> None:
+        """Init params."""
+        self.indexes = list(indexes)
+        self.executor = executor
+        self.offsets = np.cumsum([0] + [index.ntotal for index in self.indexes[:-1]]).tolist()
+        self.ntotal = sum(index.ntotal for index in self.indexes)
+        self.d = self.indexes[0].d
+
+    def search(self, x: np.ndarray, k: int):
+        """Search like a faiss index, returning distances and positions."""
+        if self.executor is not None and len(self.indexes) > 1:
+            results = list(self.executor.map(lambda index: index.search(x, k), self.indexes))
+        else:
+            results = [index.search(x, k) for index in self.indexes]
+        distances = np.hstack([found_distances for found_distances, _ in results])
+        labels = np.hstack([np.where(found >= 0, found + offset, -1)
+                            for (_, found), offset in zip(results, self.offsets)])
+        # positions not found have the largest distances, and end up last
+        order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(labels, order, axis=1)
+
+    def reconstruct(self, position: int) -> np.ndarray:
+        shard = bisect.bisect_right(self.offsets, position) - 1
+        return self.indexes[shard].reconstruct(int(position) - self.offsets[shard])
+
+
+class ShardId(str):
+    """Docstore id that knows the shard holding its chunk."""
+
+    __slots__ = ("shard",)
+
+    def __new__(cls, doc_id: str, shard: int) -> "ShardId":
+        self = super().__new__(cls, doc_id)
+        self.shard = shard
+        return self
+
+
+class ShardedIdMap(Mapping[int, str]):
+    """Position -> docstore id mapping of a `ShardedIndex`, returning `ShardId`s."""
+
+    def __init__(self, id_maps: Sequence[Mapping[int, str]], offsets: List[int]) -> None:
+        """Init params."""
+        self.id_maps = list(id_maps)
+        self.offsets = offsets
+
+    def __getitem__(self, position: int) -> str:
+        shard = bisect.bisect_right(self.offsets, position) - 1
+        if shard < 0:
+            raise KeyError(position)
+        return ShardId(self.id_maps[shard][int(position) - self.offsets[shard]], shard)
+
+    def __iter__(self) -> Iterator[int]:
+        for offset, id_map in zip(self.offsets, self.id_maps):
+            for position in id_map:
+                yield offset + position
+
+    def __len__(self) -> int:
+        return sum(len(id_map) for id_map in self.id_maps)
+
+
+class ShardedDocstore(Docstore):
+    """Docstore looking chunks up in the docstores of several shards."""
+
+    def __init__(self, docstores: Sequence[Docstore]) -> None:
+        """Init params."""
+        self.docstores = list(docstores)
+
+    def search(self, search: str) -> Union[str, Document]:
+        """Fetch a chunk by docstore id, ids are unique across shards.
+
+        Ids from the `ShardedIdMap` are looked up in their shard, others in
+        every shard until found.
+
+        """
+        shard = getattr(search, "shard", None)
+        if shard is not None:
+            return self.docstores[shard].search(str(search))
+        for docstore in self.docstores:
+            doc = docstore.search(search)
+            if isinstance(doc, Document):
+                return doc
+        return f"ID {search} not found."
+
+    def close(self) -> None:
+        """Close the docstores of the shards that hold resources, such as database connections."""
+        for docstore in self.docstores:
+            if hasattr(docstore, "close"):
+                docstore.close()
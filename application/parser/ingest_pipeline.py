@@ -0,0 +1,355 @@
+"""Pipelined ingestion.
+
+Runs the stages of an ingest concurrently, connected by bounded queues:
+
+    parse -> chunk -> embed -> index
+
+Parsing of the next files overlaps the embedding of the chunks of the
+previous ones, and the embeddings API is kept busy while files are parsed.
+Each stage has its own concurrency: parsing runs in the reader's process
+pool, embedding through the `EmbeddingScheduler`, and chunking and indexing
+in one thread each. A full queue blocks the stage feeding it, so a slow
+stage holds back the ones before it instead of letting work pile up in
+memory, and the whole run takes about as long as its slowest stage.
+
+"""
+import queue
+import threading
+from collections import Counter, deque
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from langchain.docstore.document import Document as LCDocument
+from langchain.text_splitter import CharacterTextSplitter
+from langchain.vectorstores import FAISS
+
+from parser.checkpoint import IngestCheckpoint
+from parser.embedding_cache import EmbeddingCache, text_hash
+from parser.embedding_scheduler import EmbeddingScheduler
+from parser.index_factory import convert_and_save
+from parser.schema.base import Document
+from parser.token_func import count_tokens, pack_documents, split_documents
+
+# end of a stream, put by a stage once its input is exhausted
+_DONE = object()
+
+
+class _Stopped(Exception):
+    """Raised in a stage when another stage failed."""
+
+
+class IngestPipeline:
+    """Parse, chunk, embed and index documents with overlapping stages.
+
+    Progress is checkpointed in `folder_name` like `call_openai_api`, and a
+    run with the same fingerprint resumes from the last checkpoint.
+
+    Args:
+        folder_name (str): Folder the index is saved in.
+        embeddings: Langchain embeddings, used to embed the chunks and as the
+            embedding function of the store.
+        store (Optional[FAISS]): Store to add the chunks to. A new one is
+            created by default.
+        scheduler (Optional[EmbeddingScheduler]): Scheduler of the embedding
+            requests. Defaults to one calling `embeddings.embed_documents`.
+        cache (Optional[EmbeddingCache]): Cache of already embedded chunks.
+        batch_size (int): Number of chunks per embeddings request.
+        queue_size (int): Capacity of the queues between stages, in files
+            between parsing and chunking and in batches after that.
+        checkpoint_every (int): Number of indexed batches between two
+            checkpoints.
+        chunk_size (int): Size of the chunks, in characters.
+        max_tokens (Optional[int]): Size of the chunks in tokens. When set,
+            the sections of each file are packed into chunks of up to
+            `max_tokens` with `token_func.pack_documents`, and longer ones
+            split with `token_func.split_documents`, instead of splitting
+            them by characters.
+        overlap_tokens (int): Tokens shared by consecutive parts of a section
+            split by tokens.
+        task_status: Celery task whose progress is updated.
+        index_factory (str): Type of the saved index, a faiss factory string
+            or "auto" to choose one from the number of vectors, see
+            `index_factory.choose_factory`. The store is built flat and
+            converted once all chunks are indexed.
+        index_options (Optional[Dict]): Keyword arguments of
+            `index_factory.convert_store`, such as `nprobe` or `compression`.
+        save (bool): Whether to save the store in `folder_name`. Callers
+            saving the returned store themselves, for instance as shards,
+            disable it.
+
+    """
+
+    def __init__(
+        self,
+        folder_name: str,
+        embeddings,
+        store: Optional[FAISS] = None,
+        scheduler: Optional[EmbeddingScheduler] = None,
+        cache: Optional[EmbeddingCache] = None,
+        batch_size: int = 100,
+        queue_size: int = 8,
+        checkpoint_every: int = 10,
+        chunk_size: int = 1000,
+        max_tokens: Optional[int] = None,
+        overlap_tokens: int = 0,
+        task_status=None,
+        index_factory: str = "auto",
+        index_options: Optional[Dict] = None,
+        save: bool = True,
+    ) -> None:
+        """Init params."""
+        self.folder_name = folder_name
+        self.embeddings = embeddings
+        self.model = getattr(embeddings, "model", type(embeddings).__name__)
+        self.store = store
+        self.scheduler = scheduler or EmbeddingScheduler(embeddings.embed_documents)
+        self.cache = cache
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.checkpoint_every = checkpoint_every
+        self.splitter = CharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=0)
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.task_status = task_status
+        self.index_factory = index_factory
+        self.index_options = index_options or {}
+        self.save = save
+        # docstore ids of the added vectors per source file, used for the index manifest
+        self.ids_by_source: Dict[str, List[str]] = {}
+        self.done: Counter = Counter()
+        self.chunks = 0
+        self.reused = 0
+        self.embedded = 0
+        # sections split by tokens, the chunks made of them and the tokens these hold
+        self.sections = 0
+        self._token_chunks = 0
+        self._chunk_tokens = 0
+        self._files_chunked = 0
+        self._stop = threading.Event()
+        self._errors: List[BaseException] = []
+
+    def run(self, files: Iterable[List[LCDocument]], fingerprint: str, total_files: Optional[int] = None) -> Dict:
+        """Ingest the documents of every file and save the store.
+
+        Args:
+            files: The documents of each file, typically produced lazily by
+                a reader so that files are parsed while earlier ones are
+                embedded.
+            fingerprint (str): Identifies the input, a checkpoint is only
+                resumed by a run with the same fingerprint.
+            total_files (Optional[int]): Number of files, for progress.
+
+        Returns:
+            Dict: number of chunks, chunks reused from the cache and
+            embedded, the docstore ids per source, and the store.
+
+        """
+        checkpoint = IngestCheckpoint(self.folder_name, fingerprint)
+        resumed = checkpoint.load(self.embeddings)
+        if resumed is not None:
+            self.store, self.done, self.ids_by_source = resumed
+            print(f"Resuming from checkpoint, {sum(self.done.values())} chunks already embedded")
+
+        parsed = queue.Queue(maxsize=self.queue_size)
+        chunked = queue.Queue(maxsize=self.queue_size)
+        embedded = queue.Queue(maxsize=self.queue_size)
+        stages = [
+            threading.Thread(target=self._stage, args=(self._parse, files, parsed), name="ingest-parse", daemon=True),
+            threading.Thread(target=self._stage, args=(self._chunk, parsed, chunked), name="ingest-chunk", daemon=True),
+            threading.Thread(target=self._stage, args=(self._embed, chunked, embedded), name="ingest-embed", daemon=True),
+        ]
+        for stage in stages:
+            stage.start()
+        try:
+            self._index(embedded, checkpoint, total_files)
+        except BaseException as e:
+            self._fail(e)
+        for stage in stages:
+            stage.join()
+
+        if self._errors:
+            error = self._errors[0]
+            print(f"Ingest failed: {error}")
+            self._drain(embedded)
+            if self.store is not None:
+                print(f"Saving progress, {sum(self.done.values())} chunks embedded")
+                checkpoint.save(self.store, self.done, self.ids_by_source)
+            raise error
+
+        if self.scheduler.rate_limited:
+            print(f"Rate limited {self.scheduler.rate_limited} times, "
+                  f"ended at {self.scheduler.concurrency:.1f} requests in flight")
+        if self.max_tokens is not None:
+            print(f"Packed {self.sections} sections into {self._token_chunks} chunks, "
+                  f"fill ratio {self.fill_ratio():.0%}")
+        print(f"Chunks reused from cache: {self.reused}, embedded: {self.embedded}")
+        if self.store is not None and self.save:
+            convert_and_save(self.store, self.folder_name, self.index_factory, **self.index_options)
+        checkpoint.clear()
+        return {'chunks': self.chunks, 'reused': self.reused, 'embedded': self.embedded,
+                'ids_by_source': self.ids_by_source, 'store': self.store}
+
+    def fill_ratio(self) -> float:
+        """Average share of `max_tokens` used by the chunks split by tokens, like `token_func.fill_ratio`."""
+        if not self._token_chunks:
+            return 0.0
+        return self._chunk_tokens / (self._token_chunks * self.max_tokens)
+
+    def _fail(self, e: BaseException) -> None:
+        if not isinstance(e, _Stopped):
+            self._errors.append(e)
+        self._stop.set()
+
+    def _stage(self, target, source, sink: queue.Queue) -> None:
+        try:
+            target(source, sink)
+            self._put(sink, _DONE)
+        except BaseException as e:
+            self._fail(e)
+
+    def _put(self, sink: queue.Queue, item) -> None:
+        """Put an item, giving up if another stage failed."""
+        while True:
+            if self._stop.is_set():
+                raise _Stopped()
+            try:
+                sink.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _iter(self, source: queue.Queue) -> Iterator:
+        """Iterate over the items of a queue until its producer is done."""
+        while True:
+            if self._stop.is_set():
+                raise _Stopped()
+            try:
+                item = source.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is _DONE:
+                return
+            yield item
+
+    def _parse(self, files: Iterable[List[LCDocument]], sink: queue.Queue) -> None:
+        for docs in files:
+            self._put(sink, docs)
+
+    def _split(self, docs: List[LCDocument]) -> List[LCDocument]:
+        """Split the sections of one file into chunks."""
+        if self.max_tokens is None:
+            return self.splitter.split_documents(docs)
+        sections = [Document.from_langchain_format(doc) for doc in docs]
+        chunks = pack_documents(sections, self.max_tokens)
+        chunks = split_documents(chunks, self.max_tokens, self.overlap_tokens)
+        self.sections += len(sections)
+        self._token_chunks += len(chunks)
+        self._chunk_tokens += sum(min(count_tokens(chunk), self.max_tokens) for chunk in chunks)
+        return [chunk.to_langchain_format() for chunk in chunks]
+
+    def _chunk(self, source: queue.Queue, sink: queue.Queue) -> None:
+        """Split files into chunks and group the chunks into batches.
+
+        Chunks found in the cache are sent in batches of their own, which
+        the embed stage passes through, the others in batches of
+        `batch_size` chunks to embed. Batches are sent as the chunks, their
+        keys in the checkpoint, and their vectors if cached.
+        """
+        # chunks are identified by source and content, so a resumed run can skip the ones in the store
+        skip = self.done.copy()
+        missing: List[LCDocument] = []
+        for docs in self._iter(source):
+            chunks = []
+            for chunk in self._split(docs):
+                self.chunks += 1
+                key = text_hash(f"{chunk.metadata.get('source')}\0{chunk.page_content}")
+                if skip[key] > 0:
+                    skip[key] -= 1
+                    continue
+                chunks.append((chunk, key))
+            cached = [None] * len(chunks)
+            if self.cache is not None and chunks:
+                cached = self.cache.get_many(self.model, [chunk.page_content for chunk, _ in chunks])
+            hits = [(chunk, key, vector) for (chunk, key), vector in zip(chunks, cached) if vector is not None]
+            if hits:
+                self._put(sink, ([chunk for chunk, _, _ in hits], [key for _, key, _ in hits],
+                                 [vector for _, _, vector in hits]))
+            missing.extend(item for item, vector in zip(chunks, cached) if vector is None)
+            while len(missing) >= self.batch_size:
+                self._put(sink, self._batch(missing[:self.batch_size]))
+                missing = missing[self.batch_size:]
+            self._files_chunked += 1
+        if missing:
+            self._put(sink, self._batch(missing))
+
+    @staticmethod
+    def _batch(items: List) -> tuple:
+        """Batch of chunks to embed, with their keys in a list of their own."""
+        return [chunk for chunk, _ in items], [key for _, key in items], None
+
+    def _embed(self, source: queue.Queue, sink: queue.Queue) -> None:
+        # batches in flight, in the order the scheduler yields their vectors
+        in_flight = deque()
+
+        def requests() -> Iterator[List[str]]:
+            for chunks, keys, vectors in self._iter(source):
+                in_flight.append((chunks, keys, vectors))
+                # cached batches go through the scheduler too, to stay in order, but make no request
+                yield [] if vectors is not None else [chunk.page_content for chunk in chunks]
+
+        results = self.scheduler.map(requests())
+        try:
+            for vectors in results:
+                chunks, keys, cached = in_flight.popleft()
+                self._put(sink, (chunks, keys, cached if cached is not None else vectors, cached is None))
+        finally:
+            results.close()
+
+    def _add(self, chunks: List[LCDocument], keys: List[str], vectors: List[List[float]], new: bool) -> None:
+        """Add an embedded batch to the store, and its new vectors to the cache."""
+        contents = [chunk.page_content for chunk in chunks]
+        if new and self.cache is not None:
+            self.cache.put_many(self.model, contents, vectors)
+        metadatas = [chunk.metadata for chunk in chunks]
+        text_embeddings = list(zip(contents, vectors))
+        if self.store is None:
+            self.store = FAISS.from_embeddings(text_embeddings, self.embeddings, metadatas=metadatas)
+            ids = list(self.store.index_to_docstore_id.values())
+        else:
+            ids = self.store.add_embeddings(text_embeddings, metadatas=metadatas)
+        for chunk, key, doc_id in zip(chunks, keys, ids):
+            self.ids_by_source.setdefault(chunk.metadata.get('source'), []).append(doc_id)
+            self.done[key] += 1
+        if new:
+            self.embedded += len(chunks)
+        else:
+            self.reused += len(chunks)
+
+    def _drain(self, source: queue.Queue) -> None:
+        """Add the batches embedded before a failure, so that a resumed run does not embed them again."""
+        try:
+            while True:
+                item = source.get_nowait()
+                if item is not _DONE:
+                    self._add(*item)
+        except queue.Empty:
+            pass
+        except Exception as e:
+            # the index stage failed, the batches left are embedded again on resume
+            print(f"Could not add the embedded batches left: {e}")
+
+    def _index(self, source: queue.Queue, checkpoint: IngestCheckpoint, total_files: Optional[int]) -> None:
+        from tqdm import tqdm
+
+        batches = 0
+        progress = tqdm(desc="Embedding 🦖", unit="batches")
+        for chunks, keys, vectors, new in self._iter(source):
+            self._add(chunks, keys, vectors, new)
+            batches += 1
+            progress.update()
+            if batches % self.checkpoint_every == 0:
+                checkpoint.save(self.store, self.done, self.ids_by_source)
+            if self.task_status is not None and total_files:
+                indexed = sum(self.done.values())
+                current = min(self._files_chunked / total_files, 1.0) * indexed / max(self.chunks, 1)
+                self.task_status.update_state(state='PROGRESS', meta={'current': int(current * 100)})
+        progress.close()
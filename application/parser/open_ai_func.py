@@ -1,16 +1,16 @@
 import os
 import faiss
-import pickle
 import tiktoken
-from langchain.vectorstores import FAISS
 from langchain.embeddings import OpenAIEmbeddings
-from langchain.text_splitter import CharacterTextSplitter
 
 #from langchain.embeddings import HuggingFaceEmbeddings
 #from langchain.embeddings import HuggingFaceInstructEmbeddings
 #from langchain.embeddings import CohereEmbeddings
 
-from retry import retry
+from parser.embedding_cache import EmbeddingCache, text_hash
+from parser.embedding_scheduler import EmbeddingScheduler
+from parser.index_factory import convert_and_save
+from parser.ingest_pipeline import IngestPipeline
 
 
 
@@ -21,47 +21,92 @@ def num_tokens_from_string(string: str, encoding_name: str) -> int:
     total_price = ((num_tokens/1000) * 0.0004)
     return num_tokens, total_price
 
-@retry(tries=10, delay=60)
-def store_add_texts_with_retry(store, i):
-    store.add_texts([i.page_content], metadatas=[i.metadata])
-    #store_pine.add_texts([i.page_content], metadatas=[i.metadata])
-
-def call_openai_api(docs, folder_name, task_status):
-# Function to create a vector store from the documents and save it to disk.
+# Number of chunks sent per embeddings request and maximum number of requests in flight.
+EMBEDDINGS_BATCH_SIZE = int(os.getenv("EMBEDDINGS_BATCH_SIZE", "100"))
+EMBEDDINGS_CONCURRENCY = int(os.getenv("EMBEDDINGS_CONCURRENCY", "8"))
+# Request and token budgets of the embeddings provider.
+EMBEDDINGS_RPM = int(os.getenv("EMBEDDINGS_RPM", "3000"))
+EMBEDDINGS_TPM = int(os.getenv("EMBEDDINGS_TPM", "1000000"))
+# Local cache of already embedded chunks, set EMBEDDINGS_CACHE_PATH to an empty string to disable it.
+EMBEDDINGS_CACHE_PATH = os.getenv("EMBEDDINGS_CACHE_PATH", "cache/embeddings.sqlite")
+EMBEDDINGS_CACHE_MB = int(os.getenv("EMBEDDINGS_CACHE_MB", "2048"))
+EMBEDDINGS_CACHE_DTYPE = os.getenv("EMBEDDINGS_CACHE_DTYPE", "float32")
+# Number of embedded batches between two checkpoints of the partial store.
+INGEST_CHECKPOINT_EVERY = int(os.getenv("INGEST_CHECKPOINT_EVERY", "10"))
+# Capacity of the queues between the stages of the ingest pipeline.
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "8"))
+# Type of the saved index: "auto" keeps small indexes flat and uses IVF from INDEX_ANN_MIN_VECTORS vectors,
+# any faiss factory string such as "Flat", "IVF4096,Flat" or "HNSW32" forces one. HNSW is never chosen by "auto".
+INDEX_FACTORY = os.getenv("INDEX_FACTORY", "auto")
+INDEX_ANN_MIN_VECTORS = int(os.getenv("INDEX_ANN_MIN_VECTORS", "50000"))
+# Search parameters saved with IVF and HNSW indexes, higher is more accurate and slower.
+INDEX_NPROBE = int(os.getenv("INDEX_NPROBE", "32"))
+INDEX_EF_SEARCH = int(os.getenv("INDEX_EF_SEARCH", "64"))
+# Storage of the vectors with "auto": none, fp16, int8 or pq (product quantization, smallest and least accurate).
+# Searches on compressed indexes fetch INDEX_RERANK times more candidates and re-rank them with exact distances.
+INDEX_COMPRESSION = os.getenv("INDEX_COMPRESSION", "none")
+INDEX_RERANK = int(os.getenv("INDEX_RERANK", "4"))
+# Indexes can be saved as shards searched in parallel: INDEX_SHARD_SIZE vectors per shard, or INDEX_SHARDS
+# shards that files are hashed to. Only shards holding re-uploaded files are rebuilt.
+INDEX_SHARDS = int(os.getenv("INDEX_SHARDS", "1"))
+INDEX_SHARD_SIZE = int(os.getenv("INDEX_SHARD_SIZE", "0"))
+INDEX_OPTIONS = {"min_vectors": INDEX_ANN_MIN_VECTORS, "compression": INDEX_COMPRESSION,
+                 "nprobe": INDEX_NPROBE, "ef_search": INDEX_EF_SEARCH, "rerank": INDEX_RERANK}
+
+
+def make_pipeline(folder_name, task_status=None, batch_size=EMBEDDINGS_BATCH_SIZE,
+                  max_workers=EMBEDDINGS_CONCURRENCY, store=None, checkpoint_every=INGEST_CHECKPOINT_EVERY,
+                  queue_size=INGEST_QUEUE_SIZE, save=True, max_tokens=None):
+# Function to create the ingest pipeline with the embeddings, scheduler and cache configured from the environment.
+# With max_tokens, the sections of each file are packed into chunks of up to max_tokens tokens.
 
     # create output folder if it doesn't exist
     if not os.path.exists(f"{folder_name}"):
         os.makedirs(f"{folder_name}")
 
-    from tqdm import tqdm
+    # retries are left to the scheduler, which needs to see rate limit errors to adapt
+    embeddings = OpenAIEmbeddings(openai_api_key=os.getenv("EMBEDDINGS_KEY"), max_retries=1)
 
-    # docs_test = [docs[0]]
-    # docs.pop(0)
-    c1 = 0
+    # Uncomment for MPNet embeddings
+    # model_name = "sentence-transformers/all-mpnet-base-v2"
+    # embeddings = HuggingFaceEmbeddings(model_name=model_name)
 
-    text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=0)
-    texts = text_splitter.split_documents(docs)
+    scheduler = EmbeddingScheduler(embeddings.embed_documents, requests_per_minute=EMBEDDINGS_RPM,
+                                   tokens_per_minute=EMBEDDINGS_TPM, max_concurrency=max_workers)
+    cache = None
+    if EMBEDDINGS_CACHE_PATH:
+        cache = EmbeddingCache(EMBEDDINGS_CACHE_PATH, max_bytes=EMBEDDINGS_CACHE_MB * 1024 * 1024,
+                               dtype=EMBEDDINGS_CACHE_DTYPE)
+    return IngestPipeline(folder_name, embeddings, store=store, scheduler=scheduler, cache=cache,
+                          batch_size=batch_size, queue_size=queue_size, checkpoint_every=checkpoint_every,
+                          task_status=task_status, index_factory=INDEX_FACTORY, index_options=INDEX_OPTIONS,
+                          save=save, max_tokens=max_tokens)
 
-    store = FAISS.from_documents(texts, OpenAIEmbeddings(openai_api_key=os.getenv("EMBEDDINGS_KEY")))
 
-    # Uncomment for MPNet embeddings
-    # model_name = "sentence-transformers/all-mpnet-base-v2"
-    # hf = HuggingFaceEmbeddings(model_name=model_name)
-    # store = FAISS.from_documents(docs_test, hf)
-    s1 = len(docs)
-    for i in tqdm(docs, desc="Embedding 🦖", unit="docs", total=len(docs), bar_format='{l_bar}{bar}| Time Left: {remaining}'):
-        try:
-            task_status.update_state(state='PROGRESS', meta={'current': int((c1 / s1) * 100)})
-            store_add_texts_with_retry(store, i)
-        except Exception as e:
-            print(e)
-            print("Error on ", i)
-            print("Saving progress")
-            print(f"stopped at {c1} out of {len(docs)}")
-            store.save_local(f"{folder_name}")
-            break
-        c1 += 1
-    store.save_local(f"{folder_name}")
+def save_store(store, folder_name):
+# Function to save a store with the index type configured from the environment, and its search parameters.
+    return convert_and_save(store, folder_name, INDEX_FACTORY, **INDEX_OPTIONS)
+
+
+def run_pipeline(pipeline, files, fingerprint, total_files=None):
+# Function to run an ingest pipeline and close its embedding cache.
+    try:
+        return pipeline.run(files, fingerprint, total_files=total_files)
+    finally:
+        if pipeline.cache is not None:
+            pipeline.cache.close()
+
+
+def call_openai_api(docs, folder_name, task_status=None, batch_size=EMBEDDINGS_BATCH_SIZE,
+                    max_workers=EMBEDDINGS_CONCURRENCY, store=None, checkpoint_every=INGEST_CHECKPOINT_EVERY):
+# Function to create a vector store from the documents and save it to disk.
+# Pass an already loaded store to add the documents to it instead of creating a new one.
+# Progress is checkpointed in folder_name, calling it again with the same documents after
+# a failure resumes from the last checkpoint.
+    pipeline = make_pipeline(folder_name, task_status, batch_size=batch_size, max_workers=max_workers,
+                             store=store, checkpoint_every=checkpoint_every)
+    fingerprint = text_hash("".join(text_hash(f"{doc.metadata.get('source')}\0{doc.page_content}") for doc in docs))
+    return run_pipeline(pipeline, [docs], fingerprint, total_files=1)
 
 def get_user_permission(docs, folder_name):
 # Function to ask user permission to call the OpenAI api and spend their OpenAI funds.
@@ -1,5 +1,6 @@
 """Base schema for readers."""
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Optional
 
 from langchain.docstore.document import Document as LCDocument
 
@@ -14,6 +15,9 @@ class Document(BaseDocument):
 
     """
 
+    # memoized number of tokens of `text`, see parser.token_func.count_tokens
+    token_count: Optional[int] = field(default=None, compare=False, repr=False)
+
     def __post_init__(self) -> None:
         """Post init."""
         if self.text is None:
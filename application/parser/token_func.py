@@ -1,70 +1,232 @@
 import re
 import tiktoken
 
-from typing import List
+from functools import lru_cache
+from typing import List, Optional
 from parser.schema.base import Document
-from math import ceil
+
+
+@lru_cache(maxsize=None)
+def get_encoding(encoding_name: str = "cl100k_base") -> tiktoken.Encoding:
+    """Shared tiktoken encoder, loaded once per process."""
+    return tiktoken.get_encoding(encoding_name)
+
+
+def count_tokens(doc: Document) -> int:
+    """Number of tokens of a document, memoized on the document."""
+    if doc.token_count is None:
+        doc.token_count = len(get_encoding().encode(doc.text))
+    return doc.token_count
+
+
+def _char_boundary(encoding: tiktoken.Encoding, tokens: List[int], position: int, lowest: int) -> int:
+    """Move a position in `tokens` back to the start of a character, but not below `lowest`.
+
+    Characters missing from the vocabulary are encoded as several byte tokens,
+    and a window cut between them would decode to a broken character.
+    """
+    while position > lowest and position < len(tokens) \
+            and encoding.decode_single_token_bytes(tokens[position])[0] & 0xC0 == 0x80:
+        # the token starts with a UTF-8 continuation byte
+        position -= 1
+    return position
+
+
+def _windows(encoding: tiktoken.Encoding, tokens: List[int], window: int, overlap: int = 0):
+    """Yield (start, end) windows of at most `window` tokens, sharing about `overlap` tokens.
+
+    Windows start and end on character boundaries.
+    """
+    start = 0
+    while True:
+        end = min(start + window, len(tokens))
+        if end < len(tokens):
+            end = _char_boundary(encoding, tokens, end, start + 1)
+        yield start, end
+        if end >= len(tokens):
+            return
+        start = _char_boundary(encoding, tokens, max(end - overlap, start + 1), start + 1)
+
+
+def split_text(text: str, max_tokens: int) -> List[str]:
+    """Split a text into parts of at most max_tokens tokens.
+
+    The text is encoded once and its token ids are decoded back per window.
+    """
+    encoding = get_encoding()
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return [text]
+    return [encoding.decode(tokens[start:end], errors="ignore") for start, end in _windows(encoding, tokens, max_tokens)]
 
 
 def separate_header_and_body(text):
     header_pattern = r"^(.*?\n){3}"
     match = re.match(header_pattern, text)
+    # documents shorter than three lines have no header
+    if match is None:
+        return "", text
     header = match.group(0)
     body = text[len(header):]
     return header, body
 
 def group_documents(documents: List[Document], min_tokens: int, max_tokens: int) -> List[Document]:
     docs = []
-    current_group = None
+    # the current group is kept as a list of texts and a running token count, so every
+    # document is encoded once instead of re-encoding the growing group on each step
+    group_head = None
+    group_texts = []
+    group_len = 0
+
+    def close_group():
+        docs.append(Document(text=" ".join(group_texts), doc_id=group_head.doc_id, embedding=group_head.embedding,
+                             extra_info=group_head.extra_info, token_count=group_len))
 
     for doc in documents:
-        doc_len = len(tiktoken.get_encoding("cl100k_base").encode(doc.text))
+        doc_len = count_tokens(doc)
 
-        if current_group is None:
-            current_group = Document(text=doc.text, doc_id=doc.doc_id, embedding=doc.embedding,
-                                     extra_info=doc.extra_info)
-        elif len(tiktoken.get_encoding("cl100k_base").encode(current_group.text)) + doc_len < max_tokens and doc_len >= min_tokens:
-            current_group.text += " " + doc.text
+        # joining adds at most one token per separator
+        if group_head is not None and group_len + 1 + doc_len < max_tokens and doc_len >= min_tokens:
+            group_texts.append(doc.text)
+            group_len += 1 + doc_len
         else:
-            docs.append(current_group)
-            current_group = Document(text=doc.text, doc_id=doc.doc_id, embedding=doc.embedding,
-                                     extra_info=doc.extra_info)
+            if group_head is not None:
+                close_group()
+            group_head = doc
+            group_texts = [doc.text]
+            group_len = doc_len
 
-    if current_group is not None:
-        docs.append(current_group)
+    if group_head is not None:
+        close_group()
 
     return docs
 
-def split_documents(documents: List[Document], max_tokens: int) -> List[Document]:
+def _section_key(doc: Document, header_level: Optional[int]):
+    """Identify the file a section comes from and its header above `header_level`.
+
+    Sections with different keys are never packed together. Files are told
+    apart by the "source" or "file_path" metadata.
+    """
+    extra_info = doc.extra_info or {}
+    header_path = extra_info.get("header_path") or ""
+    headers = tuple(header_path.split(" > "))[:header_level]
+    return extra_info.get("source", extra_info.get("file_path")), headers
+
+def _copy_info(doc: Document) -> Optional[dict]:
+    """Copy the metadata of a document for a chunk made from it, so that chunks can change theirs."""
+    return dict(doc.extra_info) if doc.extra_info is not None else None
+
+def pack_documents(documents: List[Document], max_tokens: int, header_level: Optional[int] = 1) -> List[Document]:
+    """Pack consecutive sections into chunks of up to max_tokens.
+
+    Sections are kept whole and in order, next-fit: a section goes into the
+    current chunk if it has room for it, otherwise it starts a new one, so
+    small sections fill up chunks instead of each becoming its own vector.
+    A new chunk is also started at every new file, and whenever the first
+    `header_level` headers of the section's "header_path" change, None
+    comparing the whole path. Sections longer than max_tokens are left
+    alone for split_documents.
+    """
     docs = []
+    # current chunk: first section, texts, token count
+    head, texts, tokens = None, [], 0
+    current_key = None
+
+    def close_chunk():
+        docs.append(Document(text="\n".join(texts), doc_id=head.doc_id, embedding=head.embedding,
+                             extra_info=_copy_info(head), token_count=tokens))
+
     for doc in documents:
-        token_length = len(tiktoken.get_encoding("cl100k_base").encode(doc.text))
-        if token_length <= max_tokens:
+        key = _section_key(doc, header_level)
+        doc_len = count_tokens(doc)
+        # joining adds at most one token per separator
+        if head is not None and key == current_key and tokens + 1 + doc_len <= max_tokens:
+            texts.append(doc.text)
+            tokens += 1 + doc_len
+            continue
+        if head is not None:
+            close_chunk()
+        head, texts, tokens = doc, [doc.text], doc_len
+        current_key = key
+    if head is not None:
+        close_chunk()
+
+    return docs
+
+def fill_ratio(documents: List[Document], max_tokens: int) -> float:
+    """Average share of max_tokens used by each chunk."""
+    if not documents:
+        return 0.0
+    return sum(min(count_tokens(doc), max_tokens) for doc in documents) / (len(documents) * max_tokens)
+
+def split_documents(documents: List[Document], max_tokens: int, overlap_tokens: int = 0) -> List[Document]:
+    """Split documents longer than max_tokens into windows of the token array.
+
+    The header (first three lines) is repeated at the start of every part, and
+    consecutive parts share `overlap_tokens` tokens of the body. Each document
+    is encoded once and only decoded at window boundaries, so every part is at
+    most max_tokens long. Windows are moved back to the start of a character
+    so that characters taking several tokens are not cut.
+    """
+    if overlap_tokens >= max_tokens:
+        raise ValueError(f"overlap_tokens ({overlap_tokens}) must be smaller than max_tokens ({max_tokens})")
+    encoding = get_encoding()
+    docs = []
+    for doc in documents:
+        if doc.token_count is not None and doc.token_count <= max_tokens:
             docs.append(doc)
-        else:
-            header, body = separate_header_and_body(doc.text)
-            num_body_parts = ceil(token_length / max_tokens)
-            part_length = ceil(len(body) / num_body_parts)
-            body_parts = [body[i:i + part_length] for i in range(0, len(body), part_length)]
-            for i, body_part in enumerate(body_parts):
-                new_doc = Document(text=header + body_part.strip(),
-                                   doc_id=f"{doc.doc_id}-{i}",
-                                   embedding=doc.embedding,
-                                   extra_info=doc.extra_info)
-                docs.append(new_doc)
+            continue
+        header, body = separate_header_and_body(doc.text)
+        header_tokens = encoding.encode(header)
+        body_tokens = encoding.encode(body)
+        if len(header_tokens) + len(body_tokens) <= max_tokens:
+            docs.append(doc)
+            continue
+        window = max_tokens - len(header_tokens)
+        if window <= overlap_tokens:
+            # the header leaves no room for the body, split the whole text instead
+            header, header_tokens = "", []
+            body_tokens = encoding.encode(doc.text)
+            window = max_tokens
+        for i, (start, end) in enumerate(_windows(encoding, body_tokens, window, overlap_tokens)):
+            part_tokens = body_tokens[start:end]
+            # only a character longer than the whole window is still cut
+            body_part = encoding.decode(part_tokens, errors="ignore")
+            new_doc = Document(text=header + body_part.strip(),
+                               doc_id=f"{doc.doc_id}-{i}",
+                               embedding=doc.embedding,
+                               extra_info=_copy_info(doc),
+                               token_count=len(header_tokens) + len(part_tokens))
+            docs.append(new_doc)
     return docs
 
-def group_split(documents: List[Document], max_tokens: int = 2000, min_tokens: int = 150, token_check: bool = True):
+def group_split(documents: List[Document], max_tokens: int = 2000, min_tokens: int = 150, token_check: bool = True,
+                overlap_tokens: int = 0, grouping: str = "consecutive"):
+    """Group small documents and split large ones.
+
+    grouping selects how small documents are merged: "consecutive" appends a
+    document to the previous group, "pack" packs consecutive sections of the
+    same file and top-level header up to max_tokens, see pack_documents.
+    """
     if token_check == False:
         return documents
+    if overlap_tokens >= max_tokens:
+        # checked before the failures of the steps below are reported and ignored
+        raise ValueError(f"overlap_tokens ({overlap_tokens}) must be smaller than max_tokens ({max_tokens})")
     print("Grouping small documents")
     try:
-        documents = group_documents(documents=documents, min_tokens=min_tokens, max_tokens=max_tokens)
+        if grouping == "pack":
+            num_sections = len(documents)
+            documents = pack_documents(documents=documents, max_tokens=max_tokens)
+            print(f"Packed {num_sections} sections into {len(documents)} chunks, "
+                  f"fill ratio {fill_ratio(documents, max_tokens):.0%}")
+        else:
+            documents = group_documents(documents=documents, min_tokens=min_tokens, max_tokens=max_tokens)
     except:
         print("Grouping failed, try running without token_check")
     print("Separating large documents")
     try:
-        documents = split_documents(documents=documents, max_tokens=max_tokens)
+        documents = split_documents(documents=documents, max_tokens=max_tokens, overlap_tokens=overlap_tokens)
     except:
         print("Grouping failed, try running without token_check")
     return documents
@@ -0,0 +1,94 @@
+"""Shared fixtures.
+
+Tests run from the application folder, which is on the path as it is for
+the app and the worker: `python -m pytest`.
+"""
+import hashlib
+import re
+
+import pytest
+import tiktoken
+
+from parser import token_func
+
+
+class ByteEncoding:
+    """Offline stand-in for a tiktoken encoding.
+
+    Runs of up to 4 ASCII letters or digits, optionally after one space,
+    are one token, and every other byte is a token of its own. Like
+    cl100k_base for rare characters, a multibyte character takes several
+    tokens, and decoding a window that cuts one needs `errors`.
+    """
+
+    _PIECE = re.compile(rb" ?[A-Za-z0-9]{1,4}|[\x00-\xff]")
+
+    def __init__(self):
+        self._ids = {}
+        self._pieces = []
+
+    def encode(self, text, **kwargs):
+        tokens = []
+        for piece in self._PIECE.findall(text.encode("utf-8")):
+            if piece not in self._ids:
+                self._ids[piece] = len(self._pieces)
+                self._pieces.append(piece)
+            tokens.append(self._ids[piece])
+        return tokens
+
+    def decode_single_token_bytes(self, token):
+        return self._pieces[token]
+
+    def decode(self, tokens, errors="replace"):
+        return b"".join(self._pieces[token] for token in tokens).decode("utf-8", errors=errors)
+
+
+@pytest.fixture(autouse=True)
+def byte_encoding(monkeypatch):
+    """Replace tiktoken encodings, which are downloaded on first use, with `ByteEncoding`."""
+    encoding = ByteEncoding()
+    monkeypatch.setattr(tiktoken, "get_encoding", lambda name: encoding)
+    token_func.get_encoding.cache_clear()
+    yield encoding
+    token_func.get_encoding.cache_clear()
+
+
+class FakeEmbeddings:
+    """Deterministic embeddings recording the batches they are asked to embed."""
+
+    model = "fake"
+
+    def __init__(self, dim=8, **kwargs):
+        self.dim = dim
+        self.batches = []
+
+    def _vector(self, text):
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return [float(byte) for byte in digest[:self.dim]]
+
+    def embed_documents(self, texts):
+        self.batches.append(list(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._vector(text)
+
+
+@pytest.fixture
+def embeddings():
+    return FakeEmbeddings()
+
+
+@pytest.fixture
+def make_store(embeddings):
+    """Build a flat langchain FAISS store of `count` chunks, saved in `folder` if given."""
+    from langchain.vectorstores import FAISS
+
+    def make(count, folder=None, source="doc.txt"):
+        texts = [f"chunk {i} of {source}" for i in range(count)]
+        store = FAISS.from_texts(texts, embeddings, metadatas=[{"source": source, "n": i} for i in range(count)])
+        if folder is not None:
+            store.save_local(str(folder))
+        return store
+
+    return make
@@ -0,0 +1,132 @@
+import os
+
+import pytest
+
+from parser.file.base_parser import BaseParser
+from parser.file.bulk import SimpleDirectoryReader
+
+
+class SectionParser(BaseParser):
+    """Returns every line as a section, and fails on files containing "fail"."""
+
+    def _init_parser(self):
+        return {}
+
+    def parse_file(self, file, errors="ignore"):
+        text = file.read_text()
+        if "fail" in text:
+            raise ValueError("cannot parse")
+        return [f"{line} (pid {os.getpid()})" for line in text.splitlines()]
+
+
+def write_files(folder, contents):
+    paths = []
+    for name, content in contents.items():
+        path = folder / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+        paths.append(str(path))
+    return paths
+
+
+def texts(documents):
+    return [doc.text.split(" (pid")[0] for doc in documents]
+
+
+@pytest.mark.parametrize("num_workers", [None, 2])
+def test_parallel_parsing_keeps_file_order(tmp_path, num_workers):
+    paths = write_files(tmp_path, {f"{i:02}.sec": f"a{i}\nb{i}" for i in range(10)})
+    reader = SimpleDirectoryReader(input_files=paths, file_extractor={".sec": SectionParser()},
+                                   num_workers=num_workers)
+    assert texts(reader.load_data()) == [f"{part}{i}" for i in range(10) for part in "ab"]
+
+
+def test_parallel_parsing_uses_worker_processes(tmp_path):
+    paths = write_files(tmp_path, {f"{i}.sec": "x" for i in range(4)})
+    reader = SimpleDirectoryReader(input_files=paths, file_extractor={".sec": SectionParser()}, num_workers=2)
+    assert all(f"(pid {os.getpid()})" not in doc.text for doc in reader.load_data())
+
+
+@pytest.mark.parametrize("num_workers", [None, 2])
+def test_files_failing_to_parse_are_skipped(tmp_path, num_workers):
+    paths = write_files(tmp_path, {"a.sec": "a", "b.sec": "fail", "c.sec": "c"})
+    reader = SimpleDirectoryReader(input_files=paths, file_extractor={".sec": SectionParser()},
+                                   num_workers=num_workers)
+    assert texts(reader.load_data()) == ["a", "c"]
+
+
+def test_file_metadata_is_attached_to_every_section(tmp_path):
+    paths = write_files(tmp_path, {"a.sec": "one\ntwo", "b.txt": "three"})
+    reader = SimpleDirectoryReader(input_files=paths, file_extractor={".sec": SectionParser()},
+                                   file_metadata=lambda path: {"source": os.path.basename(path)})
+    assert [doc.extra_info["source"] for doc in reader.load_data()] == ["a.sec", "a.sec", "b.txt"]
+
+
+def test_iter_data_yields_one_batch_per_file(tmp_path):
+    paths = write_files(tmp_path, {"a.sec": "1\n2\n3", "b.sec": "4"})
+    reader = SimpleDirectoryReader(input_files=paths, file_extractor={".sec": SectionParser()})
+    assert [texts(batch) for batch in reader.iter_data()] == [["1", "2", "3"], ["4"]]
+
+
+def test_iter_data_yields_fixed_size_batches(tmp_path):
+    paths = write_files(tmp_path, {"a.sec": "1\n2\n3", "b.sec": "4\n5"})
+    reader = SimpleDirectoryReader(input_files=paths, file_extractor={".sec": SectionParser()})
+    assert [texts(batch) for batch in reader.iter_data(batch_size=2)] == [["1", "2"], ["3", "4"], ["5"]]
+
+
+def test_files_are_parsed_lazily(tmp_path):
+    paths = write_files(tmp_path, {"a.sec": "a", "b.sec": "b"})
+
+    class CountingParser(SectionParser):
+        parsed = 0
+
+        def parse_file(self, file, errors="ignore"):
+            CountingParser.parsed += 1
+            return super().parse_file(file, errors)
+
+    documents = SimpleDirectoryReader(input_files=paths, file_extractor={".sec": CountingParser()}).iter_documents()
+    assert texts([next(documents)]) == ["a"]
+    assert CountingParser.parsed == 1
+
+
+def test_concatenate(tmp_path):
+    paths = write_files(tmp_path, {"a.txt": "a", "b.txt": "b"})
+    assert [doc.text for doc in SimpleDirectoryReader(input_files=paths).load_data(concatenate=True)] == ["a\nb"]
+
+
+def listed(folder, **kwargs):
+    reader = SimpleDirectoryReader(input_dir=str(folder), **kwargs)
+    return [os.path.relpath(str(path), str(folder)) for path in reader.input_files]
+
+
+@pytest.fixture
+def tree(tmp_path):
+    write_files(tmp_path, {
+        "b.md": "b", "a.md": "a", "big.md": "x" * 100, ".hidden.md": "h", "notes.txt": "n",
+        "docs/c.rst": "c", "docs/sub/d.md": "d", "build/e.md": "e",
+    })
+    return tmp_path
+
+
+def test_files_are_listed_before_subdirectories_in_name_order(tree):
+    assert listed(tree) == ["a.md", "b.md", "big.md", "notes.txt", "build/e.md", "docs/c.rst", "docs/sub/d.md"]
+
+
+def test_non_recursive_listing(tree):
+    assert listed(tree, recursive=False) == ["a.md", "b.md", "big.md", "notes.txt"]
+
+
+def test_required_extensions_and_hidden_files(tree):
+    assert listed(tree, required_exts=[".md"], exclude_hidden=False) == [
+        ".hidden.md", "a.md", "b.md", "big.md", "build/e.md", "docs/sub/d.md"]
+
+
+def test_include_and_exclude_globs(tree):
+    assert listed(tree, include_globs=["docs/*"]) == ["docs/c.rst", "docs/sub/d.md"]
+    # excluding a directory prunes everything below it
+    assert listed(tree, exclude_globs=["docs", "*.txt"]) == ["a.md", "b.md", "big.md", "build/e.md"]
+
+
+def test_max_file_size_and_limit(tree):
+    assert "big.md" not in listed(tree, max_file_size=10)
+    assert listed(tree, num_files_limit=2) == ["a.md", "b.md"]
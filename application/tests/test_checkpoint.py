@@ -0,0 +1,83 @@
+import time
+from collections import Counter
+
+import pytest
+import requests
+from langchain.docstore.document import Document
+
+from parser.checkpoint import IngestCheckpoint, is_transient_error
+from parser.embedding_cache import EmbeddingCache
+from parser.embedding_scheduler import EmbeddingScheduler
+from parser.ingest_pipeline import IngestPipeline
+from tests.conftest import FakeEmbeddings
+
+
+class RateLimitError(Exception):
+    """Named like the openai client's error."""
+
+
+class FailingEmbeddings(FakeEmbeddings):
+    """Fails every request after the first `succeed` ones."""
+
+    def __init__(self, succeed):
+        super().__init__()
+        self.succeed = succeed
+
+    def embed_documents(self, texts):
+        if len(self.batches) >= self.succeed:
+            raise ValueError("provider down")
+        return super().embed_documents(texts)
+
+
+class SlowCache(EmbeddingCache):
+    """Holds up the index stage on its first batch, so that the next one is still queued when the run fails."""
+
+    def put_many(self, model, texts, vectors):
+        if not hasattr(self, "waited"):
+            self.waited = True
+            time.sleep(0.3)
+        super().put_many(model, texts, vectors)
+
+
+def make_docs(count):
+    return [Document(page_content=f"chunk {i}", metadata={"source": "a.md"}) for i in range(count)]
+
+
+@pytest.mark.parametrize("error, transient", [
+    (RateLimitError("slow down"), True),
+    (requests.ConnectionError(), True),
+    (requests.Timeout(), True),
+    (ValueError("bad upload"), False),
+    (FileNotFoundError("index.faiss"), False),
+])
+def test_only_transient_errors_are_retried(error, transient):
+    assert is_transient_error(error) is transient
+
+
+def test_checkpoint_of_another_upload_is_ignored(tmp_path, embeddings):
+    store = IngestPipeline(str(tmp_path / "build"), embeddings).run([make_docs(2)], "x")["store"]
+    IngestCheckpoint(str(tmp_path), "first").save(store, Counter({"k": 1}), {"a.md": ["id"]})
+
+    assert IngestCheckpoint(str(tmp_path), "second").load(embeddings) is None
+    assert IngestCheckpoint(str(tmp_path), "first").load(embeddings) is None
+
+
+def test_failed_ingest_resumes_from_checkpoint(tmp_path):
+    docs = make_docs(10)
+    failing = FailingEmbeddings(succeed=2)
+    # one request at a time, so that the first two batches are the ones embedded
+    scheduler = EmbeddingScheduler(failing.embed_documents, max_concurrency=1, initial_concurrency=1)
+    pipeline = IngestPipeline(str(tmp_path), failing, scheduler=scheduler, cache=SlowCache(str(tmp_path / "cache")),
+                              batch_size=2, checkpoint_every=1, queue_size=1)
+    with pytest.raises(ValueError):
+        pipeline.run([docs], "upload")
+
+    retry = FakeEmbeddings()
+    result = IngestPipeline(str(tmp_path), retry, batch_size=2).run([docs], "upload")
+
+    embedded_again = [text for batch in retry.batches for text in batch]
+    # the second batch was still queued for indexing when the third failed, and saved with the checkpoint
+    assert sorted(embedded_again) == sorted(doc.page_content for doc in docs[4:])
+    assert result["embedded"] == 6
+    assert result["store"].index.ntotal == 10
+    assert not (tmp_path / "checkpoint").exists()
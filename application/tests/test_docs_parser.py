@@ -0,0 +1,79 @@
+from pathlib import Path
+
+import pytest
+
+from parser.file.base_parser import BaseParser
+from parser.file.bulk import SimpleDirectoryReader, _parse_file
+from parser.file.docs_parser import PDFParser
+
+
+def make_pdf(path, num_pages, empty_pages=()):
+    """Write a PDF with one line of text per page."""
+    objects = [b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    pages_id = 2 + 2 * num_pages
+    kids = []
+    for page in range(num_pages):
+        stream = b"BT ET" if page in empty_pages else b"BT /F1 12 Tf 40 700 Td (Page %d text) Tj ET" % (page + 1)
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] /Contents %d 0 R "
+                       b"/Resources << /Font << /F1 1 0 R >> >> >>" % (pages_id, len(objects)))
+        kids.append(len(objects))
+    objects.append(b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % kid for kid in kids), num_pages))
+    objects.append(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, len(objects), xref)
+    Path(path).write_bytes(bytes(out))
+    return Path(path)
+
+
+@pytest.fixture
+def pdf(tmp_path):
+    return make_pdf(tmp_path / "book.pdf", 10, empty_pages={3})
+
+
+def test_one_document_per_page_with_text(pdf):
+    docs = PDFParser(num_workers=1).parse_file(pdf)
+    assert [doc.extra_info["page"] for doc in docs] == [1, 2, 3, 5, 6, 7, 8, 9, 10]
+    assert "Page 5 text" in docs[3].text
+
+
+def test_page_ranges_extracted_in_parallel_keep_page_order(pdf):
+    sequential = PDFParser(num_workers=1).parse_file(pdf)
+    parallel = PDFParser(num_workers=2, min_pages_per_task=2).parse_file(pdf)
+    assert [(doc.text, doc.extra_info) for doc in parallel] == [(doc.text, doc.extra_info) for doc in sequential]
+
+
+def test_parser_is_limited_to_one_process_in_the_reader_pool(pdf):
+    parser = PDFParser(num_workers=4, min_pages_per_task=1)
+    docs = _parse_file(pdf, {".pdf": parser}, "ignore", in_pool=True)
+    assert parser.num_workers == 1
+    assert len(docs) == 9
+
+
+class WorkersParser(BaseParser):
+    """Returns the number of processes it may use."""
+
+    num_workers = 4
+
+    def _init_parser(self):
+        return {}
+
+    def parse_file(self, file, errors="ignore"):
+        return str(self.num_workers)
+
+
+@pytest.mark.parametrize("num_workers, expected", [(None, "4"), (2, "1")])
+def test_reader_limits_parsers_in_its_worker_processes(tmp_path, num_workers, expected):
+    paths = []
+    for name in ("a.x", "b.x"):
+        (tmp_path / name).write_text("")
+        paths.append(str(tmp_path / name))
+    reader = SimpleDirectoryReader(input_files=paths, file_extractor={".x": WorkersParser()}, num_workers=num_workers)
+    assert [doc.text for doc in reader.load_data()] == [expected, expected]
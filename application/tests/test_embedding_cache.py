@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+from langchain.docstore.document import Document
+
+from parser.embedding_cache import EmbeddingCache
+from parser.ingest_pipeline import IngestPipeline
+
+
+def test_round_trip_and_counters(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+    cache.put_many("m", ["a", "b"], [[1.0, 2.0], [3.0, 4.0]])
+
+    assert cache.get_many("m", ["b", "c", "a"]) == [[3.0, 4.0], None, [1.0, 2.0]]
+    assert (cache.hits, cache.misses) == (2, 1)
+    cache.close()
+
+
+def test_vectors_are_keyed_by_model(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+    cache.put_many("m1", ["a"], [[1.0]])
+    assert cache.get_many("m2", ["a"]) == [None]
+
+
+def test_float16_storage(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"), dtype="float16")
+    cache.put_many("m", ["a"], [[0.1, 0.2]])
+    assert np.allclose(cache.get_many("m", ["a"])[0], [0.1, 0.2], atol=1e-3)
+
+
+def test_unknown_dtype_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        EmbeddingCache(str(tmp_path / "cache.sqlite"), dtype="int8")
+
+
+def test_least_recently_used_vectors_are_evicted(tmp_path):
+    # 16 bytes per float32 vector of 4 dimensions, room for 2
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"), max_bytes=32)
+    cache.put_many("m", ["a"], [[1.0] * 4])
+    cache.put_many("m", ["b"], [[2.0] * 4])
+    cache.get_many("m", ["a"])
+    cache.put_many("m", ["c"], [[3.0] * 4])
+
+    assert [vector is not None for vector in cache.get_many("m", ["a", "b", "c"])] == [True, False, True]
+
+
+def stored_bytes(cache):
+    return cache._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+
+def test_size_is_tracked_without_scanning_the_table(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = EmbeddingCache(path, max_bytes=64)
+    statements = []
+    cache._conn.set_trace_callback(statements.append)
+
+    cache.put_many("m", ["a", "b", "a"], [[1.0] * 4, [2.0] * 4, [3.0] * 4])
+    # replacing a vector counts the difference in size
+    cache.put_many("m", ["b"], [[2.0] * 8])
+    assert cache._bytes == 48
+    assert not any("ORDER BY last_used" in sql or sql.endswith("FROM embeddings") for sql in statements)
+
+    cache.put_many("m", ["c", "d"], [[3.0] * 4, [4.0] * 4])
+    assert any("ORDER BY last_used" in sql for sql in statements)
+    cache._conn.set_trace_callback(None)
+    assert cache._bytes == stored_bytes(cache) <= 64
+    cache.close()
+    reopened = EmbeddingCache(path, max_bytes=64)
+    assert reopened._bytes == stored_bytes(reopened)
+
+
+def test_cache_persists_across_connections(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = EmbeddingCache(path)
+    cache.put_many("m", ["a"], [[1.0]])
+    cache.close()
+    assert EmbeddingCache(path).get_many("m", ["a"]) == [[1.0]]
+
+
+def test_cached_chunks_are_not_embedded_again(tmp_path, embeddings):
+    docs = [Document(page_content=f"chunk {i}", metadata={"source": "a.md"}) for i in range(5)]
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+    first = IngestPipeline(str(tmp_path / "one"), embeddings, cache=cache).run([docs], "one")
+    second = IngestPipeline(str(tmp_path / "two"), embeddings, cache=cache).run([docs], "two")
+
+    assert (first["embedded"], first["reused"]) == (5, 0)
+    assert (second["embedded"], second["reused"]) == (0, 5)
+    assert len(embeddings.batches) == 1
@@ -0,0 +1,99 @@
+import threading
+import time
+
+import pytest
+
+from parser.embedding_scheduler import EmbeddingScheduler, TokenBucket, is_rate_limit_error, is_retryable_error
+
+
+class RateLimitError(Exception):
+    """Named like the openai client's error."""
+
+
+class Embed:
+    """Embedding function failing with the given errors first, then returning one vector per text."""
+
+    def __init__(self, errors=(), delay=0.0):
+        self.errors = list(errors)
+        self.delay = delay
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, texts):
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            error = self.errors.pop(0) if self.errors else None
+        try:
+            time.sleep(self.delay)
+            if error is not None:
+                raise error
+            return [[float(len(text))] for text in texts]
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def scheduler(embed, **kwargs):
+    kwargs.setdefault("base_delay", 0.001)
+    return EmbeddingScheduler(embed, **kwargs)
+
+
+def test_error_classification():
+    assert is_rate_limit_error(RateLimitError())
+    assert is_retryable_error(RateLimitError())
+    assert not is_retryable_error(ValueError())
+
+
+def test_batches_are_yielded_in_order():
+    batches = [["a" * i] for i in range(1, 20)]
+    results = list(scheduler(Embed(delay=0.001), max_concurrency=4).map(batches))
+    assert results == [[[float(i)]] for i in range(1, 20)]
+
+
+def test_concurrency_never_exceeds_the_limit():
+    embed = Embed(delay=0.005)
+    list(scheduler(embed, max_concurrency=3, initial_concurrency=3).map([["x"]] * 30))
+    assert 1 < embed.max_in_flight <= 3
+
+
+def test_rate_limits_are_retried_and_halve_concurrency():
+    embed = Embed(errors=[RateLimitError()])
+    tasks = scheduler(embed, max_concurrency=8, initial_concurrency=4)
+
+    assert tasks.embed_batch(["abc"]) == [[3.0]]
+    assert embed.calls == 2
+    assert tasks.rate_limited == 1
+    assert tasks.concurrency < 4
+
+
+def test_permanent_errors_are_raised_at_once():
+    embed = Embed(errors=[ValueError("invalid key")])
+    with pytest.raises(ValueError):
+        scheduler(embed).embed_batch(["abc"])
+    assert embed.calls == 1
+
+
+def test_retries_are_bounded():
+    embed = Embed(errors=[RateLimitError()] * 5)
+    with pytest.raises(RateLimitError):
+        scheduler(embed, max_retries=2).embed_batch(["abc"])
+    assert embed.calls == 3
+
+
+def test_empty_batch_makes_no_request():
+    embed = Embed()
+    assert scheduler(embed).embed_batch([]) == []
+    assert embed.calls == 0
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(per_minute=600)
+    bucket.acquire(600)
+    start = time.monotonic()
+    bucket.acquire(2)
+    # 10 tokens per second
+    assert time.monotonic() - start >= 0.15
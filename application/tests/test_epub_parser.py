@@ -0,0 +1,53 @@
+import pytest
+from ebooklib import epub
+
+from parser.file.bulk import _parse_file
+from parser.file.epub_parser import EpubParser
+
+
+@pytest.fixture
+def book_file(tmp_path):
+    book = epub.EpubBook()
+    book.set_identifier("id")
+    book.set_title("Book")
+    book.set_language("en")
+    chapters = []
+    for number in range(1, 4):
+        chapter = epub.EpubHtml(title=f"Chapter {number}", file_name=f"ch{number}.xhtml")
+        chapter.content = f"<html><body><h1>Heading {number}</h1><p>Text of chapter {number}.</p></body></html>"
+        book.add_item(chapter)
+        chapters.append(chapter)
+    empty = epub.EpubHtml(title="Empty", file_name="empty.xhtml")
+    empty.content = "<html><body><p></p></body></html>"
+    book.add_item(empty)
+    # the third chapter is not in the table of contents
+    book.toc = [epub.Link("ch1.xhtml", "First", "ch1"), epub.Link("ch2.xhtml#part", "Second", "ch2")]
+    book.add_item(epub.EpubNcx())
+    book.add_item(epub.EpubNav())
+    book.spine = chapters[:2] + [empty, chapters[2]]
+    path = tmp_path / "book.epub"
+    epub.write_epub(str(path), book)
+    return path
+
+
+def test_one_document_per_chapter_in_reading_order(book_file):
+    docs = EpubParser(num_workers=1).parse_file(book_file)
+    assert [doc.extra_info for doc in docs] == [
+        {"chapter": 1, "chapter_title": "First"},
+        {"chapter": 2, "chapter_title": "Second"},
+        {"chapter": 4, "chapter_title": "Heading 3"},
+    ]
+    assert "Text of chapter 3." in docs[2].text
+
+
+def test_chapters_converted_in_parallel_keep_their_order(book_file):
+    sequential = EpubParser(num_workers=1).parse_file(book_file)
+    parallel = EpubParser(num_workers=2, min_chapters=1).parse_file(book_file)
+    assert [(doc.text, doc.extra_info) for doc in parallel] == [(doc.text, doc.extra_info) for doc in sequential]
+
+
+def test_parser_is_limited_to_one_process_in_the_reader_pool(book_file):
+    parser = EpubParser(num_workers=4, min_chapters=1)
+    docs = _parse_file(book_file, {".epub": parser}, "ignore", in_pool=True)
+    assert parser.num_workers == 1
+    assert len(docs) == 3
@@ -0,0 +1,49 @@
+from parser.file.html_parser import HTMLParser
+
+PAGE = """<?xml version="1.0" encoding="UTF-8"?>
+<html><head><title>My Page</title><style>p{}</style></head><body>
+<p>Some preamble text before any heading.</p>
+<section id="install"><h1>Install<a class="headerlink">¶</a></h1><p>Run the</p><p>installer now, café.</p>
+<script>var x=1;</script>
+<h2 id="linux">Linux</h2><ul><li>apt</li><li>get it done quickly</li></ul><!-- c -->after comment</section>
+<h2>Tiny</h2><p>x</p>
+<h1>Usage</h1>tail text of the usage heading here
+</body></html>"""
+
+
+def test_sections_follow_headings():
+    title, sections = HTMLParser().html_to_sections(PAGE)
+    assert title == "My Page"
+    assert [(heading, path) for heading, path, _, _ in sections] == [
+        (None, []), ("Install", ["Install"]), ("Linux", ["Install", "Linux"]), ("Usage", ["Usage"])]
+
+
+def test_text_cleanup():
+    _, sections = HTMLParser().html_to_sections(PAGE)
+    texts = [text for _, _, _, text in sections]
+    # permalinks, scripts and non ascii characters are dropped, blocks separate words
+    assert texts[1] == "Install Run the installer now, caf."
+    assert texts[2] == "Linux apt get it done quickly after comment"
+    assert texts[3] == "Usage tail text of the usage heading here"
+
+
+def test_anchor_is_the_id_of_the_heading_or_its_section():
+    _, sections = HTMLParser().html_to_sections(PAGE)
+    assert [anchor for _, _, anchor, _ in sections] == [None, "install", "linux", None]
+
+
+def test_short_sections_are_dropped():
+    _, sections = HTMLParser(min_chars=0).html_to_sections(PAGE)
+    assert "Tiny x" in [text for _, _, _, text in sections]
+
+
+def test_empty_page():
+    assert HTMLParser().html_to_sections("  ") == ("", [])
+
+
+def test_parse_file_metadata(tmp_path):
+    path = tmp_path / "page.html"
+    path.write_text(PAGE, encoding="utf-8")
+    docs = HTMLParser().parse_file(path)
+    assert docs[2].extra_info == {"title": "My Page", "header_path": "Install > Linux", "anchor": "linux"}
+    assert "anchor" not in docs[0].extra_info
@@ -0,0 +1,137 @@
+import gc
+import os
+
+import pytest
+
+from index_cache import IndexCache
+
+
+def make_index(folder, size=100):
+    os.makedirs(folder, exist_ok=True)
+    for name in ("index.faiss", "index.pkl"):
+        with open(os.path.join(folder, name), "wb") as f:
+            f.write(b"x" * size)
+    return str(folder)
+
+
+class Loader:
+    def __init__(self):
+        self.loaded = []
+
+    def __call__(self, path):
+        self.loaded.append(path)
+        return object()
+
+
+def test_hit_returns_cached_store(tmp_path):
+    path = make_index(tmp_path / "a")
+    cache = IndexCache(max_bytes=10000)
+    loader = Loader()
+
+    first = cache.get(path, loader)
+    assert cache.get(path, loader) is first
+    assert len(loader.loaded) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_changed_files_are_reloaded(tmp_path):
+    path = make_index(tmp_path / "a")
+    cache = IndexCache(max_bytes=10000)
+    loader = Loader()
+
+    first = cache.get(path, loader)
+    make_index(path, size=150)
+    assert cache.get(path, loader) is not first
+    assert len(loader.loaded) == 2
+
+
+def test_least_recently_used_store_is_evicted(tmp_path):
+    a, b, c = (make_index(tmp_path / name) for name in "abc")
+    # each store counts 200 bytes
+    cache = IndexCache(max_bytes=450)
+    loader = Loader()
+
+    cache.get(a, loader)
+    cache.get(b, loader)
+    cache.get(a, loader)
+    cache.get(c, loader)
+    assert cache.evictions == 1
+    assert cache.stats()["bytes"] == 400
+
+    cache.get(a, loader)
+    assert loader.loaded.count(a) == 1
+    cache.get(b, loader)
+    assert loader.loaded.count(b) == 2
+
+
+def test_stores_over_budget_are_not_cached(tmp_path):
+    path = make_index(tmp_path / "a")
+    cache = IndexCache(max_bytes=0)
+    loader = Loader()
+
+    cache.get(path, loader)
+    cache.get(path, loader)
+    assert len(loader.loaded) == 2
+    assert cache.stats()["entries"] == 0
+
+
+def test_invalidate_drops_store_and_stores_below(tmp_path):
+    parent = make_index(tmp_path / "user")
+    child = make_index(tmp_path / "user" / "job")
+    other = make_index(tmp_path / "user2")
+    cache = IndexCache(max_bytes=10000)
+    loader = Loader()
+    for path in (parent, child, other):
+        cache.get(path, loader)
+
+    cache.invalidate(parent)
+    assert cache.invalidations == 2
+    assert cache.stats()["entries"] == 1
+
+
+def test_missing_index_raises(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        IndexCache(max_bytes=10000).get(str(tmp_path / "missing"), Loader())
+
+
+def test_entries_are_capped_when_files_are_lazy(tmp_path):
+    a, b, c = (make_index(tmp_path / name) for name in "abc")
+    cache = IndexCache(max_bytes=10000, lazy_files=("index.faiss", "index.pkl"), max_entries=2)
+    loader = Loader()
+
+    for path in (a, b, c):
+        cache.get(path, loader)
+    assert cache.stats()["bytes"] == 0
+    assert cache.stats()["entries"] == 2
+    assert cache.evictions == 1
+
+
+def test_evicted_docstore_closes_once_released(tmp_path, make_store, embeddings):
+    from index_loader import load_store
+
+    a, b = tmp_path / "a", tmp_path / "b"
+    make_store(3, a)
+    make_store(3, b)
+    cache = IndexCache(max_bytes=10 ** 8, max_entries=1)
+    loader = lambda path: load_store(path, embeddings, lazy_docstore=True)
+
+    # a request still using the store when it is evicted
+    docstore = cache.get(str(a), loader).docstore
+    closer = docstore._closer
+    cache.get(str(b), loader)
+    assert cache.evictions == 1
+    assert docstore.count() == 3
+
+    del docstore
+    gc.collect()
+    assert not closer.alive
+
+
+def test_lazy_files_depend_on_zero_copy_mmap(monkeypatch):
+    import index_loader
+
+    monkeypatch.setattr(index_loader, "MMAP_ZERO_COPY", False)
+    assert index_loader.lazy_files(True, True) == (index_loader.DOCSTORE_FILE,)
+    monkeypatch.setattr(index_loader, "MMAP_ZERO_COPY", True)
+    assert index_loader.lazy_files(True, False) == (index_loader.INDEX_FILE,)
+    assert index_loader.lazy_files(False, False) == ()
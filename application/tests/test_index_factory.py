@@ -0,0 +1,136 @@
+import faiss
+import numpy as np
+import pytest
+
+from index_loader import load_store
+from parser.index_factory import (INDEX_PARAMS_FILE, VECTORS_FILE, RerankedIndex, build_index, choose_factory,
+                                  convert_and_save, convert_store, load_index_params)
+
+
+def random_vectors(count, dim=8, seed=0):
+    return np.random.default_rng(seed).random((count, dim), dtype=np.float32)
+
+
+def test_auto_keeps_small_indexes_flat():
+    assert choose_factory(1000, "auto", min_vectors=50000) == "Flat"
+    assert choose_factory(0, "auto") == "Flat"
+
+
+def test_auto_uses_ivf_for_large_indexes():
+    assert choose_factory(100000, "auto", min_vectors=50000) == "IVF1024,Flat"
+    assert choose_factory(100000, "auto", min_vectors=50000, compression="int8") == "IVF1024,SQ8"
+
+
+def test_auto_never_chooses_hnsw():
+    for ntotal in (10, 10 ** 4, 10 ** 6, 10 ** 8):
+        assert "HNSW" not in choose_factory(ntotal, "auto", min_vectors=1000)
+
+
+def test_forced_factory_is_kept():
+    assert choose_factory(1000, "HNSW32") == "HNSW32"
+    assert choose_factory(10 ** 6, "IVF4096,Flat") == "IVF4096,Flat"
+
+
+def test_forced_ivf_is_clamped_to_small_indexes():
+    assert choose_factory(1000, "IVF4096,Flat") == "IVF25,Flat"
+    assert choose_factory(10, "OPQ8,IVF4096,PQ8") == "OPQ8,IVF1,PQ8"
+    assert choose_factory(0, "IVF4096,Flat") == "Flat"
+
+
+@pytest.mark.parametrize("factory", ["IVF4096,Flat", "HNSW16"])
+def test_forced_factory_builds_on_small_store(make_store, factory):
+    store = make_store(100)
+    expected = store.similarity_search("chunk 7 of doc.txt", k=3)
+
+    index_params = convert_store(store, factory, nprobe=4096)
+    assert store.index.ntotal == 100
+    if factory.startswith("IVF"):
+        assert faiss.extract_index_ivf(store.index).nlist == 2
+        assert index_params["search"] == {"nprobe": 2}
+    else:
+        assert index_params["search"] == {"efSearch": 64}
+    assert store.similarity_search("chunk 7 of doc.txt", k=3)[0] == expected[0]
+
+
+def test_build_index_keeps_positions():
+    vectors = random_vectors(500)
+    index = build_index(vectors, "IVF8,Flat")
+    faiss.extract_index_ivf(index).nprobe = 8
+    _, found = index.search(vectors[:5], 1)
+    assert found[:, 0].tolist() == [0, 1, 2, 3, 4]
+
+
+def test_converted_index_is_saved_and_loaded(tmp_path, make_store, embeddings):
+    store = make_store(200)
+    expected = store.similarity_search("chunk 12 of doc.txt", k=4)
+
+    convert_and_save(store, str(tmp_path), "IVF4,Flat", nprobe=4)
+    assert (tmp_path / INDEX_PARAMS_FILE).exists()
+    assert load_index_params(str(tmp_path)) == {"factory": "IVF4,Flat", "search": {"nprobe": 4}}
+
+    loaded = load_store(str(tmp_path), embeddings)
+    assert faiss.extract_index_ivf(loaded.index).nprobe == 4
+    assert loaded.similarity_search("chunk 12 of doc.txt", k=4) == expected
+
+
+def test_compression_encodings():
+    assert choose_factory(1000, "auto", compression="fp16", dim=64) == "SQfp16"
+    assert choose_factory(1000, "auto", compression="int8", dim=64) == "SQ8"
+    # too few vectors to train a product quantizer
+    assert choose_factory(1000, "auto", compression="pq", dim=64) == "SQ8"
+    assert choose_factory(20000, "auto", compression="pq", dim=64) == "PQ4"
+    assert choose_factory(20000, "auto", compression="pq", dim=1536) == "PQ96"
+    assert choose_factory(20000, "auto", compression="pq", dim=24) == "PQ1"
+
+
+def test_unknown_compression_raises():
+    with pytest.raises(ValueError):
+        choose_factory(1000, "auto", compression="zip")
+
+
+def test_compressed_index_is_smaller():
+    vectors = random_vectors(1000, dim=64)
+    sizes = {factory: faiss.serialize_index(build_index(vectors, factory)).size
+             for factory in ("Flat", "SQfp16", "SQ8")}
+    assert sizes["SQfp16"] < sizes["Flat"] / 1.9
+    assert sizes["SQ8"] < sizes["Flat"] / 3.8
+
+
+def test_reranked_index_returns_exact_order():
+    vectors = random_vectors(1000, dim=16, seed=1)
+    queries = random_vectors(10, dim=16, seed=2)
+    exact_distances, exact = build_index(vectors, "Flat").search(queries, 5)
+
+    reranked = RerankedIndex(build_index(vectors, "SQ4"), vectors, rerank=50)
+    distances, found = reranked.search(queries, 5)
+    assert found.tolist() == exact.tolist()
+    np.testing.assert_allclose(distances, exact_distances, rtol=1e-5)
+    assert reranked.ntotal == 1000
+    # max marginal relevance searches get the full precision vectors
+    np.testing.assert_array_equal(reranked.reconstruct(3), vectors[3])
+
+
+def test_reranked_index_pads_missing_results():
+    vectors = random_vectors(3)
+    distances, found = RerankedIndex(build_index(vectors, "SQ8"), vectors, rerank=2).search(vectors[:1], 5)
+    assert sorted(found[0, :3].tolist()) == [0, 1, 2]
+    assert found[0, 3:].tolist() == [-1, -1]
+    assert np.isinf(distances[0, 3:]).all()
+
+
+def test_compressed_store_is_saved_with_vectors_and_reranked(tmp_path, make_store, embeddings):
+    store = make_store(200)
+    expected = store.similarity_search("chunk 12 of doc.txt", k=4)
+
+    index_params = convert_and_save(store, str(tmp_path), "auto", compression="int8", rerank=4)
+    assert index_params == {"factory": "SQ8", "search": {}, "rerank": 4}
+    assert np.load(tmp_path / VECTORS_FILE).shape == (200, 8)
+
+    loaded = load_store(str(tmp_path), embeddings, mmap=True)
+    assert isinstance(loaded.index, RerankedIndex)
+    assert loaded.similarity_search("chunk 12 of doc.txt", k=4) == expected
+
+    # saving it again uncompressed drops the full precision vectors
+    convert_and_save(make_store(200), str(tmp_path), "Flat")
+    assert not (tmp_path / VECTORS_FILE).exists()
+    assert not isinstance(load_store(str(tmp_path), embeddings).index, RerankedIndex)
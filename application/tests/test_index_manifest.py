@@ -0,0 +1,73 @@
+import faiss
+import numpy as np
+from langchain.docstore.in_memory import InMemoryDocstore
+from langchain.docstore.document import Document
+from langchain.vectorstores import FAISS
+
+from parser.index_manifest import IndexManifest, file_hash, remove_vectors, source_hashes
+
+
+def write(path, content):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+    return path
+
+
+def test_source_hashes_cover_every_parsed_extension(tmp_path):
+    for name in ("a.md", "b.rst", "docs/c.html", "docs/d.pdf", "e.csv", "notes.txt", ".hidden.md"):
+        write(tmp_path / name, name)
+
+    hashes = source_hashes(str(tmp_path))
+    assert sorted(hashes) == ["a.md", "b.rst", "docs/c.html", "docs/d.pdf", "e.csv"]
+    assert hashes["a.md"] == file_hash(str(tmp_path / "a.md"))
+
+
+def test_source_hashes_keep_requested_formats(tmp_path):
+    for name in ("a.md", "b.rst", "c.html", "d.txt"):
+        write(tmp_path / name, name)
+
+    assert sorted(source_hashes(str(tmp_path), [".md", ".html", ".txt"])) == ["a.md", "c.html"]
+
+
+def test_diff_finds_new_changed_and_deleted_files(tmp_path):
+    manifest = IndexManifest()
+    manifest.update("same.md", "1", ["a"])
+    manifest.update("changed.md", "2", ["b"])
+    manifest.update("deleted.md", "3", ["c", "d"])
+    manifest.save(str(tmp_path))
+
+    to_embed, stale = IndexManifest.load(str(tmp_path)).diff({"same.md": "1", "changed.md": "X", "new.md": "4"})
+    assert sorted(to_embed) == ["changed.md", "new.md"]
+    assert sorted(stale) == ["changed.md", "deleted.md"]
+    assert sorted(manifest.stale_ids(stale)) == ["b", "c", "d"]
+
+
+def test_missing_manifest_loads_as_none(tmp_path):
+    assert IndexManifest.load(str(tmp_path)) is None
+
+
+def make_store(count, dim=4):
+    index = faiss.IndexFlatL2(dim)
+    index.add(np.arange(count * dim, dtype=np.float32).reshape(count, dim))
+    ids = [f"id{i}" for i in range(count)]
+    docstore = InMemoryDocstore({doc_id: Document(page_content=doc_id) for doc_id in ids})
+    return FAISS(lambda text: [0.0] * dim, index, docstore, dict(enumerate(ids)))
+
+
+def test_remove_vectors_keeps_positions_and_ids_aligned():
+    store = make_store(5)
+    assert remove_vectors(store, ["id1", "id3", "unknown"]) == 2
+
+    assert store.index.ntotal == 3
+    assert store.index_to_docstore_id == {0: "id0", 1: "id2", 2: "id4"}
+    assert "id1" not in store.docstore._dict
+    # the vector at each position is still the one of its chunk
+    for position, doc_id in store.index_to_docstore_id.items():
+        original = int(doc_id[2:])
+        assert store.index.reconstruct(position)[0] == original * 4
+
+
+def test_remove_nothing():
+    store = make_store(2)
+    assert remove_vectors(store, []) == 0
+    assert store.index.ntotal == 2
@@ -0,0 +1,176 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from langchain.docstore.document import Document
+from langchain.docstore.in_memory import InMemoryDocstore
+
+from index_cache import IndexCache
+from index_loader import load_store
+from parser.index_factory import convert_and_save
+from parser.index_shards import (SHARDS_DIR, SHARDS_FILE, ShardedDocstore, ShardedIdMap, ShardLayout,
+                                 add_to_shards, is_sharded, new_version, publish_layout, shard_path)
+
+
+def save_sharded(store, folder, num_shards, factory="Flat"):
+    """Save `store` as shards, by source file of the chunks."""
+    layout = ShardLayout.create(store.index.ntotal, num_shards)
+    # every shard is saved, even those no file is assigned to
+    shard_ids = {shard: [] for shard in range(num_shards)}
+    for doc_id in store.index_to_docstore_id.values():
+        source = store.docstore.search(doc_id).metadata["source"]
+        shard_ids.setdefault(layout.assign(source, 1), []).append(doc_id)
+    shards = {}
+    add_to_shards(store, shard_ids, shards)
+    for shard, shard_store in shards.items():
+        convert_and_save(shard_store, shard_path(str(folder), shard), factory, nprobe=64)
+    layout.save(str(folder))
+    return layout
+
+
+def make_sources(make_store, sources=("a.md", "b.md", "c.md", "d.md"), count=60):
+    store = make_store(count, source=sources[0])
+    for source in sources[1:]:
+        store.merge_from(make_store(count, source=source))
+    return store
+
+
+def test_layout_by_size_adds_shards_when_full():
+    layout = ShardLayout.create(100, max_vectors=50)
+    assert layout.num_shards == 2
+    assert layout.assign("a", 40) == 0
+    assert layout.assign("b", 40) == 1
+    assert layout.assign("c", 40) == 2
+    assert layout.sizes == [40, 40, 40]
+    assert layout.remove("b", 40) == 1
+    assert layout.assign("d", 10) == 1
+
+
+def test_layout_by_file_is_stable(tmp_path):
+    layout = ShardLayout.create(100, num_shards=4)
+    shard = layout.assign("docs/a.md", 10)
+    layout.save(str(tmp_path))
+    loaded = ShardLayout.load(str(tmp_path))
+    assert loaded.assign("docs/a.md", 5) == shard
+    assert loaded.sizes[shard] == 15
+    assert ShardLayout.create(100, num_shards=4).assign("docs/a.md", 1) == shard
+
+
+@pytest.mark.parametrize("lazy_docstore", [False, True])
+@pytest.mark.parametrize("factory", ["Flat", "IVF2,Flat"])
+def test_sharded_store_searches_like_single_store(tmp_path, make_store, embeddings, factory, lazy_docstore):
+    store = make_sources(make_store)
+    layout = save_sharded(store, tmp_path, 3, factory)
+    assert is_sharded(str(tmp_path))
+
+    with ThreadPoolExecutor(2) as executor:
+        loaded = load_store(str(tmp_path), embeddings, mmap=True, lazy_docstore=lazy_docstore, executor=executor)
+        assert loaded.index.ntotal == store.index.ntotal == sum(layout.sizes)
+        for query in ("chunk 5 of b.md", "chunk 40 of d.md"):
+            assert loaded.similarity_search(query, k=5) == store.similarity_search(query, k=5)
+
+
+@pytest.mark.parametrize("sharded", [False, True])
+def test_max_marginal_relevance_search_on_ivf(tmp_path, make_store, embeddings, sharded):
+    store = make_sources(make_store)
+    if sharded:
+        save_sharded(store, tmp_path, 2, "IVF2,Flat")
+    else:
+        convert_and_save(store, str(tmp_path), "IVF2,Flat")
+
+    loaded = load_store(str(tmp_path), embeddings, mmap=True)
+    found = loaded.max_marginal_relevance_search("chunk 5 of b.md", k=4, fetch_k=10)
+    assert len(found) == 4
+    assert all(isinstance(doc, Document) for doc in found)
+
+
+class CountingDocstore(InMemoryDocstore):
+    def __init__(self, docs):
+        super().__init__(docs)
+        self.lookups = 0
+
+    def search(self, search):
+        self.lookups += 1
+        return super().search(search)
+
+
+def test_docstore_looks_ids_up_in_their_shard():
+    docstores = [CountingDocstore({f"id{shard}": Document(page_content=str(shard))}) for shard in range(3)]
+    id_map = ShardedIdMap([{0: "id0"}, {0: "id1"}, {0: "id2"}], [0, 1, 2])
+    docstore = ShardedDocstore(docstores)
+
+    assert docstore.search(id_map[2]).page_content == "2"
+    assert [store.lookups for store in docstores] == [0, 0, 1]
+    assert id_map[2] == "id2"
+
+    # ids not from the id map are looked for in every shard
+    assert docstore.search("id1").page_content == "1"
+    assert docstore.search("missing") == "ID missing not found."
+
+
+def upload_version(folder, layout, shards):
+    """Save `shards` into a new version of the index in `folder` and publish it, as the app does."""
+    layout.version = new_version()
+    for shard, shard_store in shards.items():
+        shard_store.save_local(shard_path(str(folder), shard, layout.version))
+    staged = folder / f".{SHARDS_FILE}.{layout.version}"
+    layout.save(str(folder))
+    (folder / SHARDS_FILE).rename(staged)
+    return publish_layout(str(folder), str(staged))
+
+
+def test_unsharded_layout_loads_from_numbered_folders(tmp_path, make_store, embeddings):
+    save_sharded(make_sources(make_store), tmp_path, 2)
+    assert ShardLayout.load(str(tmp_path)).version == ""
+    assert (tmp_path / SHARDS_DIR / "0" / "index.faiss").exists()
+    assert load_store(str(tmp_path), embeddings).index.ntotal == 240
+
+
+def test_new_version_switches_all_shards_at_once(tmp_path, make_store, embeddings):
+    save_sharded(make_sources(make_store), tmp_path, 2)
+    first = upload_version(tmp_path, ShardLayout.load(str(tmp_path)), {0: make_store(5, source="x.md"),
+                                                                        1: make_store(7, source="y.md")})
+    assert load_store(str(tmp_path), embeddings).index.ntotal == 12
+
+    # shard 1 is rebuilt, shard 0 is unchanged and linked from the current version
+    staged_layout = ShardLayout.load(str(tmp_path))
+    staged_layout.sizes = [5, 3]
+    staged_layout.version = new_version()
+    shard_store = make_store(3, source="z.md")
+    shard_store.save_local(shard_path(str(tmp_path), 1, staged_layout.version))
+    # the current version is still served while the new one is uploaded
+    assert load_store(str(tmp_path), embeddings).index.ntotal == 12
+    staged_layout.save(str(tmp_path / SHARDS_DIR))
+    published = publish_layout(str(tmp_path), str(tmp_path / SHARDS_DIR / SHARDS_FILE))
+
+    assert ShardLayout.load(str(tmp_path)).version == published.version == staged_layout.version
+    loaded = load_store(str(tmp_path), embeddings)
+    assert loaded.index.ntotal == 8
+    assert loaded.similarity_search("chunk 2 of z.md", k=1)[0].metadata["source"] == "z.md"
+    # the previous version is kept for readers still loading it, older ones are removed
+    assert sorted(p.name for p in (tmp_path / SHARDS_DIR).iterdir()) == sorted([first.version, published.version])
+
+
+def test_missing_shard_is_not_published(tmp_path, make_store):
+    layout = ShardLayout.create(10, num_shards=2)
+    layout.version = new_version()
+    make_store(3).save_local(shard_path(str(tmp_path), 0, layout.version))
+    layout.save(str(tmp_path / SHARDS_DIR))
+
+    with pytest.raises(FileNotFoundError):
+        publish_layout(str(tmp_path), str(tmp_path / SHARDS_DIR / SHARDS_FILE))
+    assert not is_sharded(str(tmp_path))
+
+
+def test_cache_reloads_sharded_index_when_published(tmp_path, make_store, embeddings):
+    upload_version(tmp_path, ShardLayout.create(10, num_shards=2), {0: make_store(2), 1: make_store(3)})
+    cache = IndexCache(max_bytes=10 ** 8)
+    loader = lambda path: load_store(path, embeddings)
+
+    first = cache.get(str(tmp_path), loader)
+    assert cache.stats()["bytes"] > 0
+    # uploading shards of a new version does not change the index
+    make_store(4).save_local(shard_path(str(tmp_path), 0, new_version()))
+    assert cache.get(str(tmp_path), loader) is first
+
+    upload_version(tmp_path, ShardLayout.load(str(tmp_path)), {0: make_store(4), 1: make_store(1)})
+    assert cache.get(str(tmp_path), loader).index.ntotal == 5
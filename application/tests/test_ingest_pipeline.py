@@ -0,0 +1,98 @@
+import json
+
+import pytest
+from langchain.docstore.document import Document
+
+from parser.embedding_cache import EmbeddingCache
+from parser.index_factory import INDEX_PARAMS_FILE
+from parser.ingest_pipeline import IngestPipeline
+
+
+def make_files(num_files, chunks_per_file):
+    return [[Document(page_content=f"file {f} chunk {c}", metadata={"source": f"f{f}.md"})
+             for c in range(chunks_per_file)] for f in range(num_files)]
+
+
+def test_every_chunk_is_indexed_with_its_source(tmp_path, embeddings):
+    result = IngestPipeline(str(tmp_path), embeddings, batch_size=4).run(make_files(3, 5), "run")
+    store = result["store"]
+
+    assert result["chunks"] == result["embedded"] == store.index.ntotal == 15
+    for source, ids in result["ids_by_source"].items():
+        assert len(ids) == 5
+        assert {store.docstore.search(doc_id).metadata["source"] for doc_id in ids} == {source}
+
+
+def test_vectors_match_their_chunks(tmp_path, embeddings):
+    store = IngestPipeline(str(tmp_path), embeddings, batch_size=3).run(make_files(2, 4), "run")["store"]
+    for position, doc_id in store.index_to_docstore_id.items():
+        text = store.docstore.search(doc_id).page_content
+        assert list(store.index.reconstruct(position)) == embeddings.embed_query(text)
+
+
+def test_files_are_consumed_while_chunks_are_embedded(tmp_path, embeddings):
+    consumed = []
+
+    def files():
+        for i, docs in enumerate(make_files(60, 2)):
+            consumed.append((i, len(embeddings.batches)))
+            yield docs
+
+    IngestPipeline(str(tmp_path), embeddings, batch_size=2, queue_size=1).run(files(), "run")
+    # the last files were read after the first batches had been embedded
+    assert consumed[-1][1] > 0
+
+
+def test_cached_and_new_chunks_are_both_indexed(tmp_path, embeddings):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+    IngestPipeline(str(tmp_path / "one"), embeddings, cache=cache).run(make_files(1, 3), "one")
+    result = IngestPipeline(str(tmp_path / "two"), embeddings, cache=cache, batch_size=2).run(make_files(2, 3), "two")
+
+    assert (result["reused"], result["embedded"]) == (3, 3)
+    assert result["store"].index.ntotal == 6
+
+
+def test_failing_stage_stops_the_run(tmp_path, embeddings):
+    def files():
+        yield make_files(1, 2)[0]
+        raise OSError("disk gone")
+
+    with pytest.raises(OSError):
+        IngestPipeline(str(tmp_path), embeddings).run(files(), "run")
+
+
+def test_store_is_saved_with_its_index_params(tmp_path, embeddings):
+    IngestPipeline(str(tmp_path), embeddings).run(make_files(1, 2), "run")
+    assert (tmp_path / "index.faiss").exists()
+    assert json.loads((tmp_path / INDEX_PARAMS_FILE).read_text())["factory"] == "Flat"
+
+
+def test_store_is_not_saved_when_disabled(tmp_path, embeddings):
+    result = IngestPipeline(str(tmp_path), embeddings, save=False).run(make_files(1, 2), "run")
+    assert result["store"].index.ntotal == 2
+    assert not (tmp_path / "index.faiss").exists()
+
+
+def test_sections_longer_than_max_tokens_are_split(tmp_path, embeddings):
+    section = " ".join(f"word{i}" for i in range(400))
+    files = [[Document(page_content=section, metadata={"source": "long.md"}),
+              Document(page_content="short", metadata={"source": "long.md"})]]
+    result = IngestPipeline(str(tmp_path), embeddings, batch_size=4, max_tokens=50).run(files, "run")
+    store = result["store"]
+
+    assert result["chunks"] == store.index.ntotal > 8
+    docs = [store.docstore.search(doc_id) for doc_id in result["ids_by_source"]["long.md"]]
+    assert all(doc.metadata == {"source": "long.md"} for doc in docs)
+    # every part has metadata of its own
+    assert len({id(doc.metadata) for doc in docs}) == len(docs)
+
+
+def test_fill_ratio_of_packed_chunks(tmp_path, embeddings, capsys):
+    # 8 sections of 6 tokens each, packed 2 per chunk of up to 15 tokens
+    files = [[Document(page_content="w1 w2 w3 w4 w5 w6", metadata={"source": "a.md"}) for _ in range(8)]]
+    pipeline = IngestPipeline(str(tmp_path), embeddings, max_tokens=15)
+    result = pipeline.run(files, "run")
+
+    assert result["chunks"] == 4
+    assert pipeline.fill_ratio() == pytest.approx(13 / 15)
+    assert "Packed 8 sections into 4 chunks, fill ratio 87%" in capsys.readouterr().out
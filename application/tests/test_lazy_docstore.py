@@ -0,0 +1,66 @@
+import os
+import sqlite3
+
+import pytest
+from langchain.docstore.document import Document
+
+from index_loader import load_store
+from lazy_docstore import DOCSTORE_DB, SQLiteDocstore, SQLiteIdMap, convert_docstore, is_converted
+
+
+def test_converted_docstore_serves_chunks_by_id_and_position(tmp_path, make_store):
+    store = make_store(5, tmp_path)
+    db_path = convert_docstore(str(tmp_path))
+    assert db_path == os.path.join(str(tmp_path), DOCSTORE_DB)
+
+    docstore = SQLiteDocstore(db_path)
+    id_map = SQLiteIdMap(docstore)
+    assert dict(id_map) == dict(store.index_to_docstore_id)
+    assert len(id_map) == 5
+    doc = docstore.search(id_map[3])
+    assert doc == store.docstore.search(store.index_to_docstore_id[3])
+    assert doc.metadata == {"source": "doc.txt", "n": 3}
+    assert docstore.search("missing") == "ID missing not found."
+    docstore.close()
+
+
+def test_missing_position_raises_key_error(tmp_path, make_store):
+    make_store(2, tmp_path)
+    id_map = SQLiteIdMap(SQLiteDocstore(convert_docstore(str(tmp_path))))
+    with pytest.raises(KeyError):
+        id_map[7]
+
+
+def test_conversion_is_redone_when_pickle_changes(tmp_path, make_store):
+    make_store(2, tmp_path)
+    assert not is_converted(str(tmp_path))
+    convert_docstore(str(tmp_path))
+    assert is_converted(str(tmp_path))
+
+    # a different number of chunks changes the size of the pickle
+    make_store(3, tmp_path)
+    assert not is_converted(str(tmp_path))
+
+
+def test_closed_docstore_is_not_reopened(tmp_path, make_store):
+    make_store(2, tmp_path)
+    docstore = SQLiteDocstore(convert_docstore(str(tmp_path)))
+    assert docstore.count() == 2
+    docstore.close()
+    docstore.close()
+    assert docstore.closed
+    with pytest.raises(sqlite3.ProgrammingError):
+        docstore.count()
+
+
+def test_lazy_store_searches_like_pickled_store(tmp_path, make_store, embeddings):
+    make_store(20, tmp_path)
+    pickled = load_store(str(tmp_path), embeddings)
+    lazy = load_store(str(tmp_path), embeddings, lazy_docstore=True)
+    assert is_converted(str(tmp_path))
+
+    for query in ("chunk 3", "chunk 17 of doc.txt"):
+        expected = pickled.similarity_search(query, k=4)
+        found = lazy.similarity_search(query, k=4)
+        assert found == expected
+        assert all(isinstance(doc, Document) for doc in found)
@@ -0,0 +1,50 @@
+import pytest
+
+from parser.file.markdown_parser import MarkdownParser
+from parser.token_func import get_encoding
+
+
+def test_tags_in_link_text_are_removed():
+    parser = MarkdownParser()
+    assert parser.markdown_to_tups("# H\nsee [a <b>x</b>](http://u) ok") == [("H", "see a x ok")]
+
+
+@pytest.mark.parametrize("options, expected", [
+    ({}, "a link and text"),
+    ({"remove_hyperlinks": False}, "a [link](u) and text"),
+    ({"remove_images": False}, "a link![[img.png]] and text"),
+    ({"remove_hyperlinks": False, "remove_images": False}, "a [link](u)![[img.png]] and text"),
+])
+def test_cleanup_rules(options, expected):
+    parser = MarkdownParser(**options)
+    [(_, text)] = parser.markdown_to_tups("# H\na [link](u)![[img.png]] and <i>text</i>")
+    assert text == expected
+
+
+def test_sections_keep_their_header_path():
+    text = "# Install\nintro\n## Linux\napt\n## Mac\nbrew\n# Usage\nrun\n"
+    sections = MarkdownParser().markdown_to_sections(text)
+    assert [(header, path) for header, path, _ in sections] == [
+        ("Install", ["Install"]), ("Linux", ["Install", "Linux"]), ("Mac", ["Install", "Mac"]), ("Usage", ["Usage"])]
+    assert [body for _, _, body in sections] == ["intro\n", "apt\n", "brew\n", "run\n"]
+
+
+def test_files_without_headers_are_flattened():
+    assert MarkdownParser().markdown_to_tups("one\ntwo\n") == [(None, "onetwo")]
+
+
+def test_long_multibyte_sections_are_split():
+    # 90 characters of 4 bytes, and 4 tokens each
+    parser = MarkdownParser(max_tokens=100)
+    sections = parser.markdown_to_tups("# H\n" + "🦖" * 90)
+    assert len(sections) > 1
+    assert all(len(get_encoding().encode(text)) <= 100 for _, text in sections)
+    assert "".join(text for _, text in sections) == "🦖" * 90
+
+
+def test_parse_file_returns_a_document_per_section(tmp_path):
+    path = tmp_path / "doc.md"
+    path.write_text("# Install\nintro\n## Linux\napt\n")
+    docs = MarkdownParser().parse_file(path)
+    assert [doc.extra_info["header_path"] for doc in docs] == ["Install", "Install > Linux"]
+    assert docs[1].text == "\n\nLinux\napt\n"
@@ -0,0 +1,68 @@
+import pytest
+from langchain.docstore.document import Document
+
+from parser import open_ai_func
+from tests.conftest import FakeEmbeddings
+
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    created = []
+
+    def make(**kwargs):
+        created.append(FakeEmbeddings())
+        return created[-1]
+
+    monkeypatch.setattr(open_ai_func, "OpenAIEmbeddings", make)
+    monkeypatch.setattr(open_ai_func, "EMBEDDINGS_CACHE_PATH", "")
+    return created
+
+
+def make_docs(count):
+    return [Document(page_content=f"document number {i}", metadata={"source": f"doc{i}.md"})
+            for i in range(count)]
+
+
+def test_chunks_are_embedded_once_in_batches(tmp_path, fake_openai):
+    result = open_ai_func.call_openai_api(make_docs(25), str(tmp_path), batch_size=10, max_workers=3)
+
+    batches = fake_openai[0].batches
+    assert sorted(len(batch) for batch in batches) == [5, 10, 10]
+    embedded = [text for batch in batches for text in batch]
+    assert sorted(embedded) == sorted(doc.page_content for doc in make_docs(25))
+    assert result["embedded"] == 25
+    assert (tmp_path / "index.faiss").exists()
+
+
+def test_store_holds_every_chunk_with_its_source(tmp_path, fake_openai):
+    store = open_ai_func.call_openai_api(make_docs(7), str(tmp_path), batch_size=3)["store"]
+
+    assert store.index.ntotal == 7
+    sources = {store.docstore.search(doc_id).metadata["source"]
+               for doc_id in store.index_to_docstore_id.values()}
+    assert sources == {f"doc{i}.md" for i in range(7)}
+
+
+def test_progress_is_reported_per_batch(tmp_path, fake_openai):
+    class Task:
+        def __init__(self):
+            self.states = []
+
+        def update_state(self, state, meta):
+            self.states.append(meta["current"])
+
+    task = Task()
+    open_ai_func.call_openai_api(make_docs(9), str(tmp_path), task_status=task, batch_size=3)
+    assert len(task.states) == 3
+    assert task.states[-1] == 100
+
+
+def test_sections_are_packed_by_tokens(tmp_path, fake_openai):
+    docs = [Document(page_content=" ".join(["word"] * 10), metadata={"source": "a.md", "header_path": "Guide"})
+            for _ in range(10)]
+    pipeline = open_ai_func.make_pipeline(str(tmp_path), max_tokens=40)
+    result = open_ai_func.run_pipeline(pipeline, [docs], "packed")
+
+    # 10 tokens per section, 3 sections and 2 separators per chunk
+    assert result["chunks"] == 4
+    assert all(doc.metadata["header_path"] == "Guide" for doc in result["store"].docstore._dict.values())
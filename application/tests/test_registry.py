@@ -0,0 +1,100 @@
+import importlib.metadata
+import os
+import pickle
+from collections import defaultdict
+
+import pytest
+
+from parser.file.base_parser import BaseParser
+from parser.file.bulk import SimpleDirectoryReader
+from parser.file.registry import ParserRegistry
+
+
+class PidParser(BaseParser):
+    """Returns the process and the parser instance that parsed a file."""
+
+    created = 0
+
+    def __init__(self):
+        super().__init__()
+        PidParser.created += 1
+
+    def _init_parser(self):
+        return {}
+
+    def parse_file(self, file, errors="ignore"):
+        return f"{os.getpid()} {id(self)}"
+
+
+class EntryPoint:
+    """Stand-in for an importlib.metadata entry point."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def load(self):
+        return PidParser
+
+
+@pytest.fixture
+def entry_point_lookups(monkeypatch):
+    lookups = []
+
+    def entry_points(group=None):
+        lookups.append(group)
+        return [EntryPoint(".plugin")]
+
+    monkeypatch.setattr(importlib.metadata, "entry_points", entry_points)
+    return lookups
+
+
+def test_parsers_are_built_on_first_lookup_only():
+    PidParser.created = 0
+    registry = ParserRegistry({".x": PidParser}, load_entry_points=False)
+    assert ".x" in registry and PidParser.created == 0
+    assert registry[".x"] is registry[".x"]
+    assert PidParser.created == 1
+    with pytest.raises(KeyError):
+        registry[".y"]
+
+
+def test_entry_points_add_extensions(entry_point_lookups):
+    registry = ParserRegistry({".x": PidParser})
+    assert sorted(registry) == [".plugin", ".x"]
+    assert isinstance(registry[".plugin"], PidParser)
+    assert entry_point_lookups == ["docsgpt.parsers"]
+
+
+def test_registered_factories_take_precedence(entry_point_lookups):
+    class MyParser(PidParser):
+        pass
+
+    registry = ParserRegistry({})
+    registry.register(".plugin", MyParser)
+    assert isinstance(registry[".plugin"], MyParser)
+
+
+def test_pickled_registry_does_not_look_entry_points_up_again(entry_point_lookups):
+    # as sent to worker processes, before the reader looked anything up
+    data = pickle.dumps(ParserRegistry({".x": PidParser}))
+    assert entry_point_lookups == ["docsgpt.parsers"]
+
+    copy = pickle.loads(data)
+    assert ".plugin" in copy
+    assert entry_point_lookups == ["docsgpt.parsers"]
+
+
+def test_worker_processes_build_each_parser_once(tmp_path):
+    paths = []
+    for i in range(12):
+        (tmp_path / f"{i}.x").write_text("")
+        paths.append(str(tmp_path / f"{i}.x"))
+    registry = ParserRegistry({".x": "tests.test_registry:PidParser"}, load_entry_points=False)
+    reader = SimpleDirectoryReader(input_files=paths, file_extractor=registry, num_workers=2)
+
+    parsers = defaultdict(set)
+    for doc in reader.load_data():
+        pid, parser = doc.text.split()
+        parsers[pid].add(parser)
+    assert str(os.getpid()) not in parsers
+    assert all(len(instances) == 1 for instances in parsers.values())
@@ -0,0 +1,71 @@
+from parser.file.rst_parser import RstParser
+
+DOC = """=====
+Title
+=====
+
+intro text
+
+Install
+-------
+
+see `docs <http://x>`_ and :ref:`guide`.
+
+----------
+
+after transition
+
+Linux
+~~~~~
+
+apt     get
+
+Usage
+-----
+
+run
+"""
+
+
+def test_header_levels_follow_the_order_of_adornment_styles():
+    sections = RstParser().rst_to_sections(DOC)
+    assert [path for _, path, _ in sections] == [
+        ["Title"], ["Title", "Install"], ["Title", "Install", "Linux"], ["Title", "Usage"]]
+
+
+def test_transitions_are_not_headers():
+    sections = RstParser().rst_to_sections(DOC)
+    assert "after transition" in sections[1][2]
+
+
+def test_adornment_shorter_than_its_title_is_not_a_header():
+    assert RstParser().rst_to_tups("A long title\n---\n\ntext\n")[0][0] is None
+
+
+def test_cleanup_rules():
+    sections = dict(RstParser().rst_to_tups(DOC))
+    assert sections["Install"].startswith("\nsee docs and `guide`.")
+    assert sections["Linux"] == "\napt  get  "
+
+
+def test_cleanup_rules_can_be_disabled():
+    parser = RstParser(remove_hyperlinks=False, remove_interpreters=False, remove_whitespaces_excess=False)
+    assert "`docs <http://x>`_ and :ref:`guide`" in dict(parser.rst_to_tups(DOC))["Install"]
+
+
+def test_repeated_characters_are_shortened():
+    assert RstParser().rst_to_tups("aaaa!!!!! x\n") == [(None, "aaa!!! x")]
+
+
+def test_parse_file_returns_a_document_per_section(tmp_path):
+    path = tmp_path / "doc.rst"
+    path.write_text(DOC)
+    docs = RstParser().parse_file(path)
+    assert [doc.extra_info["header_path"] for doc in docs] == [
+        "Title", "Title > Install", "Title > Install > Linux", "Title > Usage"]
+    assert docs[0].text.startswith("\n\nTitle\n")
+
+
+def test_whitespaces_can_be_kept_while_shortening_characters():
+    parser = RstParser(remove_whitespaces_excess=False)
+    assert parser.rst_to_tups("aaaa    b\n") == [(None, "aaa    b")]
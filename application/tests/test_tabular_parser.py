@@ -0,0 +1,45 @@
+import pytest
+
+from parser.file.tabular_parser import PandasCSVParser
+
+CSV = "id,price,code\n1,10,007\n2,,010\n3,2.5,100\n"
+
+
+@pytest.fixture
+def csv_file(tmp_path):
+    path = tmp_path / "table.csv"
+    path.write_text(CSV)
+    return path
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 10000])
+def test_values_are_kept_as_written_whatever_the_chunk_size(csv_file, chunk_size):
+    rows = PandasCSVParser(concat_rows=False, chunk_size=chunk_size).parse_file(csv_file)
+    assert rows == ["1, 10, 007", "2, nan, 010", "3, 2.5, 100"]
+
+
+def test_rows_are_concatenated(csv_file):
+    assert PandasCSVParser().parse_file(csv_file) == "1, 10, 007\n2, nan, 010\n3, 2.5, 100"
+
+
+def test_header_prefix(csv_file):
+    rows = PandasCSVParser(concat_rows=False, header_prefix=True).parse_file(csv_file)
+    assert rows[0] == "id: 1, price: 10, code: 007"
+
+
+def test_pandas_config_can_set_types(csv_file):
+    rows = PandasCSVParser(concat_rows=False, pandas_config={"dtype": {"code": int}}).parse_file(csv_file)
+    # the other columns are inferred again, price has missing values and is read as floats
+    assert rows[0] == "1, 10.0, 7"
+
+
+def test_iter_rows_is_lazy(csv_file):
+    rows = PandasCSVParser(chunk_size=1).iter_rows(csv_file)
+    assert next(rows) == "1, 10, 007"
+
+
+def test_rows_are_grouped_by_tokens(csv_file):
+    # every row is 7 tokens with the joiner
+    docs = PandasCSVParser(max_tokens=15, chunk_size=2).parse_file(csv_file)
+    assert [(doc.extra_info["row_start"], doc.extra_info["row_end"]) for doc in docs] == [(0, 1), (2, 2)]
+    assert docs[0].text == "1, 10, 007\n2, nan, 010"
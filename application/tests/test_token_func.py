@@ -0,0 +1,139 @@
+import pytest
+
+from parser.schema.base import Document
+from parser.token_func import (count_tokens, group_documents, group_split, pack_documents, split_documents,
+                               split_text)
+
+
+def make_doc(words, source="a.md", **extra_info):
+    return Document(text=" ".join(f"w{i}" for i in range(words)), extra_info={"source": source, **extra_info})
+
+
+def test_token_count_is_memoized(byte_encoding, monkeypatch):
+    calls = []
+    encode = byte_encoding.encode
+    monkeypatch.setattr(byte_encoding, "encode", lambda text, **kwargs: calls.append(text) or encode(text))
+    doc = make_doc(5)
+
+    assert count_tokens(doc) == count_tokens(doc) == 5
+    assert len(calls) == 1
+
+
+def test_group_documents_encodes_every_document_once(byte_encoding, monkeypatch):
+    calls = []
+    encode = byte_encoding.encode
+    monkeypatch.setattr(byte_encoding, "encode", lambda text, **kwargs: calls.append(text) or encode(text))
+    docs = [make_doc(20) for _ in range(50)]
+
+    group_documents(docs, min_tokens=10, max_tokens=100)
+    assert len(calls) == 50
+
+
+def test_large_enough_documents_join_the_previous_group():
+    docs = [make_doc(30), make_doc(30), make_doc(30), make_doc(30)]
+    groups = group_documents(docs, min_tokens=10, max_tokens=100)
+    # 30 + 1 + 30 + 1 + 30 tokens, the fourth document would reach the limit
+    assert [count_tokens(group) for group in groups] == [92, 30]
+    assert groups[0].text == " ".join(doc.text for doc in docs[:3])
+
+
+def test_small_documents_start_a_new_group():
+    groups = group_documents([make_doc(30), make_doc(5), make_doc(30)], min_tokens=10, max_tokens=100)
+    assert [count_tokens(group) for group in groups] == [30, 36]
+
+
+def test_group_keeps_the_metadata_of_its_first_document():
+    groups = group_documents([make_doc(5, title="one"), make_doc(20, title="two")], min_tokens=10, max_tokens=100)
+    assert [group.extra_info["title"] for group in groups] == ["one"]
+
+
+def test_short_documents_are_not_split():
+    doc = make_doc(10)
+    assert split_documents([doc], max_tokens=10) == [doc]
+
+
+def test_split_repeats_the_header_and_bounds_every_part():
+    header = "Title\nsubtitle\nsection\n"
+    doc = Document(text=header + " ".join(f"w{i}" for i in range(100)), doc_id="d")
+    parts = split_documents([doc], max_tokens=20)
+
+    assert all(part.text.startswith(header) for part in parts)
+    assert all(count_tokens(part) <= 20 for part in parts)
+    body = " ".join(part.text[len(header):] for part in parts)
+    assert body == doc.text[len(header):]
+    assert [part.doc_id for part in parts[:2]] == ["d-0", "d-1"]
+
+
+def test_parts_share_overlap_tokens():
+    doc = Document(text=" ".join(f"w{i}" for i in range(30)))
+    parts = split_documents([doc], max_tokens=10, overlap_tokens=4)
+    assert parts[0].text.split()[-4:] == parts[1].text.split()[:4]
+    assert parts[-1].text.split()[-1] == "w29"
+
+
+@pytest.mark.parametrize("overlap", [10, 11])
+def test_overlap_must_be_smaller_than_max_tokens(overlap):
+    with pytest.raises(ValueError):
+        split_documents([make_doc(30)], max_tokens=10, overlap_tokens=overlap)
+    with pytest.raises(ValueError):
+        group_split([make_doc(30)], max_tokens=10, overlap_tokens=overlap)
+
+
+@pytest.mark.parametrize("overlap", [0, 3, 5])
+def test_windows_do_not_cut_multibyte_characters(overlap):
+    # every dinosaur is 4 byte tokens, windows of 10 tokens would cut them
+    doc = Document(text="🦖" * 30)
+    parts = split_documents([doc], max_tokens=10, overlap_tokens=overlap)
+
+    assert all(set(part.text) == {"🦖"} for part in parts)
+    assert all(count_tokens(part) <= 10 for part in parts)
+    if overlap == 0:
+        assert "".join(part.text for part in parts) == doc.text
+
+
+def test_split_text_keeps_multibyte_characters():
+    text = "ab🦖" * 20
+    parts = split_text(text, max_tokens=7)
+    assert "".join(parts) == text
+
+
+def section(words, header_path="Guide", source="a.md"):
+    return make_doc(words, source=source, header_path=header_path)
+
+
+def test_sections_are_packed_in_order():
+    docs = [section(30), section(50), section(30), section(10)]
+    packed = pack_documents(docs, max_tokens=100)
+    # next-fit: the 10 token section is not moved back into the first chunk
+    assert [count_tokens(chunk) for chunk in packed] == [81, 41]
+    assert "\n".join(chunk.text for chunk in packed) == "\n".join(doc.text for doc in docs)
+
+
+def test_packing_starts_a_chunk_at_every_file():
+    packed = pack_documents([section(10, source="a.md"), section(10, source="b.md")], max_tokens=100)
+    assert [chunk.extra_info["source"] for chunk in packed] == ["a.md", "b.md"]
+
+
+def test_packing_starts_a_chunk_at_every_top_level_header():
+    docs = [section(10, "Install"), section(10, "Install > Linux"), section(10, "Usage"), section(10, "Usage > CLI")]
+    assert [chunk.extra_info["header_path"] for chunk in pack_documents(docs, 100)] == ["Install", "Usage"]
+    assert len(pack_documents(docs, 100, header_level=None)) == 4
+
+
+def test_long_sections_are_left_for_splitting():
+    packed = pack_documents([section(10), section(200), section(10)], max_tokens=100)
+    assert [count_tokens(chunk) for chunk in packed] == [10, 200, 10]
+    parts = group_split([section(10), section(200), section(10)], max_tokens=100, grouping="pack")
+    assert all(count_tokens(part) <= 100 for part in parts)
+
+
+def test_chunks_have_metadata_of_their_own():
+    doc = make_doc(30)
+    parts = split_documents([doc], max_tokens=10)
+    sections = [make_doc(2), make_doc(2)]
+    packed = pack_documents(sections, max_tokens=10)
+    assert len(parts) > 1
+    parts[0].extra_info["changed"] = True
+    assert all("changed" not in info for info in [doc.extra_info] + [part.extra_info for part in parts[1:]])
+    assert packed[0].extra_info == sections[0].extra_info
+    assert packed[0].extra_info is not sections[0].extra_info
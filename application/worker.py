@@ -5,15 +5,24 @@ import os
 
 from parser.file.bulk import SimpleDirectoryReader
 from parser.schema.base import Document
-from parser.open_ai_func import call_openai_api
+from parser.embedding_cache import text_hash
+from parser.open_ai_func import INDEX_SHARD_SIZE, INDEX_SHARDS, make_pipeline, run_pipeline, save_store
+from parser.index_factory import INDEX_PARAMS_FILE, VECTORS_FILE, to_flat
+from parser.index_shards import SHARDS_FILE, ShardLayout, add_to_shards, new_version, shard_path
+from parser.index_manifest import IndexManifest, MANIFEST_FILE, remove_vectors, source_hashes
 from parser.token_func import group_split
 from celery import current_task
+from langchain.vectorstores import FAISS
+from langchain.embeddings import OpenAIEmbeddings
 # from pymongo import MongoClient # MongoDB Database connector
 
 import string
 import zipfile
 import shutil
 
+# Number of processes parsing files during ingestion.
+INGEST_PARSE_WORKERS = int(os.getenv("INGEST_PARSE_WORKERS", "4"))
+
 try:
     nltk.download('punkt', quiet=True)
     nltk.download('averaged_perceptron_tagger', quiet=True)
@@ -25,7 +34,81 @@ def generate_random_string(length):
     return ''.join([string.ascii_letters[i % 52] for i in range(length)])
 
 
-def ingest_worker(self, directory, formats, name_job, filename, user):
+def download_index_file(user, name_job, folder, name, shard=None):
+    """Download a file of the current index of a job, or of one of its shards, into folder.
+
+    Returns whether the file exists.
+    """
+    url = os.environ.get('API_URL') + '/api/download_index'
+    params = {'user': user, 'name': name_job, 'file': name}
+    if shard is not None:
+        params['shard'] = shard
+    response = requests.get(url, params=params)
+    if response.status_code != 200:
+        return False
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, name), 'wb') as f:
+        f.write(response.content)
+    return True
+
+
+def download_previous_index(user, name_job, full_path):
+    """Download the manifest of the current index of a job into full_path, with the index or its shard layout.
+
+    Returns the manifest, or None if the job has no index with a manifest yet,
+    and the shard layout, or None if the index is not sharded. Shards are only
+    downloaded when they need to be rebuilt, see open_shard.
+    """
+    if not download_index_file(user, name_job, full_path, MANIFEST_FILE):
+        return None, None
+    if download_index_file(user, name_job, full_path, SHARDS_FILE):
+        return IndexManifest.load(full_path), ShardLayout.load(full_path)
+    for name in ('index.faiss', 'index.pkl'):
+        if not download_index_file(user, name_job, full_path, name):
+            return None, None
+    # full precision vectors of a compressed index, if it has them
+    download_index_file(user, name_job, full_path, VECTORS_FILE)
+    return IndexManifest.load(full_path), None
+
+
+def open_shard(user, name_job, full_path, shard):
+    """Download a shard of the current index of a job and load it as a flat store.
+
+    Returns None for a shard the index does not have yet.
+    """
+    folder = shard_path(full_path, shard)
+    for name in ('index.faiss', 'index.pkl'):
+        if not download_index_file(user, name_job, folder, name, shard):
+            return None
+    download_index_file(user, name_job, folder, VECTORS_FILE, shard)
+    store = FAISS.load_local(folder, OpenAIEmbeddings(openai_api_key=os.getenv("EMBEDDINGS_KEY")))
+    store.index = to_flat(store.index, folder)
+    return store
+
+
+def upload_index(user, name_job, folder, shard=None, extra_files=(), version=None):
+    """Upload the index saved in folder, as a shard of version of the index of the job with shard.
+
+    extra_files are (form field, path) pairs of other files to send along.
+    """
+    url = os.environ.get('API_URL') + '/api/upload_index'
+    data = {'name': name_job, 'user': user}
+    if shard is not None:
+        data['shard'] = shard
+        data['shard_version'] = version
+    names = {'file_faiss': 'index.faiss', 'file_pkl': 'index.pkl', 'file_params': INDEX_PARAMS_FILE,
+             'file_vectors': VECTORS_FILE}
+    paths = [(field, os.path.join(folder, name)) for field, name in names.items()] + list(extra_files)
+    # vectors.npy is only saved with compressed indexes
+    files = {field: open(path, 'rb') for field, path in paths if os.path.exists(path)}
+    try:
+        return requests.post(url, files=files, data=data)
+    finally:
+        for f in files.values():
+            f.close()
+
+
+def ingest_worker(self, directory, formats, name_job, filename, user, incremental=False):
     # directory = 'inputs' or 'temp'
     # formats = [".rst", ".md"]
     input_files = None
@@ -68,13 +151,86 @@ def ingest_worker(self, directory, formats, name_job, filename, user):
 
     # docs = [Document.to_langchain_format(raw_doc) for raw_doc in raw_docs]
 
-    from langchain.document_loaders import DirectoryLoader
-    from langchain.document_loaders import BSHTMLLoader
-    loader = DirectoryLoader(full_path, glob="**/*.html",
-                             loader_cls=BSHTMLLoader, silent_errors=True)
-    docs = loader.load()
+    # source file (relative to full_path) -> content hash
+    hashes = source_hashes(full_path, formats)
 
-    call_openai_api(docs, full_path, self)
+    store = None
+    manifest = None
+    layout = None
+    # shard -> flat store, for the shards being rebuilt
+    shards = {}
+    if incremental:
+        manifest, layout = download_previous_index(user, name_job, full_path)
+    if manifest is not None:
+        # only parse and embed files that changed since the previous upload
+        to_embed, stale = manifest.diff(hashes)
+        print(f'incremental update: {len(to_embed)} files to embed, {len(stale)} files to remove')
+        sharded = layout is not None
+        if sharded:
+            # only the shards holding changed files are downloaded and rebuilt
+            for path in stale:
+                ids = manifest.stale_ids([path])
+                shard = layout.remove(path, len(ids))
+                if shard not in shards:
+                    shards[shard] = open_shard(user, name_job, full_path, shard)
+                # a shard the index does not have holds no vectors to remove
+                if shards[shard] is not None:
+                    remove_vectors(shards[shard], ids)
+        else:
+            store = FAISS.load_local(full_path, OpenAIEmbeddings(openai_api_key=os.getenv("EMBEDDINGS_KEY")))
+            # IVF and HNSW indexes are converted back to flat to remove vectors, and rebuilt when saved
+            store.index = to_flat(store.index, full_path)
+            remove_vectors(store, manifest.stale_ids(stale))
+        for path in stale:
+            manifest.remove(path)
+    else:
+        manifest = IndexManifest()
+        to_embed = sorted(hashes)
+        sharded = INDEX_SHARDS > 1 or INDEX_SHARD_SIZE > 0
+
+    embedding_stats = {'reused': 0, 'embedded': 0, 'ids_by_source': {}, 'store': None}
+    if to_embed:
+        # files are parsed while the chunks of the previous ones are embedded
+        reader = SimpleDirectoryReader(input_files=[os.path.join(full_path, path) for path in to_embed],
+                                       num_workers=INGEST_PARSE_WORKERS,
+                                       file_metadata=lambda path: {'source': path})
+        files = ([doc.to_langchain_format() for doc in docs] for docs in reader.iter_data())
+        fingerprint = text_hash("".join(f"{path}\0{hashes[path]}" for path in to_embed))
+        # small sections of a file are packed into chunks of up to max_tokens
+        pipeline = make_pipeline(full_path, self, store=store, save=not sharded,
+                                 max_tokens=max_tokens if token_check else None)
+        embedding_stats = run_pipeline(pipeline, files, fingerprint, total_files=len(to_embed))
+    elif store is not None:
+        # nothing new to embed, the store only lost the vectors of removed files
+        save_store(store, full_path)
+    if sharded:
+        ids_by_path = {os.path.relpath(source, full_path): ids
+                       for source, ids in embedding_stats['ids_by_source'].items()}
+        shard_ids = {}
+        if layout is None:
+            layout = ShardLayout.create(sum(len(ids) for ids in ids_by_path.values()), INDEX_SHARDS, INDEX_SHARD_SIZE)
+            # a new index has all its shards, even those no file is assigned to
+            shard_ids = {shard: [] for shard in range(layout.num_shards)}
+            shards = dict.fromkeys(shard_ids)
+        # largest files first, which balances shards filled by size
+        for path in sorted(ids_by_path, key=lambda path: len(ids_by_path[path]), reverse=True):
+            shard = layout.assign(path, len(ids_by_path[path]))
+            if shard not in shards:
+                shards[shard] = open_shard(user, name_job, full_path, shard)
+            shard_ids.setdefault(shard, []).extend(ids_by_path[path])
+        if embedding_stats['store'] is not None:
+            add_to_shards(embedding_stats['store'], shard_ids, shards)
+        # shards nothing was embedded for or downloaded have no store, there is nothing to save
+        shards = {shard: shard_store for shard, shard_store in shards.items() if shard_store is not None}
+        for shard, shard_store in shards.items():
+            save_store(shard_store, shard_path(full_path, shard))
+        # the rebuilt shards are uploaded as a new version, the app links the others into it
+        layout.version = new_version()
+        layout.save(full_path)
+    for source, ids in embedding_stats['ids_by_source'].items():
+        path = os.path.relpath(source, full_path)
+        manifest.update(path, hashes[path], ids)
+    manifest.save(full_path)
     self.update_state(state='PROGRESS', meta={'current': 100})
 
     # if sample == True:
@@ -83,11 +239,16 @@ def ingest_worker(self, directory, formats, name_job, filename, user):
 
     # get files from outputs/inputs/index.faiss and outputs/inputs/index.pkl
     # and send them to the server (provide user and name in form)
-    url = os.environ.get('API_URL') + '/api/upload_index'
-    file_data = {'name': name_job, 'user': user}
-    with open(full_path + '/index.faiss', 'rb') as file_faiss, open(full_path + '/index.pkl', 'rb') as file_pkl:
-        files = {'file_faiss': file_faiss, 'file_pkl': file_pkl}
-        response = requests.post(url, files=files, data=file_data)
+    manifest_file = ('file_manifest', os.path.join(full_path, MANIFEST_FILE))
+    if sharded:
+        # the layout is sent with the last shard, the app switches to the new version once it has them all
+        for i, shard in enumerate(sorted(shards)):
+            last = i == len(shards) - 1
+            upload_index(user, name_job, shard_path(full_path, shard), shard,
+                         [manifest_file, ('file_shards', os.path.join(full_path, SHARDS_FILE))] if last else [],
+                         version=layout.version)
+    else:
+        upload_index(user, name_job, full_path, extra_files=[manifest_file])
 
     url = os.environ.get('API_URL') + '/api/delete_old?path=' + \
         'inputs/' + user + '/' + name_job
@@ -95,4 +256,5 @@ def ingest_worker(self, directory, formats, name_job, filename, user):
     # delete local
     shutil.rmtree(full_path)
 
-    return {'directory': directory, 'formats': formats, 'name_job': name_job, 'filename': filename, 'user': user, 'limited': False}
+    return {'directory': directory, 'formats': formats, 'name_job': name_job, 'filename': filename, 'user': user, 'limited': False,
+            'chunks_reused': embedding_stats['reused'], 'chunks_embedded': embedding_stats['embedded']}